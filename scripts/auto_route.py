@@ -0,0 +1,260 @@
+import math
+import numpy as np
+from clearance import distance_field
+
+SQRT2 = math.sqrt(2)
+BLOCKED = math.inf
+CHUNK_ROWS = 1024   # [px] rows of the map converted to occupancy at once
+TOLERANCE = 1e-6    # relative change of a cost below the rounding of the row passes
+# length of the 8 moves around a cell, as a 3x3 block centered on it
+STEPS = np.array([[SQRT2, 1.0, SQRT2],
+                  [1.0, 0.0, 1.0],
+                  [SQRT2, 1.0, SQRT2]])
+
+# NOTE: planning runs on a coarse grid (cell_size map pixels per cell), a cell is occupied
+# if any of its pixels is, cells closer than inflation_radius to an occupied cell are blocked
+# and cells closer than cost_radius cost up to 1 + cost_weight, so routes keep away from walls
+# occupancy(y_min, y_max, x_min, x_max) returns the occupied pixels of a window of the map
+class CostMap():
+    def __init__(self, occupancy, shape, cell_size, inflation_radius, cost_radius, cost_weight):
+        h_p, w_p = shape
+        self.cell_size = cell_size
+        h, w = -(-h_p // cell_size), -(-w_p // cell_size)
+        occupied = np.zeros((h, w), dtype=bool)
+        for y_min in range(0, h_p, CHUNK_ROWS):
+            y_max = min(y_min + CHUNK_ROWS, h_p)
+            chunk = occupancy(y_min, y_max, 0, w_p)
+            chunk = np.pad(chunk, ((0, -(y_max - y_min) % cell_size), (0, -w_p % cell_size)))
+            rows = chunk.shape[0] // cell_size
+            blocks = chunk.reshape(rows, cell_size, w, cell_size).any(axis=(1, 3))
+            occupied[y_min // cell_size:y_min // cell_size + rows] |= blocks
+
+        # radii are in cells, an obstacle may be half a cell diagonal closer than its cell center
+        inflation_radius += SQRT2 / 2
+        distance = distance_field(occupied, max(cost_radius, inflation_radius))
+        cost = 1 + cost_weight * np.clip(cost_radius - distance, 0, None) / max(cost_radius, 1e-9)
+        cost[distance < inflation_radius] = BLOCKED
+        self.cost = cost
+
+    def cell_of(self, x_p, y_p):
+        h, w = self.cost.shape
+        cx = min(max(int(x_p // self.cell_size), 0), w - 1)
+        cy = min(max(int(y_p // self.cell_size), 0), h - 1)
+        return cx, cy
+
+    # collision-free polyline from start to goal (scene pixels) or None,
+    # the search window grows until a route is found or it covers the whole map
+    def plan(self, start, goal, margin):
+        h, w = self.cost.shape
+        sx, sy = self.cell_of(*start)
+        gx, gy = self.cell_of(*goal)
+        # a straight route needs no search
+        if self.is_visible((sx, sy), (gx, gy)):
+            return [start, goal]
+
+        margin = max(int(margin), 1)
+        while True:
+            x_min, x_max = max(min(sx, gx) - margin, 0), min(max(sx, gx) + margin + 1, w)
+            y_min, y_max = max(min(sy, gy) - margin, 0), min(max(sy, gy) + margin + 1, h)
+            cells = self.search(x_min, y_min, x_max, y_max, (sx, sy), (gx, gy))
+            if cells is not None:
+                break
+            if x_min == 0 and y_min == 0 and x_max == w and y_max == h:
+                return None
+            margin *= 2
+
+        cells = self.simplify(cells)
+        # cell centers in scene pixels, the ends are the exact start and goal
+        points = [((cx + 0.5) * self.cell_size, (cy + 0.5) * self.cell_size) for cx, cy in cells]
+        points[0] = start
+        points[-1] = goal
+        return points
+
+    # cheapest route in the window [x_min, x_max) x [y_min, y_max) with 8-connected moves:
+    # the cost to the goal of every cell (cost_to_go) then steepest descent from the start
+    # NOTE: the window gets a blocked border, so the descent has no bounds checks
+    def search(self, x_min, y_min, x_max, y_max, start, goal):
+        window = np.pad(self.cost[y_min:y_max, x_min:x_max], 1, constant_values=BLOCKED)
+        sx, sy = start[0] - x_min + 1, start[1] - y_min + 1
+        gx, gy = goal[0] - x_min + 1, goal[1] - y_min + 1
+        # the ends may lie in the inflated area (e.g. a node next to a wall)
+        window[sy, sx] = 1.0
+        window[gy, gx] = 1.0
+        if not is_connected(np.isfinite(window), (sx, sy), (gx, gy)):
+            return None
+
+        # the rows are swept one by one, so they run along the longer side of the window
+        if window.shape[0] > window.shape[1]:
+            costs = cost_to_go(np.ascontiguousarray(window.T), (gy, gx)).T
+        else:
+            costs = cost_to_go(window, (gx, gy))
+
+        # each step goes to the neighbor through which the cost to the goal is the lowest,
+        # which is always lower than the current one as a step costs at least 1
+        cells = [(sx, sy)]
+        x, y = sx, sy
+        while (x, y) != (gx, gy):
+            steps = STEPS * (window[y - 1:y + 2, x - 1:x + 2] + window[y, x]) / 2
+            neighbors = costs[y - 1:y + 2, x - 1:x + 2] + steps
+            neighbors[1, 1] = BLOCKED
+            dy, dx = divmod(int(np.argmin(neighbors)), 3)
+            x, y = x + dx - 1, y + dy - 1
+            cells.append((x, y))
+        return [(cx - 1 + x_min, cy - 1 + y_min) for cx, cy in cells]
+
+    # keep only the cells needed so that consecutive ones see each other
+    # NOTE: the furthest cell seen from the last kept one is found by doubling the step
+    # then bisecting, so a long route needs a few visibility checks per kept cell
+    def simplify(self, cells):
+        simplified = [cells[0]]
+        i = 0
+        last = len(cells) - 1
+        while i < last:
+            # neighboring cells always see each other
+            seen, unseen = i + 1, None
+            step = 2
+            while seen < last:
+                j = min(i + step, last)
+                if not self.is_visible(cells[i], cells[j]):
+                    unseen = j
+                    break
+                seen = j
+                step *= 2
+            while unseen is not None and unseen - seen > 1:
+                j = (seen + unseen) // 2
+                if self.is_visible(cells[i], cells[j]):
+                    seen = j
+                else:
+                    unseen = j
+            simplified.append(cells[seen])
+            i = seen
+        return simplified
+
+    # True if the segment between the centers of the cells a and b crosses no blocked cell
+    # NOTE: the cells crossed are sampled once between each two consecutive crossings of a cell border,
+    # a segment only touching the corner of a cell does not cross it (like a diagonal step)
+    def is_visible(self, a, b):
+        dx, dy = b[0] - a[0], b[1] - a[1]
+        # borders are half way between cell centers
+        t = np.concatenate([[0.0, 1.0],
+                            (np.arange(abs(dx)) + 0.5) / max(abs(dx), 1),
+                            (np.arange(abs(dy)) + 0.5) / max(abs(dy), 1)])
+        t = np.unique(t)
+        t = (t[:-1] + t[1:]) / 2
+        x = np.floor(a[0] + t * dx + 0.5).astype(np.int64)
+        y = np.floor(a[1] + t * dy + 0.5).astype(np.int64)
+        return bool(np.isfinite(self.cost[y, x]).all())
+
+# True if the cells a and b (x, y) are 8-connected through the True cells of free
+# NOTE: the True cells are split into runs along the rows and the runs of consecutive rows
+# that touch (diagonally too) are merged with a union-find, there are far fewer runs than cells,
+# so a window without route is rejected before the costs are computed
+def is_connected(free, a, b):
+    h, w = free.shape
+    edges = np.diff(free.astype(np.int8), axis=1, prepend=0, append=0)
+    run_y, run_start = np.nonzero(edges == 1)
+    run_end = np.nonzero(edges == -1)[1]
+    # runs are sorted by row then column, so they are found by these keys
+    key_start = run_y * (w + 1) + run_start
+    key_end = run_y * (w + 1) + run_end
+    # the runs of the row above touching each run are [lo, hi)
+    lo = np.searchsorted(key_end, (run_y - 1) * (w + 1) + run_start)
+    hi = np.searchsorted(key_start, (run_y - 1) * (w + 1) + run_end, side="right")
+    counts = np.maximum(hi - lo, 0)
+    first = np.repeat(lo - np.cumsum(counts) + counts, counts)
+    above = (first + np.arange(counts.sum())).tolist()
+    below = np.repeat(np.arange(len(run_y)), counts).tolist()
+
+    parent = list(range(len(run_y)))
+    for u, v in zip(below, above):
+        u = find_root(parent, u)
+        v = find_root(parent, v)
+        if u != v:
+            parent[u] = v
+    run_a = int(np.searchsorted(key_start, a[1] * (w + 1) + a[0], side="right")) - 1
+    run_b = int(np.searchsorted(key_start, b[1] * (w + 1) + b[0], side="right")) - 1
+    return find_root(parent, run_a) == find_root(parent, run_b)
+
+def find_root(parent, u):
+    while parent[u] != u:
+        parent[u] = parent[parent[u]]
+        u = parent[u]
+    return u
+
+# cost of the cheapest 8-connected route from each cell of cost (inf where blocked) to goal (x, y),
+# a step costs its length times the mean cost of its two cells (inf where there is no route)
+# NOTE: this is a fast sweeping method: the rows are relaxed one by one from the row above
+# (downward sweep) or below (upward sweep) and every changed row is then relaxed along itself
+# in one pass per direction, the sweeps alternate until no row changes
+# (a route needs one more sweep for each time it turns back vertically)
+# NOTE: a pass along a row is d[x] = min(d[x], d[x - 1] + step[x - 1]), that is
+# min over k <= x of (d[k] - prefix[k]) + prefix[x] with the prefix sums of the steps,
+# a blocked step costs barrier, twice the cost of the longest possible route (each free cell once),
+# so that no route goes through it (BLOCKED again after the pass), being no larger than needed
+# it keeps the rounding of the prefix sums small
+def cost_to_go(cost, goal):
+    h, w = cost.shape
+    free = np.isfinite(cost)
+    barrier = 2 * SQRT2 * np.count_nonzero(free) * cost[free].max(initial=1.0)
+    vertical = (cost[:-1] + cost[1:]) / 2                   # (x, y) - (x, y + 1)
+    diagonal_r = SQRT2 * (cost[:-1, :-1] + cost[1:, 1:]) / 2  # (x, y) - (x + 1, y + 1)
+    diagonal_l = SQRT2 * (cost[:-1, 1:] + cost[1:, :-1]) / 2  # (x + 1, y) - (x, y + 1)
+    horizontal = (cost[:, :-1] + cost[:, 1:]) / 2             # (x, y) - (x + 1, y)
+    horizontal[np.isinf(horizontal)] = barrier
+    forward = np.zeros((h, w))
+    np.cumsum(horizontal, axis=1, out=forward[:, 1:])
+    del horizontal
+
+    d = np.full((h, w), BLOCKED)
+    gx, gy = goal
+    d[gy, gx] = 0.0
+    relax_row(d[gy], forward[gy], barrier)
+    # rows changed since they relaxed the row below (pending_down) or above (pending_up)
+    pending_down = np.zeros(h, dtype=bool)
+    pending_up = np.zeros(h, dtype=bool)
+    pending_down[gy] = pending_up[gy] = True
+    while pending_down.any() or pending_up.any():
+        for y in range(int(np.argmax(pending_down)) + 1, h):
+            if not pending_down[y - 1]:
+                continue
+            pending_down[y - 1] = False
+            if relax_step(d[y], d[y - 1], vertical[y - 1], diagonal_r[y - 1], diagonal_l[y - 1],
+                          forward[y], barrier):
+                pending_down[y] = pending_up[y] = True
+        # the last row has no row below, the first none above
+        pending_down[-1] = False
+        for y in range(h - 1 - int(np.argmax(pending_up[::-1])) - 1, -1, -1):
+            if not pending_up[y + 1]:
+                continue
+            pending_up[y + 1] = False
+            if relax_step(d[y], d[y + 1], vertical[y], diagonal_l[y], diagonal_r[y],
+                          forward[y], barrier):
+                pending_down[y] = pending_up[y] = True
+        pending_up[0] = False
+    return d
+
+# relax row from the adjacent row prev, diagonal_a is the step from x - 1 of prev to x of row
+# and diagonal_b the one from x + 1, returns True if a cost decreased noticeably
+def relax_step(row, prev, vertical, diagonal_a, diagonal_b, forward, barrier):
+    candidate = prev + vertical
+    np.minimum(candidate[1:], prev[:-1] + diagonal_a, out=candidate[1:])
+    np.minimum(candidate[:-1], prev[1:] + diagonal_b, out=candidate[:-1])
+    if not (candidate < row * (1 - TOLERANCE)).any():
+        return False
+    np.minimum(row, candidate, out=row)
+    relax_row(row, forward, barrier)
+    return True
+
+# passes along the row left to right then right to left (in place),
+# the costs reached only through a blocked step are back to BLOCKED
+def relax_row(row, forward, barrier):
+    rest = row - forward
+    np.minimum.accumulate(rest, out=rest)
+    rest += forward
+    np.minimum(row, rest, out=row)
+    backward = forward[-1] - forward
+    rest = row - backward
+    rest = np.minimum.accumulate(rest[::-1])[::-1]
+    rest += backward
+    np.minimum(row, rest, out=row)
+    row[row >= barrier / 2] = BLOCKED
@@ -0,0 +1,395 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import yaml
+
+# usage: python3 benchmark.py [--map-sizes 1000 5000 10000] [--nodes 1000 10000 100000]
+#                             [--scene-nodes 1000 10000 100000] [--render-modes items batched]
+#                             [--route-map-sizes 2000 8000]
+#                             [--output results.json] [--compare baseline.json]
+# NOTE: run from the scripts directory like main.py,
+# the GUI benchmarks use the offscreen platform unless QT_QPA_PLATFORM is set
+# NOTE: times are in the unit of the key suffix (_s, _ms, _us), the best of a few repeats
+# for the cheap operations and a single run for the expensive ones
+
+WALL_INTERVAL = 50      # [px] rows between the synthetic walls
+WALL_THICKNESS = 8      # [px] wall of the auto-route map
+GAP_WIDTH = 100         # [px] gap at the end of that wall
+N_HIT_TESTS = 2000
+N_SWITCHES = 200
+
+# a random walk inside the map (reflected at its border), same schema as path/*.yaml
+def synthetic_elements(n_nodes, seed=0, extent=None):
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 0.5, size=(n_nodes, 2))
+    xy = np.cumsum(steps, axis=0)
+    if extent is not None:
+        x_min, y_min, x_max, y_max = extent
+        size = np.array([x_max - x_min, y_max - y_min])
+        # reflect into [0, size) (triangle wave with period 2 * size)
+        xy = np.abs((xy + size / 2) % (2 * size) - size) + np.array([x_min, y_min])
+    directions = np.where(rng.random(n_nodes) < 0.8, "head", "keep")
+    nodes = [{
+        "id": i,
+        "pose": {
+            "direction": str(direction),
+            "x": float(x),
+            "y": float(y)
+        },
+        "type": 1
+    } for i, ((x, y), direction) in enumerate(zip(xy, directions))]
+    return {"OCC_MAP_NAME": "map.yaml", "NODE": nodes}
+
+# free map with a horizontal wall every WALL_INTERVAL rows, written as map_<w>x<h>.{pgm,yaml}
+def write_synthetic_map(work_dir, width=1000, height=1000, resolution=0.05):
+    map_np = np.full((height, width), 254, dtype=np.uint8)
+    map_np[::WALL_INTERVAL, :] = 0
+    return write_map(work_dir, f"map_{width}x{height}", map_np, resolution)
+
+# free map split by one horizontal wall with a gap of GAP_WIDTH at its right end,
+# written as route_<w>x<h>.{pgm,yaml}, a route across it has to go around the whole wall
+def write_wall_gap_map(work_dir, width=1000, height=1000, resolution=0.05):
+    map_np = np.full((height, width), 254, dtype=np.uint8)
+    map_np[height // 2:height // 2 + WALL_THICKNESS, :width - GAP_WIDTH] = 0
+    return write_map(work_dir, f"route_{width}x{height}", map_np, resolution)
+
+def write_map(work_dir, name, map_np, resolution):
+    height, width = map_np.shape
+    map_pgm_path = os.path.join(work_dir, name + ".pgm")
+    map_yaml_path = os.path.join(work_dir, name + ".yaml")
+    if os.path.exists(map_yaml_path):
+        return map_yaml_path
+
+    with open(map_pgm_path, "wb") as file:
+        file.write(f"P5\n{width} {height}\n255\n".encode())
+        file.write(map_np.tobytes())
+    map_info = {
+        "image": name + ".pgm",
+        "resolution": resolution,
+        "origin": [-width * resolution / 2, -height * resolution / 2, 0.0],
+        "negate": 0,
+        "occupied_thresh": 0.65,
+        "free_thresh": 0.196
+    }
+    with open(map_yaml_path, "w") as file:
+        yaml.dump(map_info, file)
+    return map_yaml_path
+
+def write_synthetic_elements(work_dir, n_nodes, map_yaml_path):
+    from data_utils import YamlDumper
+    from map_utils import read_pgm
+    with open(map_yaml_path, "r") as file:
+        map_info = yaml.safe_load(file)
+    pgm = read_pgm(os.path.join(os.path.dirname(map_yaml_path), map_info["image"]))
+    resolution = map_info["resolution"]
+    x_min, y_min = map_info["origin"][:2]
+    # keep a margin of one meter to the border
+    extent = (x_min + 1, y_min + 1, x_min + pgm.width * resolution - 1, y_min + pgm.height * resolution - 1)
+    elements = synthetic_elements(n_nodes, extent=extent)
+    elements["OCC_MAP_NAME"] = map_yaml_path
+    elements_path = os.path.join(work_dir, f"elements_{n_nodes}.yaml")
+    with open(elements_path, "w") as file:
+        yaml.dump(elements, file, Dumper=YamlDumper)
+    return elements_path
+
+def create_main_window():
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    from main_window import MainWindow
+    from log_utils import setup_logging
+    app = QApplication.instance() or QApplication(sys.argv)
+    main_window = MainWindow(os.path.dirname(os.getcwd()))
+    # rendering needs the real viewport size
+    main_window.show()
+    app.processEvents()
+    # the per-operation messages would dominate the output
+    setup_logging({"level": "WARNING", "buffer_level": "WARNING", "buffer_size": 1000})
+    # every decode is a real decode unless a benchmark passes its own cache
+    main_window.setting_manager.stgs["map_manager"]["map_cache"]["enabled"] = False
+    main_window.map_manager.map_cache = None
+    return app, main_window
+
+def timeit(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def bench_yaml(n_nodes, work_dir):
+    from data_utils import YamlLoader, YamlDumper
+    elements = synthetic_elements(n_nodes)
+    path = os.path.join(work_dir, f"yaml_{n_nodes}.yaml")
+    with open(path, "w") as file:
+        yaml.dump(elements, file, Dumper=YamlDumper)
+
+    def load(loader):
+        with open(path, "r") as file:
+            yaml.load(file, Loader=loader)
+
+    def dump(dumper):
+        with open(path + ".out", "w") as file:
+            yaml.dump(elements, file, Dumper=dumper)
+
+    results = {
+        "yaml_load_python_s": timeit(lambda: load(yaml.SafeLoader), repeat=1),
+        "yaml_dump_python_s": timeit(lambda: dump(yaml.Dumper), repeat=1),
+        "yaml_load_fast_s": timeit(lambda: load(YamlLoader)),
+        "yaml_dump_fast_s": timeit(lambda: dump(YamlDumper))
+    }
+    return results
+
+# map decode (read + threshold) without and with the on-disk map cache
+def bench_map(main_window, map_size, work_dir):
+    from map_utils import MapCache
+    map_manager = main_window.map_manager
+    map_yaml_path = write_synthetic_map(work_dir, map_size, map_size)
+    results = {"map_decode_s": timeit(lambda: map_manager.read_map(map_yaml_path))}
+
+    cache_dir = os.path.join(work_dir, "map_cache")
+    map_manager.map_cache = MapCache(cache_dir)
+    map_manager.read_map(map_yaml_path)
+    # a new cache instance has an empty memory cache, so the raster comes from disk
+    def decode_cached():
+        map_manager.map_cache = MapCache(cache_dir)
+        map_manager.read_map(map_yaml_path)
+    results["map_decode_cached_s"] = timeit(decode_cached)
+    map_manager.map_cache = None
+    return results
+
+# one drag step is one model and scene update (at most one per frame while dragging)
+def bench_drag(map_manager, n_steps=200):
+    from PyQt5.QtCore import QPointF
+    from data_utils import Element
+    n_nodes = len(map_manager.nodes)
+    results = {}
+    for name, row in (("first", 0), ("middle", n_nodes // 2), ("last", n_nodes - 1)):
+        element = Element(map_manager, "NODE", map_manager.nodes.get("id", row))
+        x_p = map_manager.nodes.get("x_p", row)
+        y_p = map_manager.nodes.get("y_p", row)
+        points = [QPointF(x_p + 10 * math.cos(i / 10), y_p + 10 * math.sin(i / 10)) for i in range(n_steps)]
+        start = time.perf_counter()
+        for point in points:
+            map_manager.move_element(element, point)
+        results[f"drag_step_{name}_ms"] = (time.perf_counter() - start) / n_steps * 1000
+        map_manager.move_element(element, points[-1], finalize=True)
+    return results
+
+# half of the queries hit a node, the other half are anywhere on the map
+def bench_hit_test(map_manager, seed=0):
+    from PyQt5.QtCore import QPointF
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(map_manager.nodes), N_HIT_TESTS // 2)
+    x_p = np.concatenate([map_manager.nodes["x_p"][rows], rng.uniform(0, map_manager.w_p, N_HIT_TESTS // 2)])
+    y_p = np.concatenate([map_manager.nodes["y_p"][rows], rng.uniform(0, map_manager.h_p, N_HIT_TESTS // 2)])
+    points = [QPointF(x, y) for x, y in zip(x_p.tolist(), y_p.tolist())]
+
+    def query():
+        for point in points:
+            map_manager.get_clicked_element(point)
+    return {"hit_test_us": timeit(query) / len(points) * 1e6}
+
+def bench_direction(map_manager, seed=0):
+    from data_utils import Element
+    rng = np.random.default_rng(seed)
+    ids = map_manager.nodes["id"][rng.integers(0, len(map_manager.nodes), N_SWITCHES)].tolist()
+    start = time.perf_counter()
+    for node_id in ids:
+        map_manager.switch_node_direction(Element(map_manager, "NODE", node_id))
+    results = {"switch_direction_ms": (time.perf_counter() - start) / len(ids) * 1000}
+
+    map_manager.select_all()
+    results["set_direction_all_s"] = timeit(lambda: map_manager.set_selected_direction("keep"), repeat=1)
+    map_manager.clear_selection()
+    return results
+
+# elements (yaml and sidecar) and the map after a small edit (dirty rows only)
+def bench_save(map_manager):
+    from PyQt5.QtCore import QPointF
+    results = {"save_elements_s": timeit(map_manager.save_elements, repeat=1)}
+    x_p, y_p = map_manager.w_p / 2, map_manager.h_p / 2
+    map_manager.paint_map(QPointF(x_p - 20, y_p), QPointF(x_p + 20, y_p))
+    results["save_map_s"] = timeit(map_manager.save_map, repeat=1)
+    return results
+
+# every phase of opening, using and saving an elements file in one render mode
+def bench_scene(app, main_window, n_nodes, map_size, render_mode, work_dir):
+    from PyQt5.QtGui import QImage, QPainter
+    from node_store import sidecar_path_of, save_sidecar
+    map_yaml_path = write_synthetic_map(work_dir, map_size, map_size)
+    elements_path = write_synthetic_elements(work_dir, n_nodes, map_yaml_path)
+    map_manager = main_window.map_manager
+    gv = main_window.map_widget.graphics_view
+    gv.render_mode = render_mode
+    results = {}
+
+    # the yaml is parsed without a sidecar, then the sidecar is written and read
+    sidecar_path = sidecar_path_of(elements_path)
+    if os.path.exists(sidecar_path):
+        os.remove(sidecar_path)
+    results["element_load_yaml_s"] = timeit(lambda: map_manager.read_elements(elements_path), repeat=1)
+    elements = map_manager.read_elements(elements_path)
+    save_sidecar(sidecar_path, elements["NODE"], map_yaml_path)
+    results["element_load_sidecar_s"] = timeit(lambda: map_manager.read_elements(elements_path))
+
+    map_manager.reset_data()
+    map_manager.load_elements(elements_path, map_manager.read_elements(elements_path))
+    map_manager.load_map(map_yaml_path)
+    start = time.perf_counter()
+    map_manager.show_loaded_map()
+    map_manager.show_loaded_elements()
+    # the deferred work (e.g. the clearance check of the edges) is part of the population
+    app.processEvents()
+    results["scene_population_s"] = time.perf_counter() - start
+
+    image = QImage(gv.viewport().size(), QImage.Format_ARGB32)
+    def render():
+        painter = QPainter(image)
+        gv.render(painter)
+        painter.end()
+    results["first_render_s"] = timeit(render, repeat=1)
+    results["render_s"] = timeit(render)
+
+    results.update(bench_hit_test(map_manager))
+    results.update(bench_drag(map_manager))
+    results.update(bench_direction(map_manager))
+    app.processEvents()
+    results.update(bench_save(map_manager))
+    app.processEvents()
+    return results
+
+# auto-routing across the wall of write_wall_gap_map(), from a quarter of the width
+# above the wall to the same column below it (the default settings, search margin included)
+def bench_route(main_window, map_size, work_dir):
+    from PyQt5.QtCore import QPointF
+    map_yaml_path = write_wall_gap_map(work_dir, map_size, map_size)
+    map_manager = main_window.map_manager
+    map_manager.reset_data()
+    map_manager.load_map(map_yaml_path)
+    map_manager.show_loaded_map()
+    sm = main_window.setting_manager.stgs["map_manager"]["auto_route"]
+    is_enabled = sm["enabled"]
+    sm["enabled"] = True
+    start = QPointF(map_size / 4, 100)
+    goal = QPointF(map_size / 4, map_size - 100)
+    try:
+        map_manager.add_node(start)
+        # the cost map is built at the first routed node
+        results = {"route_first_s": timeit(lambda: map_manager.add_node(goal), repeat=1)}
+        cost_map = map_manager.cost_map
+        margin = sm["search_margin"] / (cost_map.cell_size * map_manager.resolution)
+        results["route_plan_s"] = timeit(lambda: cost_map.plan((start.x(), start.y()), (goal.x(), goal.y()),
+                                                               margin))
+    finally:
+        sm["enabled"] = is_enabled
+    return results
+
+def environment():
+    from PyQt5.QtCore import QT_VERSION_STR, PYQT_VERSION_STR
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "qt": QT_VERSION_STR,
+        "pyqt": PYQT_VERSION_STR,
+        "platform": platform.platform(),
+        "with_libyaml": yaml.__with_libyaml__
+    }
+
+def print_run(run):
+    print(" ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                   for key, value in run.items()))
+
+# {"<section>[<identifying values>].<metric>": value} for comparing two result files
+def flatten(results):
+    metrics = {}
+    for section, runs in results.items():
+        if not section.endswith("_runs"):
+            continue
+        for run in runs:
+            keys = ",".join(str(value) for value in run.values() if not isinstance(value, float))
+            for key, value in run.items():
+                if isinstance(value, float):
+                    metrics[f"{section}[{keys}].{key}"] = value
+    return metrics
+
+def compare(baseline, results):
+    old = flatten(baseline)
+    new = flatten(results)
+    print(f"compared to {baseline.get('environment', {}).get('commit')}")
+    for name, value in new.items():
+        if name not in old:
+            continue
+        change = (value - old[name]) / old[name] * 100 if old[name] > 0 else math.inf
+        print(f"{name:70s} {old[name]:10.3f} {value:10.3f} {change:+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Brushee GUI benchmarks")
+    parser.add_argument("--map-sizes", type=int, nargs="*", default=[1000, 5000, 10000],
+                        help="side length [px] of the synthetic maps to decode")
+    parser.add_argument("--nodes", type=int, nargs="*", default=[1000, 10000, 100000],
+                        help="node counts of the yaml benchmarks")
+    parser.add_argument("--scene-nodes", "--drag-nodes", dest="scene_nodes", type=int, nargs="*",
+                        default=[1000, 10000, 100000], help="node counts of the editor benchmarks")
+    parser.add_argument("--scene-map-size", type=int, default=4000,
+                        help="side length [px] of the map of the editor benchmarks")
+    parser.add_argument("--route-map-sizes", type=int, nargs="*", default=[2000, 8000],
+                        help="side length [px] of the maps of the auto-route benchmarks")
+    parser.add_argument("--render-modes", nargs="*", default=["items", "batched"], choices=["items", "batched"])
+    parser.add_argument("--output", default=None, help="write results as json")
+    parser.add_argument("--compare", default=None, help="print the change to a previous result json")
+    args = parser.parse_args()
+
+    app, main_window = create_main_window()
+    results = {"environment": environment(), "arguments": vars(args),
+               "map_runs": [], "yaml_runs": [], "scene_runs": [], "route_runs": []}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for map_size in args.map_sizes:
+            run = {"map_size": map_size}
+            run.update(bench_map(main_window, map_size, work_dir))
+            results["map_runs"].append(run)
+            print_run(run)
+
+        for n_nodes in args.nodes:
+            run = {"nodes": n_nodes}
+            run.update(bench_yaml(n_nodes, work_dir))
+            results["yaml_runs"].append(run)
+            print_run(run)
+
+        for render_mode in args.render_modes:
+            for n_nodes in args.scene_nodes:
+                run = {"render_mode": render_mode, "nodes": n_nodes, "map_size": args.scene_map_size}
+                run.update(bench_scene(app, main_window, n_nodes, args.scene_map_size, render_mode, work_dir))
+                results["scene_runs"].append(run)
+                print_run(run)
+
+        for map_size in args.route_map_sizes:
+            run = {"route_map_size": map_size}
+            run.update(bench_route(main_window, map_size, work_dir))
+            results["route_runs"].append(run)
+            print_run(run)
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare is not None:
+        with open(args.compare, "r") as file:
+            compare(json.load(file), results)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import numpy as np
+
+# scipy is optional, the numpy version below gives the same (capped) distances
+try:
+    from scipy.ndimage import distance_transform_edt
+except ImportError:
+    distance_transform_edt = None
+
+SAMPLE_STEP = 0.5   # [px] spacing of the samples along an edge
+
+# euclidean distance [px] from each cell to the nearest occupied cell, capped at max_distance
+def distance_field(occupied, max_distance):
+    if not occupied.any():
+        return np.full(occupied.shape, max_distance, dtype=np.float32)
+    if distance_transform_edt is not None:
+        field = distance_transform_edt(~occupied)
+        return np.minimum(field, max_distance).astype(np.float32)
+
+    # NOTE: separable exact transform, the distance along each column first
+    # and then the minimum over the horizontal offsets up to max_distance
+    h, w = occupied.shape
+    cap = int(np.ceil(max_distance))
+    rows = np.arange(h)[:, None]
+    above = np.maximum.accumulate(np.where(occupied, rows, -h - cap), axis=0)
+    below = np.minimum.accumulate(np.where(occupied, rows, 2 * h + cap)[::-1], axis=0)[::-1]
+    column = np.minimum(np.minimum(rows - above, below - rows), cap + 1).astype(np.float32)
+    column_2 = column**2
+    field_2 = column_2.copy()
+    for k in range(1, min(cap, w - 1) + 1):
+        np.minimum(field_2[:, k:], column_2[:, :-k] + k**2, out=field_2[:, k:])
+        np.minimum(field_2[:, :-k], column_2[:, k:] + k**2, out=field_2[:, :-k])
+    return np.minimum(np.sqrt(field_2), max_distance).astype(np.float32)
+
+# NOTE: the field is built per tile when an edge first needs it, each tile from its
+# window padded by max_distance so that the capped distances are exact at the tile border
+# occupancy(y_min, y_max, x_min, x_max) returns the occupied cells of a window
+class ClearanceField():
+    def __init__(self, occupancy, shape, max_distance, tile_size=256):
+        self.occupancy = occupancy
+        self.h_p, self.w_p = shape
+        self.max_distance = max_distance    # [px]
+        self.tile_size = tile_size
+        self.pad = int(np.ceil(max_distance))
+        self.tiles = {}
+
+    def get_tile(self, tx, ty):
+        key = (tx, ty)
+        if key not in self.tiles:
+            x_min, y_min = tx * self.tile_size, ty * self.tile_size
+            x_max, y_max = min(x_min + self.tile_size, self.w_p), min(y_min + self.tile_size, self.h_p)
+            wx_min, wy_min = max(x_min - self.pad, 0), max(y_min - self.pad, 0)
+            wx_max, wy_max = min(x_max + self.pad, self.w_p), min(y_max + self.pad, self.h_p)
+            field = distance_field(self.occupancy(wy_min, wy_max, wx_min, wx_max), self.max_distance)
+            self.tiles[key] = field[y_min - wy_min:y_max - wy_min, x_min - wx_min:x_max - wx_min]
+        return self.tiles[key]
+
+    # distance [px] at the pixels (x, y), outside the map is treated as occupied
+    def lookup(self, x, y):
+        distance = np.zeros(len(x), dtype=np.float32)
+        inside = np.nonzero((x >= 0) & (x < self.w_p) & (y >= 0) & (y < self.h_p))[0]
+        x = x[inside]
+        y = y[inside]
+        n_tx = -(-self.w_p // self.tile_size)
+        tile_of = (y // self.tile_size) * n_tx + x // self.tile_size
+        order = np.argsort(tile_of, kind="stable")
+        tile_ids, starts = np.unique(tile_of[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for tile_id, start, end in zip(tile_ids.tolist(), starts.tolist(), ends.tolist()):
+            ty, tx = divmod(tile_id, n_tx)
+            tile = self.get_tile(tx, ty)
+            group = order[start:end]
+            distance[inside[group]] = tile[y[group] - ty * self.tile_size, x[group] - tx * self.tile_size]
+        return distance
+
+    # the map changed in [x_min, x_max) x [y_min, y_max), drop the tiles it can affect
+    def invalidate(self, x_min, y_min, x_max, y_max):
+        tx_min = max(x_min - self.pad, 0) // self.tile_size
+        ty_min = max(y_min - self.pad, 0) // self.tile_size
+        tx_max = (x_max + self.pad - 1) // self.tile_size
+        ty_max = (y_max + self.pad - 1) // self.tile_size
+        for key in list(self.tiles):
+            tx, ty = key
+            if tx_min <= tx <= tx_max and ty_min <= ty <= ty_max:
+                del self.tiles[key]
+
+    # minimum distance [px] along each segment, sampled every SAMPLE_STEP in one vectorized pass
+    def segment_clearance(self, x_0, y_0, x_1, y_1):
+        n = len(x_0)
+        if n == 0:
+            return np.zeros(0, dtype=np.float32)
+        length = np.hypot(x_1 - x_0, y_1 - y_0)
+        n_samples = np.ceil(length / SAMPLE_STEP).astype(np.int64) + 1
+        starts = np.concatenate([[0], np.cumsum(n_samples)[:-1]])
+        segment = np.repeat(np.arange(n), n_samples)
+        step = np.arange(len(segment)) - starts[segment]
+        t = step / np.maximum(n_samples[segment] - 1, 1)
+        x = x_0[segment] + t * (x_1 - x_0)[segment]
+        y = y_0[segment] + t * (y_1 - y_0)[segment]
+        distance = self.lookup(np.floor(x).astype(np.int64), np.floor(y).astype(np.int64))
+        return np.minimum.reduceat(distance, starts)
@@ -1,142 +1,525 @@
 import os
 import yaml
 import numpy as np
-from PIL import Image
-from PyQt5.QtGui import QImage, QPixmap, QPen, QColor, QBrush
+from PyQt5.QtCore import QTimer
+from map_utils import read_pgm, threshold_map, threshold_lut, occupancy_lut, occupancy_values, stamp_segment, MapCache
+from map_utils import write_pgm, patch_pgm
+from spatial_index import SpatialIndex
+from clearance import ClearanceField
+from auto_route import CostMap
+from route_layer import rotated_triangles, point_in_triangle, point_segment_distance
+from undo_stack import UndoStack, AddNodesDelta, DeleteNodesDelta, MoveNodesDelta, DirectionDelta
+from node_store import NodeStore, HEAD, YamlLoader, YamlDumper
+from node_store import sidecar_path_of, is_sidecar_fresh, load_sidecar, save_sidecar, peek_sidecar_map_name
+from profiler import timed
 import math
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# attributes set by load_map(), copied by MapManager.apply_map()
+MAP_ATTRIBUTES = ("map_yaml_path", "map_info", "resolution", "origin", "negate", "occupied_thresh",
+                  "free_thresh", "map_pgm_path", "map_type", "w_p", "h_p", "max_val", "raw_map", "map_np",
+                  "map_offset", "map_dirty_rows", "is_map_writable", "is_map_saved")
+
+EDGE_HIT_PAD = 2            # [px] pen width margin around edges and nodes
+MIN_INDEX_CELL_SIZE = 8     # [px]
+EDGE_HIT_WIDTH = 1          # [px] outline width for hit-testing in the batched render mode
 
 # NOTE: not use "path", use "overlay" instead
 # NOTE: "node", "edge", ... is part of "element"
 class MapManager():
-    def __init__(self, main_window):
+    def __init__(self, main_window, map_cache=None):
         self.main_window = main_window
+        self.map_cache = map_cache if map_cache is not None else self.create_map_cache()
         self.data_loaded = None
-        self.elements = []
+        self.nodes = NodeStore()
+        self.node_items = []    # node_items[i] is the item of row i
+        self.edge_items = []    # edge_items[i] connects rows i and i + 1
         self.elements_path = None
         self.map_yaml_path = None
         self.map_pgm_path = None # need ?
         self.map_png_path = None # need ?
         self.is_saved = True
+        self.is_map_saved = True
+        self.spatial_index = None
+        self.selected_ids = set()
+        self.undo_stack = UndoStack(self.main_window.setting_manager.stgs["map_manager"]["undo_depth"])
+
+        # clearance of the edges to obstacles, keyed by the id of the start node
+        self.clearance_field = None
+        self.edge_clearance = {}    # [m]
+        self.unsafe_edges = set()
+        self.unchecked_edges = set()
+
+        # inflated obstacle costs for auto-routing, built at the first auto-routed node of a map
+        self.cost_map = None
+
+    # parse and validate an elements file, returns None if it is not valid
+    # NOTE: "NODE" of the returned dict is a NodeStore (pixel columns are filled later)
+    # the binary sidecar is used instead of the yaml when it is newer
+    def read_elements(self, elements_path):
+        sidecar_path = sidecar_path_of(elements_path)
+        if is_sidecar_fresh(elements_path, sidecar_path):
+            try:
+                occ_map_name, nodes = load_sidecar(sidecar_path)
+                elements = {"NODE": nodes}
+                if occ_map_name is not None:
+                    elements["OCC_MAP_NAME"] = occ_map_name
+                return elements
+            except (OSError, KeyError, ValueError) as e:
+                logger.error("Can't read %s, fall back to yaml: %s", sidecar_path, e)
 
-    def load_elements(self, elements_path):
+        try:
+            with open(elements_path, 'r') as file:
+                elements = yaml.load(file, Loader=YamlLoader)
+        except (OSError, yaml.YAMLError) as e:
+            logger.error("Can't read %s: %s", elements_path, e)
+            return None
+
+        if not self.check_validation(elements):
+            return None
+        nodes = NodeStore()
+        nodes.extend(elements.get("NODE") or [])
+        elements["NODE"] = nodes
+        return elements
+
+    # elements is the result of read_elements(), so the file is parsed only once
+    def load_elements(self, elements_path, elements=None):
+        if elements is None:
+            elements = self.read_elements(elements_path)
+            if elements is None:
+                return False
         self.elements_path = elements_path
-        with open(elements_path, 'r') as file:
-            self.data_loaded = yaml.safe_load(file)
+        self.data_loaded = elements
         if "OCC_MAP_NAME" in self.data_loaded:
             self.map_yaml_path = self.data_loaded["OCC_MAP_NAME"]
+        return True
 
 
+    @timed
     def show_loaded_elements(self):
         if self.data_loaded is None:
-            print("Error: No elements loaded")
+            logger.error("No elements loaded")
             return
         else:
-            for node in self.data_loaded["NODE"]:
-                self.register_node(node)
+            # NOTE: the loaded store replaces the (reset) current one
+            self.nodes = self.data_loaded["NODE"]
+            self.data_loaded = None
+            x_c = self.nodes["x"]
+            y_c = self.nodes["y"]
+            x_p, y_p = self.coords2pixels(x_c, y_c)
+            self.nodes["x_p"][:] = x_p
+            self.nodes["y_p"][:] = y_p
+
+            gv = self.main_window.map_widget.graphics_view
+            directions = [self.nodes.direction_name(code) for code in self.nodes["direction"].tolist()]
+            self.node_items = gv.draw_nodes(x_c, y_c, directions)
+            ids = self.nodes["id"].tolist()
+            for node_id, x_p_i, y_p_i in zip(ids, x_p.tolist(), y_p.tolist()):
+                self.spatial_index.insert_point(("NODE", node_id), x_p_i, y_p_i, self.node_pad, priority=0)
+            # NOTE: one message per node only at DEBUG, the loop is skipped otherwise
+            if logger.isEnabledFor(logging.DEBUG):
+                for node_id, x, y in zip(ids, x_c.tolist(), y_c.tolist()):
+                    logger.debug("Add node %d at (%.2f, %.2f)", node_id, x, y)
+            logger.info("Add %d nodes", len(ids))
 
-    # TODO: key not found error
+            # connect and orient the whole route at once
+            self.edge_items = [self.create_edge(row) for row in range(len(self.nodes) - 1)]
+            self.update_all_nodes()
+            gv.route_changed()
+
+    @timed
     def load_map(self, map_yaml_path):
-        if not os.path.exists(map_yaml_path):
-            print(f"Error: {map_yaml_path} not exists")
+        if map_yaml_path is None or not os.path.exists(map_yaml_path):
+            logger.error("%s not exists", map_yaml_path)
             return False
 
         self.map_yaml_path = map_yaml_path
-        with open(map_yaml_path, 'r') as file:
-            map_info = yaml.safe_load(file)
-
-        self.resolution = map_info['resolution']
-        self.origin = map_info['origin']
-        self.negate = map_info['negate']
-        self.occupied_thresh = map_info['occupied_thresh']
-        self.free_thresh = map_info['free_thresh']
-        map_pgm_name = map_info['image']
+        try:
+            with open(map_yaml_path, 'r') as file:
+                map_info = yaml.load(file, Loader=YamlLoader)
+
+            # checked here, a string (e.g. occupied_thresh: "0.65") would only fail deep in the decoding
+            for key in ('resolution', 'negate', 'occupied_thresh', 'free_thresh'):
+                if not isinstance(map_info[key], (int, float)):
+                    raise ValueError(f"{key} is not a number: {map_info[key]!r}")
+            self.resolution = map_info['resolution']
+            self.origin = map_info['origin']
+            self.negate = map_info['negate']
+            self.occupied_thresh = map_info['occupied_thresh']
+            self.free_thresh = map_info['free_thresh']
+            map_pgm_name = map_info['image']
+            # kept as loaded, save_map_as() only overwrites the keys it changes
+            self.map_info = map_info
+        except (OSError, yaml.YAMLError, KeyError, TypeError, ValueError) as e:
+            logger.error("Can't read %s: %s", map_yaml_path, e)
+            return False
         map_dir = os.path.dirname(map_yaml_path)
         self.map_pgm_path = os.path.join(map_dir, map_pgm_name)
-        self.load_map_pgm(self.map_pgm_path)
 
-        return True
+        return self.load_map_pgm(self.map_pgm_path)
+
+    # decode a map without touching this manager (safe to call from a worker thread)
+    # returns a detached manager holding the map attributes, or None
+    def read_map(self, map_yaml_path):
+        decoder = MapManager(self.main_window, map_cache=self.map_cache)
+        if not decoder.load_map(map_yaml_path):
+            return None
+        return decoder
 
+    # adopt the map decoded by read_map()
+    def apply_map(self, decoder):
+        for key in MAP_ATTRIBUTES:
+            setattr(self, key, getattr(decoder, key))
+
+    # cheap guess of OCC_MAP_NAME so that the map can be decoded while the elements are parsed
+    def peek_map_yaml_path(self, elements_path):
+        sidecar_path = sidecar_path_of(elements_path)
+        try:
+            if is_sidecar_fresh(elements_path, sidecar_path):
+                return peek_sidecar_map_name(sidecar_path)
+            with open(elements_path, 'r') as file:
+                match = re.search(r"^OCC_MAP_NAME:(.*)$", file.read(), re.MULTILINE)
+            if match is None:
+                return None
+            return yaml.load(match.group(1), Loader=YamlLoader)
+        except (OSError, KeyError, ValueError, yaml.YAMLError):
+            return None
+
+    @timed
     def load_map_pgm(self, map_pgm_path):
-        with open(map_pgm_path, 'rb') as file:
-            self.map_type = file.readline()
-            file.readline()  # to read comment line
-            self.w_p, self.h_p = map(int, file.readline().split())
-            self.max_val = int(file.readline())
-            if self.map_type == b'P5\n':
-                self.bytes_map = file.read()
-                self.convert2pil()
-            else:
-                print(f"Error: Unsupported map type: {self.map_type}")
-                self.bytes_map = None
-                self.pil_map = None
+        try:
+            pgm = read_pgm(map_pgm_path)
+        except (OSError, ValueError) as e:
+            logger.error("Can't read %s: %s", map_pgm_path, e)
+            self.raw_map = None
+            return False
 
-    def convert2pil(self):
-        map_np = np.zeros((self.h_p, self.w_p), dtype=np.uint8)
-        for i in range(len(self.bytes_map)):
-            if self.negate:
-                cell = (self.max_val - self.bytes_map[i]) / self.max_val
-            else:
-                cell = self.bytes_map[i] / self.max_val
+        self.map_type = pgm.map_type
+        self.w_p, self.h_p = pgm.width, pgm.height
+        self.max_val = pgm.max_val
+        self.raw_map = pgm.data
+        self.map_offset = pgm.offset
+        self.convert2pil()
+        # the arrays may be a memmap of the file or shared with the map cache
+        self.is_map_writable = False
+        self.is_map_saved = True
+        self.map_dirty_rows = np.zeros(self.h_p, dtype=bool)
+        return True
 
-            if cell > self.occupied_thresh:
-                map_np[i // self.w_p, i % self.w_p] = self.max_val
-            elif cell < self.free_thresh:
-                map_np[i // self.w_p, i % self.w_p] = 0
-            else:
-                map_np[i // self.w_p, i % self.w_p] = int(cell * self.max_val)
+    def create_map_cache(self):
+        sm = self.main_window.setting_manager.stgs["map_manager"]["map_cache"]
+        if not sm["enabled"]:
+            return None
+        cache_dir = sm["dir"]
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "brushee_gui", "maps")
+        return MapCache(cache_dir, max_size_mb=sm["max_size_mb"], memory_entries=sm["memory_entries"])
 
-        self.pil_map = Image.fromarray(map_np)
+    @timed
+    def convert2pil(self):
+        # reuse the thresholded raster of the same pgm and parameters if possible
+        key = None
+        if self.map_cache is not None:
+            try:
+                key = self.map_cache.make_key(self.map_pgm_path, self.negate,
+                                              self.occupied_thresh, self.free_thresh)
+                self.map_np = self.map_cache.get(key)
+            except OSError:
+                self.map_np = None
+            if self.map_np is not None:
+                return
+
+        self.map_np = threshold_map(self.raw_map, self.max_val, self.negate,
+                                    self.occupied_thresh, self.free_thresh)
+        if key is not None:
+            self.map_cache.put(key, self.map_np)
 
     # reset graphics view and show map by calling graphics_view.set_map()
     # (scene.clear is called in set_map())
     # NOTE: this function should be called before show_loaded_elements()
+    @timed
     def show_loaded_map(self):
-        map_q = QImage(self.pil_map.tobytes(), self.pil_map.width, self.pil_map.height, QImage.Format_Grayscale8)
-        map_pix = QPixmap.fromImage(map_q)
         gv = self.main_window.map_widget.graphics_view
-        gv.set_map(map_pix)
+        gv.set_map(self.map_np)
+
+        # spatial index for hit-testing, cell size is about one node
+        sm_node = self.main_window.setting_manager.stgs["map_graphics_view"]["node"]
+        self.triangle_base_p = sm_node["triangle_base_size"] / self.resolution
+        self.node_pad = self.triangle_base_p + EDGE_HIT_PAD
+        self.spatial_index = SpatialIndex(max(2 * self.node_pad, MIN_INDEX_CELL_SIZE))
+
+        # distance field of the obstacles, built per tile when edges are checked
+        sm = self.main_window.setting_manager.stgs["map_manager"]["clearance"]
+        self.clearance_field = None
+        self.edge_clearance = {}
+        self.unsafe_edges = set()
+        self.cost_map = None
+        # NOTE: one entry per value of the dtype (like threshold_map), a pixel above max_val
+        # in a broken pgm must not raise an IndexError in occupied_window()
+        self.occupancy_lut = occupancy_lut(self.max_val, self.negate, self.occupied_thresh, self.free_thresh,
+                                           sm["unknown_is_occupied"], size=np.iinfo(self.raw_map.dtype).max + 1)
+        if sm["enabled"]:
+            self.clearance_field = ClearanceField(self.occupied_window, (self.h_p, self.w_p),
+                                                  sm["max_distance"] / self.resolution, tile_size=sm["tile_size"])
+
+    # stamp a brush stroke from start to end (scene pixels) into the map,
+    # PAINT_MAP marks the cells occupied and ERASE_MAP marks them free
+    def paint_map(self, start, end, erase=False):
+        self.make_map_writable()
+        occupied, free = occupancy_values(self.max_val, self.negate)
+        raw_value = free if erase else occupied
+        lut = threshold_lut(self.max_val, self.negate, self.occupied_thresh, self.free_thresh,
+                            size=np.iinfo(self.raw_map.dtype).max + 1)
+        sm = self.main_window.setting_manager.stgs["map_graphics_view"]["paint_mode"]
+        # at least one pixel is stamped
+        radius = max(sm["brush_radius"] / self.resolution, 0.5)
+
+        x_0, y_0, x_1, y_1 = start.x(), start.y(), end.x(), end.y()
+        rect = stamp_segment(self.raw_map, x_0, y_0, x_1, y_1, radius, raw_value)
+        if rect is None:
+            return
+        stamp_segment(self.map_np, x_0, y_0, x_1, y_1, radius, lut[raw_value])
+        self.map_dirty_rows[rect[1]:rect[3]] = True
+        self.is_map_saved = False
+        self.main_window.map_widget.graphics_view.map_layer.update_region(self.map_np, *rect)
+        self.cost_map = None
+        if self.clearance_field is not None:
+            self.clearance_field.invalidate(*rect)
+            self.check_edges_near(*rect)
+
+    def occupied_window(self, y_min, y_max, x_min, x_max):
+        return self.occupancy_lut[self.raw_map[y_min:y_max, x_min:x_max]]
+
+    # the edges are checked in one batch per event loop iteration
+    def mark_edge_unchecked(self, node_id):
+        if self.clearance_field is None:
+            return
+        if len(self.unchecked_edges) == 0:
+            QTimer.singleShot(0, self.check_edges)
+        self.unchecked_edges.add(node_id)
+
+    def check_edges(self):
+        ids = self.unchecked_edges
+        self.unchecked_edges = set()
+        if self.clearance_field is None:
+            return
+        n = len(self.nodes)
+        rows = np.array([self.nodes.row_of[node_id] for node_id in ids
+                         if node_id in self.nodes.row_of and self.nodes.row_of[node_id] < n - 1], dtype=np.int64)
+        if len(rows) == 0:
+            return
+        x_p = self.nodes["x_p"]
+        y_p = self.nodes["y_p"]
+        clearance = self.clearance_field.segment_clearance(x_p[rows], y_p[rows], x_p[rows + 1], y_p[rows + 1])
+        clearance = clearance.astype(np.float64) * self.resolution
+
+        gv = self.main_window.map_widget.graphics_view
+        safety_distance = self.main_window.setting_manager.stgs["map_manager"]["clearance"]["safety_distance"]
+        node_ids = self.nodes["id"][rows].tolist()
+        for row, node_id, edge_clearance in zip(rows.tolist(), node_ids, clearance.tolist()):
+            self.edge_clearance[node_id] = edge_clearance
+            is_unsafe = edge_clearance < safety_distance
+            if is_unsafe == (node_id in self.unsafe_edges):
+                continue
+            if is_unsafe:
+                self.unsafe_edges.add(node_id)
+            else:
+                self.unsafe_edges.discard(node_id)
+            self.edge_items[row].setPen(gv.unsafe_edge_pen if is_unsafe else gv.edge_pen)
+
+    # re-check the edges close enough to a changed map rect to be affected
+    def check_edges_near(self, x_min, y_min, x_max, y_max):
+        n = len(self.nodes)
+        if n < 2:
+            return
+        pad = self.clearance_field.pad
+        x_p = self.nodes["x_p"]
+        y_p = self.nodes["y_p"]
+        x_0, y_0, x_1, y_1 = x_p[:-1], y_p[:-1], x_p[1:], y_p[1:]
+        near = ((np.minimum(x_0, x_1) <= x_max + pad) & (np.maximum(x_0, x_1) >= x_min - pad) &
+                (np.minimum(y_0, y_1) <= y_max + pad) & (np.maximum(y_0, y_1) >= y_min - pad))
+        for node_id in self.nodes["id"][:-1][near].tolist():
+            self.mark_edge_unchecked(node_id)
+
+    def forget_edge(self, node_id):
+        self.edge_clearance.pop(node_id, None)
+        self.unsafe_edges.discard(node_id)
+
+    # copy-on-write, the loaded arrays are only copied at the first edit
+    def make_map_writable(self):
+        if self.is_map_writable:
+            return
+        self.raw_map = np.array(self.raw_map)
+        self.map_np = np.array(self.map_np)
+        self.is_map_writable = True
+
+    # write the edited map back to its pgm, only the dirty rows if the file layout is unchanged
+    def save_map(self):
+        if self.is_map_saved:
+            logger.info("Map is not modified")
+            return True
+        map_pgm_path = self.map_pgm_path
+        try:
+            expected_size = self.map_offset + self.raw_map.nbytes if self.map_offset is not None else None
+            if self.map_type == "P5" and os.path.exists(map_pgm_path) and os.path.getsize(map_pgm_path) == expected_size:
+                patch_pgm(map_pgm_path, self.raw_map, self.map_offset, self.map_dirty_rows)
+            else:
+                offset = write_pgm(map_pgm_path, self.raw_map, self.max_val, self.map_type)
+                self.map_offset = offset if self.map_type == "P5" else None
+        except OSError as e:
+            logger.error("Can't write %s: %s", map_pgm_path, e)
+            return False
+        self.map_dirty_rows[:] = False
+        self.is_map_saved = True
+        logger.info("Save map to %s", map_pgm_path)
+        return True
+
+    # write the map as a new map (pgm and map yaml next to each other) and switch to it
+    # NOTE: the elements file refers to the new map yaml from the next save
+    def save_map_as(self, map_yaml_path):
+        map_dir = os.path.dirname(map_yaml_path)
+        map_pgm_name = os.path.splitext(os.path.basename(map_yaml_path))[0] + ".pgm"
+        map_pgm_path = os.path.join(map_dir, map_pgm_name)
+        # other keys of the loaded map yaml (e.g. "mode") are kept
+        map_info = dict(self.map_info)
+        map_info.update({
+            "image": map_pgm_name,
+            "resolution": self.resolution,
+            "origin": self.origin,
+            "negate": self.negate,
+            "occupied_thresh": self.occupied_thresh,
+            "free_thresh": self.free_thresh
+        })
+        tmp_path = map_yaml_path + ".tmp"
+        try:
+            offset = write_pgm(map_pgm_path, self.raw_map, self.max_val)
+            with open(tmp_path, 'w') as file:
+                yaml.dump(map_info, file, Dumper=YamlDumper, sort_keys=False)
+            os.replace(tmp_path, map_yaml_path)
+        except OSError as e:
+            logger.error("Can't write %s: %s", map_yaml_path, e)
+            return False
+
+        self.map_yaml_path = map_yaml_path
+        self.map_info = map_info
+        self.map_pgm_path = map_pgm_path
+        self.map_type = "P5"
+        self.map_offset = offset
+        self.map_dirty_rows[:] = False
+        self.is_map_saved = True
+        self.is_saved = False
+        logger.info("Save map as %s", map_yaml_path)
+        return True
 
     # reset only manager data
     # elements in scene and map data are reset when call show_loaded_map()
     def reset_data(self):
         self.data_loaded = None
-        self.elements = []
+        self.nodes = NodeStore()
+        self.node_items = []
+        self.edge_items = []
         self.elements_path = None
         self.map_yaml_path = None
         self.map_pgm_path = None
         self.map_png_path = None
         self.is_saved = True
+        if self.spatial_index is not None:
+            self.spatial_index.clear()
+        self.selected_ids = set()
+        self.undo_stack.clear()
+        self.edge_clearance = {}
+        self.unsafe_edges = set()
+        self.unchecked_edges = set()
 
-    def coord2pixel(self, coord):
-        x_p, y_p = coord
-        x_c = (x_p - self.origin[0]) / self.resolution
-        y_c = -(y_p + self.origin[1]) / self.resolution
+    # array in / array out, x_c and y_c are map coordinates [m]
+    def coords2pixels(self, x_c, y_c):
+        x_c = np.asarray(x_c, dtype=np.float64)
+        y_c = np.asarray(y_c, dtype=np.float64)
+        x_p = (x_c - self.origin[0]) / self.resolution
+        y_p = -(y_c + self.origin[1]) / self.resolution
+        return x_p, y_p
+
+    def pixels2coords(self, x_p, y_p):
+        x_p = np.asarray(x_p, dtype=np.float64)
+        y_p = np.asarray(y_p, dtype=np.float64)
+        x_c = x_p * self.resolution + self.origin[0]
+        y_c = -y_p * self.resolution - self.origin[1]
         return x_c, y_c
 
+    def coord2pixel(self, coord):
+        x_p, y_p = self.coords2pixels(*coord)
+        return float(x_p), float(y_p)
+
     def pixel2coord(self, pixel):
-        x_c, y_c = pixel
-        x_p = x_c * self.resolution + self.origin[0]
-        y_p = -y_c * self.resolution - self.origin[1]
-        return x_p, y_p
+        x_c, y_c = self.pixels2coords(*pixel)
+        return float(x_c), float(y_c)
+
+    # node triangles in scene pixels, shape (n, 3, 2) as (top, left, right)
+    def node_triangles(self, x_c, y_c):
+        sm_node = self.main_window.setting_manager.stgs["map_graphics_view"]["node"]
+        triangle_base = sm_node["triangle_base_size"]
+        x_c = np.asarray(x_c, dtype=np.float64)
+        y_c = np.asarray(y_c, dtype=np.float64)
+        tri_x = np.stack([x_c, x_c - triangle_base/2, x_c + triangle_base/2], axis=-1)
+        tri_y = np.stack([y_c + triangle_base, y_c - triangle_base/2, y_c - triangle_base/2], axis=-1)
+        tri_x, tri_y = self.coords2pixels(tri_x, tri_y)
+        return np.stack([tri_x, tri_y], axis=-1)
 
+    @timed
     def get_clicked_element(self, point):
-        for element in self.elements:
-            if element.item.contains(point):
+        if self.spatial_index is None:
+            return None
+        # nodes are returned before edges, both in insertion order
+        is_batched = self.main_window.map_widget.graphics_view.route_layer.is_batched
+        for attribute, node_id in self.spatial_index.query(point.x(), point.y()):
+            element = Element(self, attribute, node_id)
+            if is_batched:
+                if self.hit_test(element, point):
+                    return element
+                continue
+            item = element.item
+            if item.contains(item.mapFromScene(point)):
                 return element
 
         return None
 
+    # geometric version of item.contains() for the batched render mode (no scene items)
+    def hit_test(self, element, point):
+        row = element.row
+        if element.attribute == "NODE":
+            triangle = rotated_triangles(self.nodes["x_p"][row:row + 1], self.nodes["y_p"][row:row + 1],
+                                         self.nodes["angle"][row:row + 1], self.triangle_base_p)[0]
+            triangle = triangle.tolist()
+            if point_in_triangle(point.x(), point.y(), triangle):
+                return True
+            # the outline is part of the node as for a scene item
+            return any(point_segment_distance(point.x(), point.y(), *triangle[i - 1], *triangle[i]) <= EDGE_HIT_WIDTH / 2
+                       for i in range(3))
+        distance = point_segment_distance(point.x(), point.y(), *self.edge_points(row))
+        return distance <= EDGE_HIT_WIDTH / 2
+
+    def get_element_by_id(self, node_id):
+        if node_id not in self.nodes:
+            return None
+        return Element(self, "NODE", node_id)
+
     def add_node(self, point):
-        x_c, y_c = self.pixel2coord((point.x(), point.y()))
-        elem_n = len(self.elements)
-        ids = [self.elements[i].data["id"] for i in range(elem_n)]
-        while True:
-            if elem_n not in ids:
-                break
-            elem_n += 1
+        sm = self.main_window.setting_manager.stgs["map_manager"]["auto_route"]
+        if sm["enabled"] and len(self.nodes) != 0:
+            self.add_routed_node(point)
+            return
+
+        node = self.new_node(self.pixel2coord((point.x(), point.y())))
+        row = self.register_node(node)
+        self.undo_stack.push(AddNodesDelta([(row, node)]))
 
-        node = {
-            "id": elem_n,
+    def new_node(self, coord):
+        x_c, y_c = coord
+        return {
+            "id": self.nodes.allocate_id(),
             "pose": {
                 "x": x_c,
                 "y": y_c,
@@ -145,9 +528,35 @@ class MapManager():
             "type": 1
         }
 
-        self.register_node(node)
+    # auto-route mode: the new node is connected to the last one by a collision-free path,
+    # its corners are inserted as nodes together with the new node (one undo step)
+    # NOTE: falls back to a straight edge if there is no path
+    def add_routed_node(self, point):
+        sm = self.main_window.setting_manager.stgs["map_manager"]["auto_route"]
+        if self.cost_map is None:
+            cell_size = max(int(round(sm["grid_resolution"] / self.resolution)), 1)
+            resolution = cell_size * self.resolution
+            self.cost_map = CostMap(self.occupied_window, (self.h_p, self.w_p), cell_size,
+                                    sm["inflation_radius"] / resolution, sm["cost_radius"] / resolution,
+                                    sm["cost_weight"])
+
+        start = (float(self.nodes["x_p"][-1]), float(self.nodes["y_p"][-1]))
+        goal = (point.x(), point.y())
+        margin = sm["search_margin"] / (self.cost_map.cell_size * self.resolution)
+        points = self.cost_map.plan(start, goal, margin)
+        if points is None:
+            logger.warning("No collision-free route found, added a straight edge")
+            points = [start, goal]
 
-    def register_node(self, node):
+        n = len(self.nodes)
+        nodes = [(n + i, self.new_node(self.pixel2coord(pixel))) for i, pixel in enumerate(points[1:])]
+        self.insert_nodes(nodes)
+        self.undo_stack.push(AddNodesDelta(nodes))
+
+    # row is where the node is inserted in the route (appended by default)
+    def register_node(self, node, row=None):
+        if row is None:
+            row = len(self.nodes)
         gv = self.main_window.map_widget.graphics_view
         x_c = node["pose"]["x"]
         y_c = node["pose"]["y"]
@@ -156,197 +565,574 @@ class MapManager():
         direction = node["pose"]["direction"]
         node_item = gv.draw_node(x_c, y_c, direction)
 
-        internal_data = {
-            "x_p": x_p,
-            "y_p": y_p,
-            "angle": 0
-        }
-        element = Element("NODE", node, internal_data=internal_data, item=node_item)
-
-        self.elements.append(element)
-        self.update_elements()
+        self.nodes.insert_node(row, node, x_p, y_p)
+        self.node_items.insert(row, node_item)
+        self.spatial_index.insert_point(("NODE", node["id"]), x_p, y_p, self.node_pad, priority=0)
+        self.update_elements(row, added=True)
 
-        print(f"Add node {node['id']} at ({x_c:.2f}, {y_c:.2f})")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Add node %d at (%.2f, %.2f)", node["id"], x_c, y_c)
+        return row
 
-    def delete_element(self, element, update=True):
-        # TODO: use try-except
-        if not element in self.elements:
-            print("Error: Element not in elements")
+    # NOTE: edges are derived from the node order, so only nodes can be deleted
+    def delete_element(self, element):
+        if element.attribute != "NODE":
+            logger.error("Can't delete %s", element.attribute)
             return
-        gv = self.main_window.map_widget.graphics_view
-        gv.scene.removeItem(element.item)
-        self.elements.remove(element)
+        row = self.nodes.row_of.get(element.id)
+        if row is None:
+            logger.error("Element not in elements")
+            return
+        node = self.nodes.to_dict(row)
+        self.delete_node(row)
+        self.undo_stack.push(DeleteNodesDelta([(row, node)]))
+        logger.debug("Delete %s %d", element.attribute, element.id)
 
-        if update:
-            self.update_elements()
-            print(f"Delete {element.attribute} {element.data['id']}")
+    def delete_node(self, row):
+        gv = self.main_window.map_widget.graphics_view
+        node_id = self.nodes.get("id", row)
+        gv.remove_item(self.node_items.pop(row))
+        self.nodes.delete(row)
+        self.spatial_index.remove(("NODE", node_id))
+        self.selected_ids.discard(node_id)
+        self.update_elements(row, deleted_id=node_id)
 
     def switch_node_direction(self, element):
-        sm = self.main_window.setting_manager
-        sm_node = sm.stgs["map_graphics_view"]["node"]
-        if element.data["pose"]["direction"] == "head":
-            element.data["pose"]["direction"] = "keep"
-            pen = QPen(QColor(sm_node["kn_pen"]))
-            pen.setWidth(sm_node["kn_pen_w"])
-            brush = QBrush(QColor(sm_node["kn_brush"]))
-        elif element.data["pose"]["direction"] == "keep":
-            element.data["pose"]["direction"] = "head"
-            pen = QPen(QColor(sm_node["hn_pen"]))
-            pen.setWidth(sm_node["hn_pen_w"])
-            brush = QBrush(QColor(sm_node["hn_brush"]))
+        row = element.row
+        direction = self.nodes.direction_name(self.nodes.get("direction", row))
+        if direction == "head":
+            new_direction = "keep"
+        elif direction == "keep":
+            new_direction = "head"
         else:
-            print("Error: Invalid direction")
+            logger.error("Invalid direction")
+            return
 
-        element.item.setPen(pen)
-        element.item.setBrush(brush)
-        self.update_elements()
+        self.set_node_direction(row, new_direction)
+        self.undo_stack.push(DirectionDelta([element.id], [direction], [new_direction]))
+        logger.debug("Switch direction of node %d", element.id)
 
-        print(f"Switch direction of node {element.data['id']}")
+    def set_node_direction(self, row, direction):
+        self.nodes.set("direction", row, self.nodes.direction_code(direction))
+        self.restyle_nodes([row])
+        self.update_elements(row)
 
     def move_element(self, element, point, finalize=False):
-        x_c, y_c = self.pixel2coord((point.x(), point.y()))
+        # a node of a multi-selection drags the whole selection
+        if element.id in self.selected_ids and len(self.selected_ids) > 1:
+            self.move_selection(element, point, finalize=finalize)
+            return
+
+        row = element.row
+        old_pos = (self.nodes.get("x_p", row), self.nodes.get("y_p", row))
+        x_c, y_c = self.move_node(row, point.x(), point.y(), finalize=finalize)
+        # the moves of a drag are merged into one entry, the finalizing move closes it
+        self.undo_stack.push(MoveNodesDelta([element.id], [old_pos], [(point.x(), point.y())],
+                                            is_open=not finalize))
+
+        if finalize and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Move %s %d to (%.2f, %.2f)", element.attribute, element.id, x_c, y_c)
+
+    # x_p, y_p: new scene pixel position, returns the new map coordinates
+    def move_node(self, row, x_p, y_p, finalize=True):
+        x_c, y_c = self.pixel2coord((x_p, y_p))
         if not finalize:
-            dx = point.x() - element.internal_data["x_p"]
-            dy = point.y() - element.internal_data["y_p"]
-            element.item.moveBy(dx, dy)
-            element.item.update()
+            dx = x_p - self.nodes.get("x_p", row)
+            dy = y_p - self.nodes.get("y_p", row)
+            item = self.node_items[row]
+            item.moveBy(dx, dy)
+            item.update()
         else:
             gv = self.main_window.map_widget.graphics_view
-            direction = element.data["pose"]["direction"]
-            new_elem = gv.draw_node(x_c, y_c, direction)
-            gv.scene.removeItem(element.item)
-            element.item = new_elem
+            direction = self.nodes.direction_name(self.nodes.get("direction", row))
+            new_item = gv.draw_node(x_c, y_c, direction)
+            gv.remove_item(self.node_items[row])
+            self.node_items[row] = new_item
+            if self.nodes.get("id", row) in self.selected_ids:
+                self.restyle_nodes([row])
 
-        element.internal_data["x_p"] = point.x()
-        element.internal_data["y_p"] = point.y()
-        element.data["pose"]["x"] = x_c
-        element.data["pose"]["y"] = y_c
+        self.nodes.set("x_p", row, x_p)
+        self.nodes.set("y_p", row, y_p)
+        self.nodes.set("x", row, x_c)
+        self.nodes.set("y", row, y_c)
+        self.spatial_index.move_point(("NODE", self.nodes.get("id", row)), x_p, y_p, self.node_pad)
 
-        self.update_elements()
+        self.update_elements(row)
+        return x_c, y_c
 
-        print(f"Move {element.attribute} {element.data['id']} to ({x_c:.2f}, {y_c:.2f})")
+    # NOTE: the bulk operations below are applied to the model and scene as one batch,
+    # edges and headings are updated once for the whole batch
 
-    def update_elements(self):
-        self.update_edges()
-        self.update_nodes()
-        self.is_saved = False
+    # nodes is a list of (row, node dict), rows are the rows after insertion in ascending order
+    def insert_nodes(self, nodes):
+        if len(nodes) == 0:
+            return
+        gv = self.main_window.map_widget.graphics_view
+        n = len(self.nodes)
+        rows = [row for row, _ in nodes]
+        node_dicts = [node for _, node in nodes]
+        x_c = [node["pose"]["x"] for node in node_dicts]
+        y_c = [node["pose"]["y"] for node in node_dicts]
+        x_p, y_p = self.coords2pixels(x_c, y_c)
+        new_items = gv.draw_nodes(x_c, y_c, [node["pose"]["direction"] for node in node_dicts])
+        self.nodes.insert_nodes(rows, node_dicts, x_p, y_p)
 
-    def update_edges(self):
-        # delete all edges (POWER IMPLEMENTATION)
-        elements_to_delete = []
-        for element in self.elements:
-            if element.attribute == "EDGE":
-                elements_to_delete.append(element)
+        m = len(self.nodes)
+        inserted = np.zeros(m, dtype=bool)
+        inserted[rows] = True
+        old_items = iter(self.node_items)
+        new_items = iter(new_items)
+        self.node_items = [next(new_items) if is_inserted else next(old_items) for is_inserted in inserted.tolist()]
+        for node, x_p_i, y_p_i in zip(node_dicts, x_p.tolist(), y_p.tolist()):
+            self.spatial_index.insert_point(("NODE", node["id"]), x_p_i, y_p_i, self.node_pad, priority=0)
 
-        for element in elements_to_delete:
-            self.delete_element(element, update=False)
+        # an old edge is kept (with a new end if nodes were inserted after its start),
+        # inserted nodes and the former last node get a new edge
+        old_row = np.cumsum(~inserted) - 1
+        reuse = ~inserted[:-1] & (old_row[:-1] < n - 1)
+        edge_items = [None] * (m - 1)
+        for row, edge_item in zip(np.nonzero(reuse)[0].tolist(), self.edge_items):
+            edge_items[row] = edge_item
+        self.edge_items = edge_items
+        for row in np.nonzero(~reuse)[0].tolist():
+            self.edge_items[row] = self.create_edge(row)
+        for row in np.nonzero(reuse & inserted[1:])[0].tolist():
+            self.set_edge(row)
 
-        # draw edges connecting each node
-        node_elems = [element for element in self.elements if element.attribute == "NODE"]
-        for idx, elem in enumerate(node_elems):
-            if idx == 0:
-                continue
-            prev_elem = node_elems[idx - 1]
+        self.update_all_nodes()
+        self.mark_modified()
+        logger.info("Add %d nodes", len(nodes))
+
+    def delete_nodes(self, ids):
+        if len(ids) == 0:
+            return
+        gv = self.main_window.map_widget.graphics_view
+        n = len(self.nodes)
+        rows = np.sort([self.nodes.row_of[node_id] for node_id in ids])
+        keep = np.ones(n, dtype=bool)
+        keep[rows] = False
+        node_ids = self.nodes["id"].tolist()
+        for row in rows.tolist():
+            gv.remove_item(self.node_items[row])
+            self.spatial_index.remove(("NODE", node_ids[row]))
+
+        # an edge is kept if its start is kept and a later node is kept (its end may change)
+        kept_rows = np.nonzero(keep)[0]
+        last_kept = kept_rows[-1] if len(kept_rows) != 0 else -1
+        reuse = keep[:-1] & (np.arange(n - 1) < last_kept)
+        for row in np.nonzero(~reuse)[0].tolist():
+            gv.remove_item(self.edge_items[row])
+            self.spatial_index.remove(("EDGE", node_ids[row]))
+            self.forget_edge(node_ids[row])
+        new_row = np.cumsum(keep) - 1
+        reset_rows = new_row[:-1][reuse & ~keep[1:]].tolist()
+
+        self.edge_items = [edge_item for edge_item, is_reused in zip(self.edge_items, reuse.tolist()) if is_reused]
+        self.node_items = [node_item for node_item, is_kept in zip(self.node_items, keep.tolist()) if is_kept]
+        self.nodes.delete_rows(rows)
+        self.selected_ids.difference_update(ids)
+        for row in reset_rows:
+            self.set_edge(row)
+
+        self.update_all_nodes()
+        self.mark_modified()
+        logger.info("Delete %d nodes", len(rows))
+
+    def set_nodes_direction(self, ids, directions):
+        rows = [self.nodes.row_of[node_id] for node_id in ids]
+        for row, direction in zip(rows, directions):
+            self.nodes.set("direction", row, self.nodes.direction_code(direction))
+        self.restyle_nodes(rows)
+        self.update_headings(rows)
+        self.mark_modified()
+
+    # positions are new scene pixel positions of the nodes
+    def move_nodes(self, ids, positions, finalize=True):
+        if len(ids) == 0:
+            return
+        nodes = self.nodes
+        rows = np.array([nodes.row_of[node_id] for node_id in ids])
+        x_p, y_p = np.asarray(positions, dtype=np.float64).reshape(-1, 2).T
+        x_c, y_c = self.pixels2coords(x_p, y_p)
+        if not finalize:
+            dx = x_p - nodes["x_p"][rows]
+            dy = y_p - nodes["y_p"][rows]
+            for row, dx_i, dy_i in zip(rows.tolist(), dx.tolist(), dy.tolist()):
+                self.node_items[row].moveBy(dx_i, dy_i)
+        else:
             gv = self.main_window.map_widget.graphics_view
-            start = [prev_elem.internal_data["x_p"],
-                     prev_elem.internal_data["y_p"]]
-            end = [elem.internal_data["x_p"],
-                   elem.internal_data["y_p"]]
-            edge = gv.draw_edge(start, end)
-
-            data = {
-                "id": -1,
-                "type": -1,
-                "start_node": prev_elem.data["id"],
-                "end_node": elem.data["id"],
-                "start_pos": {
-                    "x": prev_elem.data["pose"]["x"],
-                    "y": prev_elem.data["pose"]["y"]
-                },
-                "end_pos": {
-                    "x": elem.data["pose"]["x"],
-                    "y": elem.data["pose"]["y"]
-                }
-            }
-            element = Element("EDGE", data, item=edge)
-            self.elements.append(element)
+            directions = [nodes.direction_name(code) for code in nodes["direction"][rows].tolist()]
+            new_items = gv.draw_nodes(x_c, y_c, directions)
+            for row, new_item in zip(rows.tolist(), new_items):
+                gv.remove_item(self.node_items[row])
+                new_item.setRotation(math.degrees(nodes.get("angle", row)))
+                self.node_items[row] = new_item
+            self.restyle_nodes(rows.tolist())
+
+        nodes["x_p"][rows] = x_p
+        nodes["y_p"][rows] = y_p
+        nodes["x"][rows] = x_c
+        nodes["y"][rows] = y_c
+        # NOTE: nothing is hit-tested while dragging, the index is updated by the finalizing move
+        if finalize:
+            node_ids = nodes["id"][rows].tolist()
+            for node_id, x_p_i, y_p_i in zip(node_ids, x_p.tolist(), y_p.tolist()):
+                self.spatial_index.move_point(("NODE", node_id), x_p_i, y_p_i, self.node_pad)
 
-    def update_nodes(self):
-        node_elems = [element for element in self.elements if element.attribute == "NODE"]
+        # edges on both sides of every moved node, each edge once
+        edge_rows = set(rows[rows > 0] - 1) | set(rows[rows < len(nodes) - 1])
+        for row in sorted(int(row) for row in edge_rows):
+            self.set_edge(row, index=finalize)
 
-        for idx, elem in enumerate(node_elems):
-            if idx == 0:
-                elem.internal_data["angle"] = math.pi/2
-                angle = math.degrees(elem.internal_data["angle"])
-                elem.item.setRotation(angle)
+        self.update_headings(rows.tolist())
+        self.mark_modified()
+
+    def set_nodes_position(self, ids, positions):
+        self.move_nodes(ids, positions)
+
+    # a single edit only propagates locally, batches are recomputed at once
+    def update_headings(self, rows):
+        if len(rows) == 1:
+            self.update_nodes(rows[0])
+        else:
+            self.update_all_nodes()
+
+    # NOTE: selected nodes are drawn with the selection style instead of their direction style
+    def restyle_nodes(self, rows):
+        gv = self.main_window.map_widget.graphics_view
+        for row in rows:
+            if self.nodes.get("id", row) in self.selected_ids:
+                pen, brush = gv.selection_style()
             else:
-                prev_elem = node_elems[idx - 1]
-                if prev_elem.data["pose"]["direction"] == "head":
-                    prev_elem = node_elems[idx - 1]
-                    dx = elem.internal_data["x_p"] - prev_elem.internal_data["x_p"]
-                    dy = elem.internal_data["y_p"] - prev_elem.internal_data["y_p"]
-                    angle = math.atan2(dy, dx) + math.pi/2
-                    prev_elem.internal_data["angle"] = angle
-                elif prev_elem.data["pose"]["direction"] == "keep":
-                    angle = prev_elem.internal_data["angle"]
-                else:
-                    print("Error: Invalid direction")
-                    angle = prev_elem.internal_data["angle"]
+                pen, brush = gv.node_style(self.nodes.direction_name(self.nodes.get("direction", row)))
+            item = self.node_items[row]
+            item.setPen(pen)
+            item.setBrush(brush)
+
+    def select_nodes(self, ids, add=False):
+        if not add:
+            self.clear_selection()
+        ids = [node_id for node_id in ids if node_id in self.nodes and node_id not in self.selected_ids]
+        self.selected_ids.update(ids)
+        self.restyle_nodes([self.nodes.row_of[node_id] for node_id in ids])
+
+    def toggle_node_selection(self, node_id):
+        if node_id in self.selected_ids:
+            self.selected_ids.discard(node_id)
+            self.restyle_nodes([self.nodes.row_of[node_id]])
+        else:
+            self.select_nodes([node_id], add=True)
+
+    def select_nodes_in_rect(self, rect, add=False):
+        x_p = self.nodes["x_p"]
+        y_p = self.nodes["y_p"]
+        inside = (x_p >= rect.left()) & (x_p <= rect.right()) & (y_p >= rect.top()) & (y_p <= rect.bottom())
+        self.select_nodes(self.nodes["id"][inside].tolist(), add=add)
+        logger.info("Select %d nodes", len(self.selected_ids))
+
+    def select_all(self):
+        self.select_nodes(self.nodes["id"].tolist())
+
+    def clear_selection(self):
+        rows = [self.nodes.row_of[node_id] for node_id in self.selected_ids if node_id in self.nodes]
+        self.selected_ids = set()
+        self.restyle_nodes(rows)
+
+    # selected ids in route order
+    def selected_in_order(self):
+        return sorted(self.selected_ids, key=self.nodes.row_of.__getitem__)
+
+    def delete_selected(self):
+        ids = self.selected_in_order()
+        if len(ids) == 0:
+            return
+        nodes = [(self.nodes.row_of[node_id], self.nodes.to_dict(self.nodes.row_of[node_id])) for node_id in ids]
+        self.delete_nodes(ids)
+        self.undo_stack.push(DeleteNodesDelta(nodes))
+
+    def set_selected_direction(self, direction):
+        ids = self.selected_in_order()
+        if len(ids) == 0:
+            return
+        old_directions = [self.nodes.direction_name(self.nodes.get("direction", self.nodes.row_of[node_id]))
+                          for node_id in ids]
+        self.set_nodes_direction(ids, [direction] * len(ids))
+        self.undo_stack.push(DirectionDelta(ids, old_directions, [direction] * len(ids)))
+        logger.info("Set direction of %d nodes to %s", len(ids), direction)
+
+    # translate the whole selection by the displacement of the dragged element
+    def move_selection(self, element, point, finalize=False):
+        ids = self.selected_in_order()
+        rows = [self.nodes.row_of[node_id] for node_id in ids]
+        dx = point.x() - self.nodes.get("x_p", element.row)
+        dy = point.y() - self.nodes.get("y_p", element.row)
+        old_pos = np.stack([self.nodes["x_p"][rows], self.nodes["y_p"][rows]], axis=-1)
+        new_pos = old_pos + [dx, dy]
+        self.move_nodes(ids, new_pos, finalize=finalize)
+        self.undo_stack.push(MoveNodesDelta(ids, old_pos.tolist(), new_pos.tolist(), is_open=not finalize))
+
+        if finalize:
+            logger.info("Move %d nodes", len(ids))
+
+    def undo(self):
+        delta = self.undo_stack.undo(self)
+        if delta is None:
+            logger.info("Nothing to undo")
+            return
+        logger.info("Undo %s", delta.name)
+
+    def redo(self):
+        delta = self.undo_stack.redo(self)
+        if delta is None:
+            logger.info("Nothing to redo")
+            return
+        logger.info("Redo %s", delta.name)
+
+    # idx is the row of the edited node (or where it was, when deleted)
+    # the route changed, also refreshes the bounds of the route layer
+    def mark_modified(self):
+        self.is_saved = False
+        self.main_window.map_widget.graphics_view.route_changed()
+
+    @timed
+    def update_elements(self, idx, added=False, deleted_id=None):
+        self.update_edges(idx, added=added, deleted_id=deleted_id)
+        self.update_nodes(idx)
+        self.mark_modified()
+
+    # only the one or two edges next to the edited node are touched
+    # NOTE: edge_items[i] connects rows i and i + 1, its index key is the id of row i
+    def update_edges(self, idx, added=False, deleted_id=None):
+        n = len(self.nodes)
+        if added:
+            # row idx was inserted, split the edge it lands on
+            if 0 < idx < n - 1:
+                self.set_edge(idx - 1)
+                self.edge_items.insert(idx, self.create_edge(idx))
+            elif idx > 0:
+                self.edge_items.insert(idx - 1, self.create_edge(idx - 1))
+            elif n > 1:
+                self.edge_items.insert(0, self.create_edge(0))
+        elif deleted_id is not None:
+            # the node formerly at idx is gone, join its neighbours
+            if len(self.edge_items) == 0:
+                return
+            if 0 < idx < n:
+                self.remove_edge(idx, deleted_id)
+                self.set_edge(idx - 1)
+            elif idx == 0:
+                self.remove_edge(0, deleted_id)
+            else:
+                self.remove_edge(idx - 1, self.nodes.get("id", idx - 1))
+        else:
+            if idx > 0:
+                self.set_edge(idx - 1)
+            if idx < len(self.edge_items):
+                self.set_edge(idx)
+
+    def edge_points(self, row):
+        x_p = self.nodes["x_p"]
+        y_p = self.nodes["y_p"]
+        return float(x_p[row]), float(y_p[row]), float(x_p[row + 1]), float(y_p[row + 1])
+
+    def create_edge(self, row):
+        gv = self.main_window.map_widget.graphics_view
+        s_x_p, s_y_p, e_x_p, e_y_p = self.edge_points(row)
+        edge_item = gv.draw_edge([s_x_p, s_y_p], [e_x_p, e_y_p])
+        node_id = self.nodes.get("id", row)
+        self.spatial_index.insert_segment(("EDGE", node_id), s_x_p, s_y_p, e_x_p, e_y_p, EDGE_HIT_PAD, priority=1)
+        # a new item has the normal pen
+        self.unsafe_edges.discard(node_id)
+        self.mark_edge_unchecked(node_id)
+        return edge_item
+
+    # update an existing edge in place (line geometry and index)
+    def set_edge(self, row, index=True):
+        points = self.edge_points(row)
+        self.edge_items[row].setLine(*points)
+        node_id = self.nodes.get("id", row)
+        if index:
+            self.spatial_index.insert_segment(("EDGE", node_id), *points, EDGE_HIT_PAD, priority=1)
+        self.mark_edge_unchecked(node_id)
+
+    def remove_edge(self, row, start_id):
+        gv = self.main_window.map_widget.graphics_view
+        gv.remove_item(self.edge_items.pop(row))
+        self.spatial_index.remove(("EDGE", start_id))
+        self.forget_edge(start_id)
+
+    # edge dict in the elements file schema
+    def edge_data(self, row):
+        nodes = self.nodes
+        return {
+            "id": -1,
+            "type": -1,
+            "start_node": nodes.get("id", row),
+            "end_node": nodes.get("id", row + 1),
+            "start_pos": {
+                "x": nodes.get("x", row),
+                "y": nodes.get("y", row)
+            },
+            "end_pos": {
+                "x": nodes.get("x", row + 1),
+                "y": nodes.get("y", row + 1)
+            }
+        }
 
-                elem.internal_data["angle"] = angle
-                angle = math.degrees(angle)
-                prev_elem.item.setRotation(angle)
+    def edges_data(self):
+        ids = self.nodes["id"].tolist()
+        x_c = self.nodes["x"].tolist()
+        y_c = self.nodes["y"].tolist()
+        return [{
+            "id": -1,
+            "type": -1,
+            "start_node": ids[row],
+            "end_node": ids[row + 1],
+            "start_pos": {"x": x_c[row], "y": y_c[row]},
+            "end_pos": {"x": x_c[row + 1], "y": y_c[row + 1]}
+        } for row in range(len(ids) - 1)]
+
+    # NOTE: heading of a "head" node points to the next node,
+    # a "keep" node (and the last node) inherits the heading of the previous node
+    def node_heading(self, idx):
+        nodes = self.nodes
+        if nodes.get("direction", idx) == HEAD and idx < len(nodes) - 1:
+            dx = nodes.get("x_p", idx + 1) - nodes.get("x_p", idx)
+            dy = nodes.get("y_p", idx + 1) - nodes.get("y_p", idx)
+            return math.atan2(dy, dx) + math.pi/2
+        elif idx > 0:
+            return nodes.get("angle", idx - 1)
+        else:
+            return math.pi/2
+
+    # an edit at idx changes the headings of idx - 1 and idx,
+    # then the change only propagates along the following chain of "keep" nodes
+    def update_nodes(self, idx):
+        nodes = self.nodes
+        for i in range(max(idx - 1, 0), len(nodes)):
+            if i > idx and nodes.get("direction", i) == HEAD and i < len(nodes) - 1:
+                break
+            angle = self.node_heading(i)
+            if i > idx and angle == nodes.get("angle", i):
+                break
+            nodes.set("angle", i, angle)
+            self.node_items[i].setRotation(math.degrees(angle))
+
+    def update_all_nodes(self):
+        if len(self.nodes) == 0:
+            return
+        nodes = self.nodes
+        angles = compute_headings(nodes["x_p"], nodes["y_p"], nodes["direction"] == HEAD)
+        # only the items whose heading changed are rotated
+        changed = np.nonzero(angles != nodes["angle"])[0]
+        nodes["angle"][:] = angles
+        for row, angle in zip(changed.tolist(), np.degrees(angles[changed]).tolist()):
+            self.node_items[row].setRotation(angle)
 
     def save_elements(self):
         save_data = {
             "OCC_MAP_NAME": self.map_yaml_path
         }
-        for element in self.elements:
-            if element.attribute not in save_data:
-                save_data[element.attribute] = []
-            save_data[element.attribute].append(element.data)
+        if len(self.nodes) != 0:
+            save_data["NODE"] = self.nodes.to_dicts()
+        if len(self.edge_items) != 0:
+            save_data["EDGE"] = self.edges_data()
 
         with open(self.elements_path, 'w') as file:
-            yaml.dump(save_data, file)
+            yaml.dump(save_data, file, Dumper=YamlDumper)
             self.is_saved = True
-        print(f"Save elements to {self.elements_path}")
+        logger.info("Save elements to %s", self.elements_path)
+
+        # the sidecar is written after the yaml, so it is the newer one
+        sm = self.main_window.setting_manager.stgs["map_manager"]
+        sidecar_path = sidecar_path_of(self.elements_path)
+        if sm["binary_sidecar"]:
+            save_sidecar(sidecar_path, self.nodes, self.map_yaml_path)
+            logger.info("Save elements to %s", sidecar_path)
+        elif os.path.exists(sidecar_path):
+            # a stale sidecar would shadow the yaml on the next open
+            os.remove(sidecar_path)
 
-    def check_validation(self, elements_path):
-        with open(elements_path, 'r') as file:
-            elements = yaml.safe_load(file)
+    def check_validation(self, elements):
+        if not isinstance(elements, dict):
+            logger.error("Elements file is not a mapping")
+            return False
 
         # check validation
         if "NODE" in elements and len(elements["NODE"]) != 0:
             node_elems = elements["NODE"]
+            ids = set()
             for node_elem in node_elems:
                 if "id" not in node_elem:
-                    print("Error: 'id' not in node_elem")
+                    logger.error("'id' not in node_elem")
                     return False
+                if node_elem["id"] in ids:
+                    logger.error("Duplicate id %s", node_elem["id"])
+                    return False
+                ids.add(node_elem["id"])
                 if "pose" not in node_elem:
-                    print("Error: 'pose' not in node_elem")
+                    logger.error("'pose' not in node_elem")
                     return False
                 if "type" not in node_elem:
-                    print("Error: 'type' not in node_elem")
+                    logger.error("'type' not in node_elem")
                 if "x" not in node_elem["pose"]:
-                    print("Error: 'x' not in node_elem['pose']")
+                    logger.error("'x' not in node_elem['pose']")
                     return False
                 if "y" not in node_elem["pose"]:
-                    print("Error: 'y' not in node_elem['pose']")
+                    logger.error("'y' not in node_elem['pose']")
                     return False
                 if "direction" not in node_elem["pose"]:
-                    print("Error: 'direction' not in node_elem['pose']")
+                    logger.error("'direction' not in node_elem['pose']")
                     return False
 
         return True
 
+# vectorized version of MapManager.node_heading() for a whole route
+def compute_headings(x_p, y_p, is_head):
+    n = len(x_p)
+    headings = np.full(n, math.pi/2)
+    headings[:-1] = np.arctan2(np.diff(y_p), np.diff(x_p)) + math.pi/2
+
+    # forward fill from the last "head" node (the last node never points anywhere)
+    defined = is_head.copy()
+    defined[-1] = False
+    source = np.where(defined, np.arange(n), -1)
+    source = np.maximum.accumulate(source)
+    return np.where(source >= 0, headings[np.maximum(source, 0)], math.pi/2)
+
+# NOTE: thin view of a node (or of the edge starting at a node) in MapManager.nodes
+# views are created on demand, the data itself lives in the node store
 class Element():
-    def __init__(self, attribute, data, internal_data=None, item=None):
+    __slots__ = ("manager", "attribute", "id", "temp_style_applied", "original_pen", "original_brush")
+
+    def __init__(self, manager, attribute, node_id):
+        self.manager = manager
         self.attribute = attribute
-        self.data = data
-        self.internal_data = internal_data
-        self.item = item
+        self.id = node_id
         self.temp_style_applied = False
 
+    def __eq__(self, other):
+        return isinstance(other, Element) and (self.attribute, self.id) == (other.attribute, other.id)
+
+    def __hash__(self):
+        return hash((self.attribute, self.id))
+
+    @property
+    def row(self):
+        return self.manager.nodes.row_of[self.id]
+
+    @property
+    def item(self):
+        if self.attribute == "NODE":
+            return self.manager.node_items[self.row]
+        return self.manager.edge_items[self.row]
+
+    @property
+    def data(self):
+        if self.attribute == "NODE":
+            return self.manager.nodes.to_dict(self.row)
+        return self.manager.edge_data(self.row)
+
     def apply_temp_style(self, pen=None, brush=None):
         if not self.temp_style_applied:
             self.temp_style_applied = True
@@ -366,22 +1152,32 @@ class Element():
 
     @property
     def info_text(self):
+        data = self.data
         text = ""
         if self.attribute == "NODE":
             text += "Node\n"
-            text += f"ID: {self.data['id']}\n"
-            text += f"Type: {self.data['type']}\n"
-            text += f"X: {self.data['pose']['x']:.2f}\n"
-            text += f"Y: {self.data['pose']['y']:.2f}\n"
-            text += f"Direction: {self.data['pose']['direction']}"
+            text += f"ID: {data['id']}\n"
+            text += f"Type: {data['type']}\n"
+            text += f"X: {data['pose']['x']:.2f}\n"
+            text += f"Y: {data['pose']['y']:.2f}\n"
+            text += f"Direction: {data['pose']['direction']}"
         elif self.attribute == "EDGE":
             text += "Edge\n"
-            text += f"ID: {self.data['id']}\n"
-            text += f"Type: {self.data['type']}\n"
-            text += f"Start node: {self.data['start_node']}\n"
-            text += f"End node: {self.data['end_node']}\n"
-            text += f"Start pos: ({self.data['start_pos']['x']:.2f}, {self.data['start_pos']['y']:.2f})\n"
-            text += f"End pos: ({self.data['end_pos']['x']:.2f}, {self.data['end_pos']['y']:.2f})"
+            text += f"ID: {data['id']}\n"
+            text += f"Type: {data['type']}\n"
+            text += f"Start node: {data['start_node']}\n"
+            text += f"End node: {data['end_node']}\n"
+            text += f"Start pos: ({data['start_pos']['x']:.2f}, {data['start_pos']['y']:.2f})\n"
+            text += f"End pos: ({data['end_pos']['x']:.2f}, {data['end_pos']['y']:.2f})"
+            clearance = self.manager.edge_clearance.get(self.id)
+            if clearance is not None:
+                max_distance = self.manager.main_window.setting_manager.stgs["map_manager"]["clearance"]["max_distance"]
+                if clearance >= max_distance:
+                    text += f"\nClearance: >= {max_distance:.2f} m"
+                else:
+                    text += f"\nClearance: {clearance:.2f} m"
+                if self.id in self.manager.unsafe_edges:
+                    text += " (unsafe)"
 
         return text
 
@@ -407,9 +1203,62 @@ class settingManager():
             'map_widget': {
                 'zoom_factor': 1.5
             },
+            'profiling': {
+                'enabled': False,           # also enabled by BRUSHEE_PROFILE=1
+                'capture_dir': None,        # cProfile captures, ~/.cache/brushee_gui/profiles by default
+                'overlay_interval': 250     # [ms] refresh of the performance overlay
+            },
+            'logging': {
+                'level': 'INFO',            # console
+                'buffer_level': 'INFO',     # log viewer (Help > Show Log)
+                'buffer_size': 1000         # records kept for the log viewer
+            },
+            'map_manager': {
+                'binary_sidecar': True,
+                'undo_depth': 1000,
+                'clearance': {
+                    'enabled': True,
+                    'safety_distance': 0.3,     # [m]
+                    'max_distance': 1.0,        # [m] distances are exact up to this
+                    'unknown_is_occupied': True,
+                    'tile_size': 256
+                },
+                'auto_route': {
+                    'enabled': False,
+                    'grid_resolution': 0.2,     # [m] cell size of the planning grid
+                    'inflation_radius': 0.3,    # [m] no route closer to obstacles
+                    'cost_radius': 0.6,         # [m] routes prefer to stay this far away
+                    'cost_weight': 2.0,
+                    'search_margin': 20.0       # [m] initial search window around start and goal
+                },
+                'map_cache': {
+                    'enabled': True,
+                    'dir': None,
+                    'max_size_mb': 1024,
+                    'memory_entries': 4
+                }
+            },
             'map_graphics_view': {
+                'render_mode': 'items',
+                'lod': {
+                    'node_min_size': 4,
+                    'cluster_cell_size': 48,
+                    'cluster_min_count': 10,
+                    'cluster_marker_size': 28,
+                    'point_size': 3,
+                    'cluster_pen': '#804000',
+                    'cluster_brush': '#FFE4B5'
+                },
+                'paint_mode': {
+                    'brush_radius': 0.1     # [m]
+                },
                 'move_mode': {
-                    'click_th': 10
+                    'click_th': 10,
+                    'frame_interval': 16    # [ms]
+                },
+                'map_layer': {
+                    'tile_size': 256,
+                    'tile_cache_size': 512
                 },
                 'node': {
                     'triangle_base_size': 0.3,
@@ -427,10 +1276,15 @@ class settingManager():
                     'kn_pen_w': 1,
                     'on_brush': '#D3D3D3',
                     'on_pen': '#808080',
-                    'on_pen_w': 1
+                    'on_pen_w': 1,
+                    'sel_brush': '#FFD700',
+                    'sel_pen': '#FF00FF',
+                    'sel_pen_w': 2
                 },
                 'edge': {
-                    'pen': '#FFA500'
+                    'pen': '#FFA500',
+                    'unsafe_pen': '#FF0000',
+                    'unsafe_pen_w': 2
                 }
             }
         }
@@ -456,5 +1310,5 @@ class settingManager():
                                         settings[key][sub_key][sub_sub_key] = sub_sub_value
                 return settings
         except Exception as e:
-            print(f"Error loading settings: {e}")
+            logger.error("Can't load settings: %s", e)
             return default_settings
@@ -0,0 +1,130 @@
+from PyQt5.QtWidgets import QProgressDialog
+from PyQt5.QtCore import Qt, QTimer
+from concurrent.futures import ThreadPoolExecutor
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# NOTE: the elements file is parsed and the map is decoded on two worker threads at the same time,
+# only the final scene population is done on the Qt thread (by the callback)
+class FileLoader():
+    POLL_INTERVAL = 50  # [ms]
+
+    def __init__(self, map_manager, parent=None):
+        # class variable initialization
+        self.map_manager = map_manager
+        self.parent = parent
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.elements_future = None
+        self.map_future = None
+        self.is_map_retried = False
+        self.callback = None
+        self.progress = None
+
+        # results are collected by polling, so that the callback runs on the Qt thread
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.poll)
+
+    @property
+    def is_busy(self):
+        return self.elements_future is not None
+
+    # callback(elements, decoded_map) is called with None for the part that failed
+    def load(self, elements_path, callback):
+        if self.is_busy:
+            logger.error("Another file is being loaded")
+            return
+
+        self.callback = callback
+        self.elements_future = self.executor.submit(self.map_manager.read_elements, elements_path)
+        self.map_future = self.executor.submit(self.guess_and_read_map, elements_path)
+
+        self.progress = QProgressDialog(f"Loading {os.path.basename(elements_path)} ...", "Cancel", 0, 3, self.parent)
+        self.progress.setWindowTitle("Open Map Elements File")
+        self.progress.setWindowModality(Qt.WindowModal)
+        self.progress.setMinimumDuration(300)
+        self.progress.setValue(0)
+        self.progress.canceled.connect(self.cancel)
+        self.timer.start(self.POLL_INTERVAL)
+
+    def guess_and_read_map(self, elements_path):
+        map_yaml_path = self.map_manager.peek_map_yaml_path(elements_path)
+        return self.read_map(map_yaml_path)
+
+    # (map_yaml_path, decoded map or None), a failed decode is logged here once
+    def read_map(self, map_yaml_path):
+        if map_yaml_path is None:
+            return map_yaml_path, None
+        try:
+            return map_yaml_path, self.map_manager.read_map(map_yaml_path)
+        except Exception as e:
+            logger.error("Can't load map file %s: %s", map_yaml_path, e)
+            return map_yaml_path, None
+
+    def poll(self):
+        if not self.is_busy:
+            return
+        n_done = self.elements_future.done() + self.map_future.done()
+        self.progress.setValue(n_done)
+        if not self.elements_future.done():
+            return
+
+        elements = self.get_result(self.elements_future)
+        if elements is None:
+            self.finish(None, None)
+            return
+        if not self.map_future.done():
+            self.progress.setLabelText("Decoding map ...")
+            return
+
+        # the guess was wrong (or not possible), decode the map named in the file
+        # NOTE: only once, a map that fails again is reported as not loaded (decoded_map is None)
+        map_yaml_path, decoded_map = self.get_result(self.map_future) or (None, None)
+        occ_map_name = elements.get("OCC_MAP_NAME")
+        if occ_map_name is not None and map_yaml_path != occ_map_name and not self.is_map_retried:
+            self.is_map_retried = True
+            self.map_future = self.executor.submit(self.read_map, occ_map_name)
+            return
+
+        self.finish(elements, decoded_map)
+
+    def get_result(self, future):
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error("Loading failed: %s", e)
+            return None
+
+    def finish(self, elements, decoded_map):
+        self.timer.stop()
+        self.progress.setLabelText("Building scene ...")
+        self.progress.setValue(2)
+        callback = self.callback
+        self.reset()
+        callback(elements, decoded_map)
+        self.close_progress()
+
+    # running workers can't be interrupted, their results are just discarded
+    def cancel(self):
+        if not self.is_busy:
+            return
+        self.timer.stop()
+        self.elements_future.cancel()
+        self.map_future.cancel()
+        self.reset()
+        self.close_progress()
+        logger.info("Cancel loading")
+
+    def reset(self):
+        self.elements_future = None
+        self.map_future = None
+        self.is_map_retried = False
+        self.callback = None
+
+    def close_progress(self):
+        if self.progress is not None:
+            self.progress.canceled.disconnect(self.cancel)
+            self.progress.setValue(self.progress.maximum())
+            self.progress.close()
+            self.progress = None
@@ -0,0 +1,91 @@
+import logging
+import json
+import sys
+import threading
+from collections import deque
+
+CONSOLE_FORMAT = "%(levelname)s %(name)s: %(message)s"
+BUFFER_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+# NOTE: every module logs to its own logger (logging.getLogger(__name__)), the handlers
+# below are attached to the root logger once per process by setup_logging()
+# NOTE: per-element messages are DEBUG, the loggers are set to the lowest handler level,
+# so with the default INFO level `logger.isEnabledFor(logging.DEBUG)` skips them entirely
+
+# keeps the last records in memory for the log viewer (Help > Show Log)
+# NOTE: records are only formatted when they are viewed
+class RingBufferHandler(logging.Handler):
+    def __init__(self, capacity=1000, level=logging.NOTSET):
+        super().__init__(level=level)
+        self.records = deque(maxlen=capacity)
+        self.setFormatter(logging.Formatter(BUFFER_FORMAT))
+
+    def emit(self, record):
+        # the message is fixed now, the arguments may change later
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        self.records.append(record)
+
+    def get_records(self, level=logging.NOTSET):
+        with self.lock:
+            records = list(self.records)
+        return [record for record in records if record.levelno >= level]
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+    def to_dict(self, record):
+        return {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.message,
+            "thread": record.threadName
+        }
+
+    # one json object per line
+    def save(self, path, level=logging.NOTSET):
+        with open(path, "w") as file:
+            for record in self.get_records(level):
+                file.write(json.dumps(self.to_dict(record)) + "\n")
+
+ring_buffer = None
+console_handler = None
+setup_lock = threading.Lock()
+
+def parse_level(level):
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).upper())
+    if not isinstance(value, int):
+        raise ValueError(f"Unknown log level: {level}")
+    return value
+
+# (re)configure the handlers from the "logging" settings
+def setup_logging(sm):
+    global ring_buffer, console_handler
+    try:
+        console_level = parse_level(sm["level"])
+        buffer_level = parse_level(sm["buffer_level"])
+    except ValueError as e:
+        console_level = buffer_level = logging.INFO
+        logging.getLogger(__name__).error("%s, use INFO", e)
+
+    with setup_lock:
+        root = logging.getLogger()
+        if console_handler is None:
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+            root.addHandler(console_handler)
+        if ring_buffer is None or ring_buffer.records.maxlen != sm["buffer_size"]:
+            records = ring_buffer.get_records() if ring_buffer is not None else []
+            if ring_buffer is not None:
+                root.removeHandler(ring_buffer)
+            ring_buffer = RingBufferHandler(sm["buffer_size"])
+            ring_buffer.records.extend(records)
+            root.addHandler(ring_buffer)
+        console_handler.setLevel(console_level)
+        ring_buffer.setLevel(buffer_level)
+        root.setLevel(min(console_level, buffer_level))
+    return ring_buffer
@@ -0,0 +1,77 @@
+from PyQt5.QtWidgets import QDialog, QPlainTextEdit, QComboBox, QPushButton, QHBoxLayout, QVBoxLayout, QFileDialog
+from PyQt5.QtGui import QFont
+import logging
+import log_utils
+
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+
+logger = logging.getLogger(__name__)
+
+# shows the in-memory log (records kept by log_utils.ring_buffer)
+class LogDialog(QDialog):
+    def __init__(self, main_window, parent=None):
+        super().__init__(parent=parent)
+        # class variable initialization
+        self.main_window = main_window
+
+        self.text = QPlainTextEdit(self)
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.text.setFont(QFont("Monospace"))
+        self.level_box = QComboBox(self)
+        self.level_box.addItems(LEVELS)
+        self.level_box.setCurrentText("INFO")
+        self.level_box.currentTextChanged.connect(self.refresh)
+        refresh_button = QPushButton("Refresh", self)
+        refresh_button.clicked.connect(self.refresh)
+        clear_button = QPushButton("Clear", self)
+        clear_button.clicked.connect(self.clear)
+        save_button = QPushButton("Save...", self)
+        save_button.clicked.connect(self.save)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.level_box)
+        buttons.addStretch()
+        buttons.addWidget(refresh_button)
+        buttons.addWidget(clear_button)
+        buttons.addWidget(save_button)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.text)
+        layout.addLayout(buttons)
+
+        self.setWindowTitle("Log")
+        self.resize(800, 400)
+        self.refresh()
+
+    def level(self):
+        return logging.getLevelName(self.level_box.currentText())
+
+    def refresh(self):
+        ring_buffer = log_utils.ring_buffer
+        if ring_buffer is None:
+            self.text.setPlainText("")
+            return
+        lines = [ring_buffer.format(record) for record in ring_buffer.get_records(self.level())]
+        self.text.setPlainText("\n".join(lines))
+        # scroll to the latest record
+        scroll_bar = self.text.verticalScrollBar()
+        scroll_bar.setValue(scroll_bar.maximum())
+
+    def clear(self):
+        if log_utils.ring_buffer is not None:
+            log_utils.ring_buffer.clear()
+        self.refresh()
+
+    # the shown records as json lines
+    def save(self):
+        if log_utils.ring_buffer is None:
+            return
+        fname, _ = QFileDialog.getSaveFileName(self, "Save Log", "log.jsonl", "JSON Lines (*.jsonl)")
+        if fname == "":
+            return
+        try:
+            log_utils.ring_buffer.save(fname, self.level())
+        except OSError as e:
+            logger.error("Can't write %s: %s", fname, e)
+            return
+        logger.info("Save log to %s", fname)
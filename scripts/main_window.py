@@ -5,6 +5,8 @@ from map_widget import MapWidget
 from menu_tab import DraggableMenuBar
 from editor_toolbar import EditorToolBar
 from data_utils import MapManager, settingManager
+from log_utils import setup_logging
+from profiler import profiler
 import os
 
 # TODO:
@@ -20,6 +22,8 @@ class MainWindow(QMainWindow):
         super().__init__()
         # class variable initialization
         self.setting_manager = settingManager(crt_dir)
+        setup_logging(self.setting_manager.stgs["logging"])
+        profiler.configure(self.setting_manager.stgs["profiling"])
         self.map_manager = MapManager(self)
         self.sm = self.setting_manager.stgs["main_window"]
         self.crt_dir = crt_dir
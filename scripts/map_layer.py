@@ -0,0 +1,110 @@
+from PyQt5.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtCore import QRectF
+from collections import OrderedDict
+import numpy as np
+import math
+
+# NOTE: level 0 is the full resolution map, level k is downsampled by 2^k
+# tiles are built only when they become visible and kept in an LRU cache
+class MapTileLayer(QGraphicsItem):
+    def __init__(self, map_np, tile_size=256, cache_size=512, parent=None):
+        super().__init__(parent)
+        # class variable initialization
+        self.levels = [map_np]
+        self.h_p, self.w_p = map_np.shape
+        self.tile_size = tile_size
+        self.cache_size = cache_size
+        self.tile_cache = OrderedDict()
+        self.max_level = 0
+        while max(self.w_p, self.h_p) / 2**self.max_level > tile_size:
+            self.max_level += 1
+
+        # item setting
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+        self.setZValue(-1)
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.w_p, self.h_p)
+
+    def paint(self, painter, option, widget=None):
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        level = self.select_level(lod)
+        scale = 2**level
+        map_level = self.get_level(level)
+        lh, lw = map_level.shape
+
+        # visible tile range at the selected level
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        if exposed.isEmpty():
+            return
+        size = self.tile_size * scale
+        tx_min = max(int(exposed.left() // size), 0)
+        ty_min = max(int(exposed.top() // size), 0)
+        tx_max = min(int(math.ceil(exposed.right() / size)), math.ceil(lw / self.tile_size))
+        ty_max = min(int(math.ceil(exposed.bottom() / size)), math.ceil(lh / self.tile_size))
+
+        for ty in range(ty_min, ty_max):
+            for tx in range(tx_min, tx_max):
+                tile = self.get_tile(level, tx, ty)
+                target = QRectF(tx * size, ty * size, tile.width() * scale, tile.height() * scale)
+                source = QRectF(0, 0, tile.width(), tile.height())
+                painter.drawPixmap(target, tile, source)
+
+    # pick the coarsest level that still has at least one map pixel per screen pixel
+    def select_level(self, lod):
+        if lod >= 1:
+            return 0
+        level = int(math.floor(math.log2(1 / lod)))
+        return min(level, self.max_level)
+
+    def get_level(self, level):
+        while len(self.levels) <= level:
+            self.levels.append(downsample(self.levels[-1]))
+        return self.levels[level]
+
+    # the map pixels in [x_min, x_max) x [y_min, y_max) changed (map_np may be a new array),
+    # only the built levels and cached tiles covering them are refreshed
+    def update_region(self, map_np, x_min, y_min, x_max, y_max):
+        self.levels[0] = map_np
+        for level in range(len(self.levels)):
+            scale = 2**level
+            lx_min, ly_min = x_min // scale, y_min // scale
+            lx_max, ly_max = -(-x_max // scale), -(-y_max // scale)
+            if level > 0:
+                prev = self.levels[level - 1]
+                block = prev[2 * ly_min:2 * ly_max, 2 * lx_min:2 * lx_max]
+                self.levels[level][ly_min:ly_max, lx_min:lx_max] = downsample(block)
+
+            # drop the tiles of this level overlapping the region
+            tx_min, ty_min = lx_min // self.tile_size, ly_min // self.tile_size
+            tx_max, ty_max = -(-lx_max // self.tile_size), -(-ly_max // self.tile_size)
+            for tx in range(tx_min, tx_max):
+                for ty in range(ty_min, ty_max):
+                    self.tile_cache.pop((level, tx, ty), None)
+        self.update(QRectF(x_min, y_min, x_max - x_min, y_max - y_min))
+
+    def get_tile(self, level, tx, ty):
+        key = (level, tx, ty)
+        if key in self.tile_cache:
+            self.tile_cache.move_to_end(key)
+            return self.tile_cache[key]
+
+        map_level = self.get_level(level)
+        y0, x0 = ty * self.tile_size, tx * self.tile_size
+        block = np.ascontiguousarray(map_level[y0:y0 + self.tile_size, x0:x0 + self.tile_size])
+        h, w = block.shape
+        image = QImage(block.data, w, h, w, QImage.Format_Grayscale8)
+        tile = QPixmap.fromImage(image)
+
+        self.tile_cache[key] = tile
+        if len(self.tile_cache) > self.cache_size:
+            self.tile_cache.popitem(last=False)
+        return tile
+
+# min pooling keeps thin (dark) walls visible when zoomed out
+def downsample(map_level):
+    h, w = map_level.shape
+    map_level = np.pad(map_level, ((0, h % 2), (0, w % 2)), mode="edge")
+    h2, w2 = map_level.shape[0] // 2, map_level.shape[1] // 2
+    return map_level.reshape(h2, 2, w2, 2).min(axis=(1, 3))
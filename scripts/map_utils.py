@@ -0,0 +1,329 @@
+import numpy as np
+from collections import OrderedDict
+import threading
+import hashlib
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+PGM_HEADER_CHUNK = 4096
+
+class PgmImage():
+    def __init__(self, map_type, width, height, max_val, data, offset=None):
+        self.map_type = map_type
+        self.width = width
+        self.height = height
+        self.max_val = max_val
+        self.data = data        # (height, width) array, read-only memmap view for P5
+        self.offset = offset    # byte offset of the raster (P5 only)
+
+# NOTE: header is "magic width height maxval" separated by whitespace,
+# and "#" starts a comment running to the end of the line (any number of them)
+def parse_pgm_header(buf):
+    tokens = []
+    pos = 0
+    while len(tokens) < 4:
+        if pos >= len(buf):
+            raise ValueError("Truncated PGM header")
+        c = buf[pos:pos + 1]
+        if c == b"#":
+            end = buf.find(b"\n", pos)
+            if end == -1:
+                raise ValueError("Truncated PGM header")
+            pos = end + 1
+        elif c.isspace():
+            pos += 1
+        else:
+            start = pos
+            while pos < len(buf) and not buf[pos:pos + 1].isspace() and buf[pos:pos + 1] != b"#":
+                pos += 1
+            tokens.append(buf[start:pos])
+
+    # exactly one whitespace character separates maxval from the raster
+    if pos >= len(buf):
+        raise ValueError("Truncated PGM header")
+    pos += 1
+
+    map_type = tokens[0].decode("ascii")
+    width, height, max_val = (int(token) for token in tokens[1:])
+    return map_type, width, height, max_val, pos
+
+def read_pgm(pgm_path):
+    rollback_pgm(pgm_path)
+    # grow the header buffer until every comment line fits
+    chunk_size = PGM_HEADER_CHUNK
+    with open(pgm_path, "rb") as file:
+        while True:
+            file.seek(0)
+            header = file.read(chunk_size)
+            try:
+                map_type, width, height, max_val, offset = parse_pgm_header(header)
+                break
+            except ValueError:
+                if len(header) < chunk_size:
+                    raise
+                chunk_size *= 2
+    if not 0 < max_val < 65536:
+        raise ValueError(f"Invalid max value: {max_val}")
+
+    # 16-bit samples are stored big-endian (most significant byte first)
+    dtype = np.dtype(np.uint8) if max_val < 256 else np.dtype(">u2")
+    if map_type == "P5":
+        # zero-copy: pages are only read when pixels are actually touched
+        data = np.memmap(pgm_path, dtype=dtype, mode="r", offset=offset, shape=(height, width))
+        return PgmImage(map_type, width, height, max_val, data, offset=offset)
+    elif map_type == "P2":
+        with open(pgm_path, "rb") as file:
+            file.seek(offset)
+            text = file.read().decode("ascii")
+        values = np.fromstring(text, dtype=np.int64, sep=" ")
+        if len(values) < width * height:
+            raise ValueError("Truncated PGM raster")
+        data = values[:width * height].astype(dtype.newbyteorder("=")).reshape(height, width)
+        return PgmImage(map_type, width, height, max_val, data)
+    else:
+        raise ValueError(f"Unsupported map type: {map_type}")
+
+# NOTE: pixel value -> display value is a pure function of the pixel value,
+# so the whole threshold is evaluated once per possible value (lookup table)
+# and then applied to the raster with a single fancy-indexing pass
+# NOTE: 16-bit maps are scaled down to 8-bit for display
+def threshold_lut(max_val, negate, occupied_thresh, free_thresh, size=256):
+    values = np.arange(size, dtype=np.float64)
+    if negate:
+        cell = (max_val - values) / max_val
+    else:
+        cell = values / max_val
+
+    # same branch order as the original per-pixel loop
+    display_max = min(max_val, 255)
+    lut = np.trunc(cell * display_max)
+    lut[cell < free_thresh] = 0
+    lut[cell > occupied_thresh] = display_max
+    return lut.astype(np.uint8)
+
+def threshold_map(raw_map, max_val, negate, occupied_thresh, free_thresh):
+    size = np.iinfo(raw_map.dtype).max + 1
+    lut = threshold_lut(max_val, negate, occupied_thresh, free_thresh, size=size)
+    return lut[raw_map]
+
+# occupied cells for each raw value with the map_server semantics
+# (occupancy above occupied_thresh, free below free_thresh, unknown in between)
+# NOTE: values above max_val (invalid in a pgm) are occupied, so no route goes through them
+def occupancy_lut(max_val, negate, occupied_thresh, free_thresh, unknown_is_occupied=True, size=256):
+    values = np.arange(size, dtype=np.float64)
+    if negate:
+        occupancy = values / max_val
+    else:
+        occupancy = (max_val - values) / max_val
+    if unknown_is_occupied:
+        lut = occupancy >= free_thresh
+    else:
+        lut = occupancy > occupied_thresh
+    lut[max_val + 1:] = True
+    return lut
+
+# raw pgm values of an occupied and a free cell
+def occupancy_values(max_val, negate):
+    if negate:
+        return max_val, 0
+    return 0, max_val
+
+# NOTE: a brush stroke between two mouse samples is stamped as one capsule
+# (all pixels whose center is within radius of the segment), so fast strokes leave no gaps
+# x, y are scene pixel coordinates, returns the changed rect (x_min, y_min, x_max, y_max) or None
+def stamp_segment(array, x_0, y_0, x_1, y_1, radius, value):
+    h, w = array.shape
+    x_min = max(int(np.floor(min(x_0, x_1) - radius)), 0)
+    y_min = max(int(np.floor(min(y_0, y_1) - radius)), 0)
+    x_max = min(int(np.ceil(max(x_0, x_1) + radius)) + 1, w)
+    y_max = min(int(np.ceil(max(y_0, y_1) + radius)) + 1, h)
+    if x_min >= x_max or y_min >= y_max:
+        return None
+
+    # distance of the pixel centers to the segment
+    x = np.arange(x_min, x_max) + 0.5
+    y = (np.arange(y_min, y_max) + 0.5)[:, None]
+    dx = x_1 - x_0
+    dy = y_1 - y_0
+    length_2 = dx**2 + dy**2
+    if length_2 == 0:
+        t = 0
+    else:
+        t = np.clip(((x - x_0) * dx + (y - y_0) * dy) / length_2, 0, 1)
+    mask = (x - x_0 - t * dx)**2 + (y - y_0 - t * dy)**2 <= radius**2
+    if not mask.any():
+        return None
+
+    # shrink the rect to the stamped pixels
+    rows = np.nonzero(mask.any(axis=1))[0]
+    cols = np.nonzero(mask.any(axis=0))[0]
+    mask = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    x_max = x_min + int(cols[-1]) + 1
+    y_max = y_min + int(rows[-1]) + 1
+    x_min += int(cols[0])
+    y_min += int(rows[0])
+    array[y_min:y_max, x_min:x_max][mask] = value
+    return x_min, y_min, x_max, y_max
+
+# NOTE: every write goes to a temporary file that replaces the pgm at the end,
+# so an interrupted save never leaves a broken map
+def write_pgm(pgm_path, data, max_val, map_type="P5"):
+    h, w = data.shape
+    header = f"{map_type}\n{w} {h}\n{max_val}\n".encode("ascii")
+    tmp_path = pgm_path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(header)
+        if map_type == "P5":
+            dtype = np.dtype(np.uint8) if max_val < 256 else np.dtype(">u2")
+            np.ascontiguousarray(data, dtype=dtype).tofile(file)
+        else:
+            np.savetxt(file, data, fmt="%d")
+    os.replace(tmp_path, pgm_path)
+    return len(header)
+
+# rewrite only the dirty rows of a P5 pgm of the same size, in place
+# NOTE: whole rows are contiguous in the file, so each run of dirty rows is one sequential write
+# NOTE: the original bytes of the dirty rows are saved to a journal ("<pgm>.journal") before
+# the pgm is touched, an interrupted save is rolled back by rollback_pgm() at the next read
+def patch_pgm(pgm_path, data, offset, dirty_rows):
+    row_bytes = data.shape[1] * data.dtype.itemsize
+    runs = row_runs(dirty_rows)
+    spans = np.array([(offset + start * row_bytes, (end - start) * row_bytes) for start, end in runs],
+                     dtype=np.int64).reshape(-1, 2)
+    journal_path = pgm_path + ".journal"
+    with open(pgm_path, "r+b") as file:
+        originals = []
+        for position, length in spans.tolist():
+            file.seek(position)
+            originals.append(np.frombuffer(file.read(length), dtype=np.uint8))
+        write_journal(journal_path, spans, originals)
+
+        for (position, _), (start, end) in zip(spans.tolist(), runs):
+            file.seek(position)
+            file.write(np.ascontiguousarray(data[start:end]).tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    os.remove(journal_path)
+
+# the journal only appears once it is complete (temporary file + replace)
+def write_journal(journal_path, spans, originals):
+    tmp_path = journal_path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        np.savez(file, spans=spans, data=np.concatenate(originals + [np.zeros(0, dtype=np.uint8)]))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, journal_path)
+
+# restore the rows of an interrupted patch_pgm(), returns True if there was one
+def rollback_pgm(pgm_path):
+    journal_path = pgm_path + ".journal"
+    if not os.path.exists(journal_path):
+        return False
+    with np.load(journal_path) as journal:
+        spans, data = journal["spans"], journal["data"]
+    with open(pgm_path, "r+b") as file:
+        start = 0
+        for position, length in spans.tolist():
+            file.seek(position)
+            file.write(data[start:start + length].tobytes())
+            start += length
+        file.flush()
+        os.fsync(file.fileno())
+    os.remove(journal_path)
+    logger.warning("Roll back the interrupted save of %s", pgm_path)
+    return True
+
+# [start, end) of each run of True in a boolean array
+def row_runs(rows):
+    edges = np.diff(np.concatenate([[0], rows.astype(np.int8), [0]]))
+    starts = np.nonzero(edges == 1)[0]
+    ends = np.nonzero(edges == -1)[0]
+    return list(zip(starts.tolist(), ends.tolist()))
+
+# NOTE: thresholded rasters are cached on disk as raw uint8 files ("<key>_<h>x<w>.raw")
+# that are memory-mapped when reused, plus an in-process LRU of the recent ones
+# the key covers the pgm file (path, mtime, size) and the threshold parameters
+class MapCache():
+    def __init__(self, cache_dir, max_size_mb=1024, memory_entries=4):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024 * 1024
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        # maps are decoded on worker threads
+        self.lock = threading.Lock()
+
+    def make_key(self, pgm_path, negate, occupied_thresh, free_thresh):
+        stat = os.stat(pgm_path)
+        source = repr((os.path.abspath(pgm_path), stat.st_mtime_ns, stat.st_size,
+                       bool(negate), float(occupied_thresh), float(free_thresh)))
+        return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+
+        path = self.find(key)
+        if path is None:
+            return None
+        try:
+            h, w = (int(v) for v in os.path.splitext(path)[0].rsplit("_", 1)[1].split("x"))
+            map_np = np.memmap(path, dtype=np.uint8, mode="r", shape=(h, w))
+            os.utime(path)  # mtime is the LRU order on disk
+        except (OSError, ValueError) as e:
+            logger.error("Broken map cache %s: %s", path, e)
+            return None
+        self.remember(key, map_np)
+        return map_np
+
+    def put(self, key, map_np):
+        self.remember(key, map_np)
+        if self.max_size <= 0:
+            return
+        h, w = map_np.shape
+        path = os.path.join(self.cache_dir, f"{key}_{h}x{w}.raw")
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = path + f".{os.getpid()}.{threading.get_ident()}.tmp"
+            np.ascontiguousarray(map_np, dtype=np.uint8).tofile(tmp_path)
+            os.replace(tmp_path, path)
+            self.evict()
+        except OSError as e:
+            logger.error("Can't write map cache %s: %s", path, e)
+
+    def remember(self, key, map_np):
+        with self.lock:
+            self.memory[key] = map_np
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def find(self, key):
+        if not os.path.isdir(self.cache_dir):
+            return None
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(key + "_") and name.endswith(".raw"):
+                return os.path.join(self.cache_dir, name)
+        return None
+
+    # remove the least recently used files until the cache fits into max_size
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".raw"):
+                path = os.path.join(self.cache_dir, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                # still mapped somewhere (Windows), try again next time
+                pass
@@ -1,7 +1,20 @@
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QGraphicsScene, QGraphicsView, QMessageBox, QToolTip
-from PyQt5.QtGui import QPen, QBrush, QColor, QPolygonF
-from PyQt5.QtCore import Qt, QEvent, QTimer, QPointF
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QGraphicsScene, QGraphicsView, QMessageBox, QToolTip, QRubberBand
+from PyQt5.QtWidgets import QGraphicsPolygonItem, QGraphicsLineItem
+from PyQt5.QtGui import QPen, QBrush, QColor, QPolygonF, QPainter
+from PyQt5.QtCore import Qt, QEvent, QTimer, QPointF, QRect, QRectF
+from map_layer import MapTileLayer
+from route_layer import RouteLayer, NodeHandle, EdgeHandle
+from profiler import profiler, timed
+from collections import deque
 import math
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+PERF_WINDOW = 60                            # frames averaged by the performance overlay
+PERF_OVERLAY_RECT = QRect(8, 8, 280, 40)    # [px] in viewport coordinates
+MAX_FREE_ITEMS = 1000                       # hidden items kept for reuse per item type
 
 class MapWidget(QWidget):
     def __init__(self, main_window, parent=None):
@@ -26,10 +39,12 @@ class MapWidget(QWidget):
     def zoom_in(self):
         zoom_factor = self.sm["zoom_factor"]
         self.graphics_view.scale(zoom_factor, zoom_factor)
+        self.graphics_view.update_lod()
 
     def zoom_out(self):
         zoom_factor = self.sm["zoom_factor"]
         self.graphics_view.scale(1/zoom_factor, 1/zoom_factor)
+        self.graphics_view.update_lod()
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Plus:
@@ -53,6 +68,37 @@ class MapGraphicsView(QGraphicsView):
         self.end_point = None
         self.moving_element = None
         self.is_moving = False
+        self.paint_point = None
+
+        # drag updates are coalesced to one per frame, only the latest pointer position is applied
+        self.drag_point = None
+        self.drag_timer = QTimer()
+        self.drag_timer.setSingleShot(True)
+        self.drag_timer.setInterval(self.sm["move_mode"]["frame_interval"])
+        self.drag_timer.timeout.connect(self.flush_drag)
+
+        # rubber band selection (SELECT mode, started on empty space)
+        self.rubber_band = QRubberBand(QRubberBand.Rectangle, self.viewport())
+        self.rubber_band_origin = None
+
+        # NOTE: removed node and edge items are hidden and reused by draw_nodes() and draw_edge(),
+        # hiding is about 3 times faster than QGraphicsScene.removeItem() in a 100k item scene,
+        # at most MAX_FREE_ITEMS per type are kept, the others are removed from the scene
+        self.free_items = {QGraphicsPolygonItem: [], QGraphicsLineItem: []}
+
+        # "items": one scene item per node and edge, "batched": one RouteLayer paints the whole route
+        # NOTE: in both modes the RouteLayer paints the overview when zoomed out,
+        # the node and edge items are hidden meanwhile (not parented to one item,
+        # the children of an item are not culled by the scene index)
+        self.render_mode = self.sm["render_mode"]
+        self.route_layer = None
+        self.is_overview = False
+
+        # pens and brushes are shared by all nodes of the same style
+        self.node_styles = {}
+        self.edge_pen = QPen(QColor(self.sm["edge"]["pen"]))
+        self.unsafe_edge_pen = QPen(QColor(self.sm["edge"]["unsafe_pen"]))
+        self.unsafe_edge_pen.setWidth(self.sm["edge"]["unsafe_pen_w"])
 
         # graphics scene setting
         self.scene = QGraphicsScene()
@@ -65,13 +111,25 @@ class MapGraphicsView(QGraphicsView):
         self.tooltip_pos = None
         self.tooltip_text = None
 
+        # frame time and input-to-paint latency (View > Show Performance Overlay)
+        # NOTE: only measured while the overlay is shown or the profiler is enabled
+        self.is_perf_overlay = False
+        self.frame_times = deque(maxlen=PERF_WINDOW)
+        self.latencies = deque(maxlen=PERF_WINDOW)
+        self.input_time = None
+        self.perf_timer = QTimer()
+        self.perf_timer.setInterval(setting_manager.stgs["profiling"]["overlay_interval"])
+        self.perf_timer.timeout.connect(lambda: self.viewport().update(PERF_OVERLAY_RECT))
+
         # map graphics view setting
         self.setMouseTracking(True)
 
   # TODO: Avoid using class variables to store state to prevent `None` errors
+    @timed
     def mousePressEvent(self, event):
         if not self.is_map_set:
             return super().mousePressEvent(event)
+        self.mark_input()
 
         self.start_point = self.mapToScene(event.pos())
         if self.edit_mode == "ADD_NODE":
@@ -81,38 +139,134 @@ class MapGraphicsView(QGraphicsView):
         elif self.edit_mode == "MOVE":
             self.move_event(event)
         elif self.edit_mode == "SELECT":
-            self.select_event()
+            self.select_event(event)
+        elif self.edit_mode in ("PAINT_MAP", "ERASE_MAP"):
+            self.paint_event(event)
 
         self.update()
         return super().mousePressEvent(event)
 
+    @timed
     def mouseMoveEvent(self, event):
         if not self.is_map_set:
             return super().mouseMoveEvent(event)
+        self.mark_input()
 
         self.current_point = self.mapToScene(event.pos())
         if self.edit_mode == "MOVE":
             self.move_event(event)
         elif self.edit_mode == "SELECT":
-            self.update_tooltip(event)
+            if self.rubber_band_origin is not None:
+                self.rubber_band.setGeometry(QRect(self.rubber_band_origin, event.pos()).normalized())
+            else:
+                self.update_tooltip(event)
+        elif self.edit_mode in ("PAINT_MAP", "ERASE_MAP"):
+            self.paint_event(event)
         self.update()
         return super().mouseMoveEvent(event)
 
+    @timed
     def mouseReleaseEvent(self, event):
         if not self.is_map_set:
             return super().mouseReleaseEvent(event)
+        self.mark_input()
 
         self.end_point = self.mapToScene(event.pos())
         if self.edit_mode == "MOVE":
             self.move_event(event)
+        elif self.edit_mode == "SELECT":
+            self.rubber_band_event(event)
+        elif self.edit_mode in ("PAINT_MAP", "ERASE_MAP"):
+            self.paint_event(event)
 
         self.update()
         return super().mouseReleaseEvent(event)
 
-    def set_map(self, map_pix):
+    # the latency of an input event lasts until the next frame is painted
+    def mark_input(self):
+        if self.input_time is None and (self.is_perf_overlay or profiler.enabled):
+            self.input_time = time.perf_counter()
+
+    def paintEvent(self, event):
+        if not (self.is_perf_overlay or profiler.enabled):
+            return super().paintEvent(event)
+
+        start = time.perf_counter()
+        super().paintEvent(event)
+        end = time.perf_counter()
+        # repaints of the overlay alone are not frames
+        if event.rect() != PERF_OVERLAY_RECT:
+            self.frame_times.append(end - start)
+            if profiler.enabled:
+                profiler.record("MapGraphicsView.paintEvent", end - start)
+            if self.input_time is not None:
+                self.latencies.append(end - self.input_time)
+                if profiler.enabled:
+                    profiler.record("input_latency", end - self.input_time)
+                self.input_time = None
+        if self.is_perf_overlay:
+            self.draw_perf_overlay()
+
+    def draw_perf_overlay(self):
+        def summary(times):
+            if len(times) == 0:
+                return "-"
+            return f"{times[-1]*1000:.1f} ms (avg {sum(times)/len(times)*1000:.1f}, max {max(times)*1000:.1f})"
+
+        painter = QPainter(self.viewport())
+        painter.fillRect(PERF_OVERLAY_RECT, QColor(0, 0, 0, 160))
+        painter.setPen(QColor("#FFFFFF"))
+        text = f"frame {summary(self.frame_times)}\nlatency {summary(self.latencies)}"
+        painter.drawText(PERF_OVERLAY_RECT.adjusted(6, 2, -6, -2), Qt.AlignLeft | Qt.AlignVCenter, text)
+        painter.end()
+
+    def set_perf_overlay(self, is_shown):
+        self.is_perf_overlay = is_shown
+        self.frame_times.clear()
+        self.latencies.clear()
+        self.input_time = None
+        if is_shown:
+            self.perf_timer.start()
+        else:
+            self.perf_timer.stop()
+        self.viewport().update()
+
+    def set_map(self, map_np):
         self.scene.clear()
-        self.scene.addPixmap(map_pix)
+        for items in self.free_items.values():
+            items.clear()
+        sm_layer = self.sm["map_layer"]
+        self.map_layer = MapTileLayer(map_np,
+                                      tile_size=sm_layer["tile_size"],
+                                      cache_size=sm_layer["tile_cache_size"])
+        self.scene.addItem(self.map_layer)
+        map_manager = self.map_widget.main_window.map_manager
+        triangle_base = self.sm["node"]["triangle_base_size"] / map_manager.resolution
+        self.route_layer = RouteLayer(self, map_manager, triangle_base, self.render_mode == "batched")
+        self.scene.addItem(self.route_layer)
+        self.is_overview = False
         self.is_map_set = True
+        self.update_lod()
+
+    # switch the node and edge items off while the route layer paints the overview,
+    # items are only touched when the threshold is crossed
+    def update_lod(self):
+        if self.route_layer is None:
+            return
+        is_overview = self.route_layer.is_overview(self.transform().m11())
+        if is_overview == self.is_overview:
+            return
+        self.is_overview = is_overview
+        if self.route_layer.is_batched:
+            return
+        map_manager = self.map_widget.main_window.map_manager
+        for item in map_manager.node_items + map_manager.edge_items:
+            item.setVisible(not is_overview)
+
+    # called by MapManager on every change of the route
+    def route_changed(self):
+        if self.route_layer is not None:
+            self.route_layer.mark_dirty()
 
     def add_node_event(self):
         self.map_manager.add_node(self.start_point)
@@ -121,7 +275,9 @@ class MapGraphicsView(QGraphicsView):
         element = self.map_manager.get_clicked_element(self.start_point)
         if element is None:
             return
-        if element.attribute == "NODE":
+        if element.attribute == "NODE" and element.id in self.map_manager.selected_ids:
+            self.delete_selected_event()
+        elif element.attribute == "NODE":
             pen = QColor(self.sm["node"]["del_pen"])
             pen = QPen(pen)
             pen.setWidth(self.sm["node"]["del_pen_w"])
@@ -129,13 +285,13 @@ class MapGraphicsView(QGraphicsView):
             brush = QBrush(brush)
             element.apply_temp_style(pen, brush)
 
-            id = element.data["id"]
+            id = element.id
             message = f"Do you want to delete node {id}?"
             reply = QMessageBox.question(None, "Delete Node", message, QMessageBox.Yes | QMessageBox.No)
             if reply == QMessageBox.Yes:
                 self.map_manager.delete_element(element)
             else:
-                print("Cancel")
+                logger.info("Cancel delete node %d", id)
                 element.apply_original_style()
 
     def move_event(self, event):
@@ -159,7 +315,9 @@ class MapGraphicsView(QGraphicsView):
             if self.moving_element is None:
                 return
 
-            self.map_manager.move_element(self.moving_element, self.current_point)
+            self.drag_point = self.current_point
+            if not self.drag_timer.isActive():
+                self.drag_timer.start()
 
         if event.type() == QEvent.MouseButtonRelease:
             if self.moving_element is None:
@@ -172,19 +330,76 @@ class MapGraphicsView(QGraphicsView):
                 if distance < self.sm["move_mode"]["click_th"]:
                     self.is_moving = True
                     return
+            # the finalizing move supersedes a pending drag update
+            self.drag_timer.stop()
+            self.drag_point = None
             self.map_manager.move_element(self.moving_element, self.end_point, finalize=True)
             self.moving_element.apply_original_style()
             self.is_moving = False
             self.moving_element = None
 
-    def select_event(self):
+    def flush_drag(self):
+        if self.drag_point is None or self.moving_element is None:
+            return
+        point = self.drag_point
+        self.drag_point = None
+        self.map_manager.move_element(self.moving_element, point)
+
+    # a stroke continues from the previous mouse sample, only the stamped rect is repainted
+    def paint_event(self, event):
+        if event.type() == QEvent.MouseButtonRelease:
+            self.paint_point = None
+            return
+        if not event.buttons() & Qt.LeftButton:
+            return
+
+        point = self.mapToScene(event.pos())
+        start = point if self.paint_point is None else self.paint_point
+        self.map_manager.paint_map(start, point, erase=self.edit_mode == "ERASE_MAP")
+        self.paint_point = point
+
+    # one confirmation for the whole selection, deleted as one batch
+    def delete_selected_event(self):
+        n_selected = len(self.map_manager.selected_ids)
+        if n_selected == 0:
+            return
+        message = f"Do you want to delete {n_selected} selected nodes?"
+        reply = QMessageBox.question(None, "Delete Nodes", message, QMessageBox.Yes | QMessageBox.No)
+        if reply == QMessageBox.Yes:
+            self.map_manager.delete_selected()
+        else:
+            logger.info("Cancel delete %d selected nodes", n_selected)
+
+    # shift + click toggles the selection of a node, a drag on empty space selects by rubber band
+    def select_event(self, event):
         element = self.map_manager.get_clicked_element(self.start_point)
         if element is None:
+            self.rubber_band_origin = event.pos()
+            self.rubber_band.setGeometry(QRect(self.rubber_band_origin, self.rubber_band_origin))
+            self.rubber_band.show()
             return
         if element.attribute == "NODE":
-            id = element.data["id"]
+            id = element.id
+            if event.modifiers() & Qt.ShiftModifier:
+                self.map_manager.toggle_node_selection(id)
+                return
             self.map_manager.switch_node_direction(element)
-            print(f"Select node {id} and switch direction mode")
+            logger.debug("Select node %d and switch direction mode", id)
+
+    def rubber_band_event(self, event):
+        if self.rubber_band_origin is None:
+            return
+        self.rubber_band.hide()
+        add = bool(event.modifiers() & Qt.ShiftModifier)
+        distance = (event.pos() - self.rubber_band_origin).manhattanLength()
+        self.rubber_band_origin = None
+        if distance < self.sm["move_mode"]["click_th"]:
+            # a plain click on empty space clears the selection
+            if not add:
+                self.map_manager.clear_selection()
+            return
+        rect = QRectF(self.start_point, self.end_point).normalized()
+        self.map_manager.select_nodes_in_rect(rect, add=add)
 
     def update_tooltip(self, event):
         element = self.map_manager.get_clicked_element(self.current_point)
@@ -202,23 +417,12 @@ class MapGraphicsView(QGraphicsView):
         if self.tooltip_pos and self.tooltip_text:
             QToolTip.showText(self.tooltip_pos, self.tooltip_text)
 
-    def draw_node(self, x_c, y_c, direction):
-        map_manager = self.map_widget.main_window.map_manager
-        triangle_base = self.sm["node"]["triangle_base_size"]
-
-        top = (x_c, y_c + triangle_base)
-        left = (x_c - triangle_base/2, y_c - triangle_base/2)
-        right = (x_c + triangle_base/2, y_c - triangle_base/2)
-        top = map_manager.coord2pixel(top)
-        left = map_manager.coord2pixel(left)
-        right = map_manager.coord2pixel(right)
-        polygon = QPolygonF([
-            QPointF(top[0], top[1]),
-            QPointF(left[0], left[1]),
-            QPointF(right[0], right[1])
-        ])
-        x_p, y_p = map_manager.coord2pixel((x_c, y_c))
+    def node_style(self, direction):
+        if direction not in self.node_styles:
+            self.node_styles[direction] = self.create_node_style(direction)
+        return self.node_styles[direction]
 
+    def create_node_style(self, direction):
         sm_node = self.sm["node"]
         if direction == "head":
             pen = QPen(QColor(sm_node["hn_pen"]))
@@ -232,19 +436,85 @@ class MapGraphicsView(QGraphicsView):
             pen = QPen(QColor(sm_node["on_pen"]))
             pen.setWidth(sm_node["on_pen_w"])
             brush = QBrush(QColor(sm_node["on_brush"]))
+        return pen, brush
 
-        node_item = self.scene.addPolygon(polygon, pen, brush)
-        node_item.setTransformOriginPoint(x_p, y_p)
+    def selection_style(self):
+        if "selected" not in self.node_styles:
+            self.node_styles["selected"] = self.create_selection_style()
+        return self.node_styles["selected"]
 
-        return node_item
+    def create_selection_style(self):
+        sm_node = self.sm["node"]
+        pen = QPen(QColor(sm_node["sel_pen"]))
+        pen.setWidth(sm_node["sel_pen_w"])
+        brush = QBrush(QColor(sm_node["sel_brush"]))
+        return pen, brush
+
+    def draw_node(self, x_c, y_c, direction):
+        return self.draw_nodes([x_c], [y_c], [direction])[0]
+
+    # geometry of all nodes is computed in one batched call
+    def draw_nodes(self, x_c, y_c, directions):
+        if self.route_layer.is_batched:
+            return [NodeHandle(self.route_layer, *self.node_style(direction)) for direction in directions]
+
+        map_manager = self.map_widget.main_window.map_manager
+        triangles = map_manager.node_triangles(x_c, y_c).tolist()
+        x_p, y_p = map_manager.coords2pixels(x_c, y_c)
+
+        node_items = []
+        for triangle, x_p_i, y_p_i, direction in zip(triangles, x_p.tolist(), y_p.tolist(), directions):
+            pen, brush = self.node_style(direction)
+            polygon = QPolygonF([QPointF(x, y) for x, y in triangle])
+            node_item = self.reuse_item(QGraphicsPolygonItem)
+            if node_item is None:
+                node_item = self.scene.addPolygon(polygon, pen, brush)
+            else:
+                node_item.setPolygon(polygon)
+                node_item.setPen(pen)
+                node_item.setBrush(brush)
+            node_item.setVisible(not self.is_overview)
+            node_item.setTransformOriginPoint(x_p_i, y_p_i)
+            node_items.append(node_item)
+
+        return node_items
 
     def draw_edge(self, start, end):
+        if self.route_layer.is_batched:
+            return EdgeHandle(self.route_layer)
+
         s_x_p, s_y_p = start
         e_x_p, e_y_p = end
-        pen = QPen(QColor(self.sm["edge"]["pen"]))
+        pen = self.edge_pen
 
-        edge_item = self.scene.addLine(s_x_p, s_y_p, e_x_p, e_y_p, pen)
+        edge_item = self.reuse_item(QGraphicsLineItem)
+        if edge_item is None:
+            edge_item = self.scene.addLine(s_x_p, s_y_p, e_x_p, e_y_p, pen)
+        else:
+            edge_item.setLine(s_x_p, s_y_p, e_x_p, e_y_p)
+            edge_item.setPen(pen)
+        edge_item.setVisible(not self.is_overview)
 
         return edge_item
 
+    # NOTE: the handles of the batched render mode are only hidden (the RouteLayer repaints)
+    def remove_item(self, item):
+        free_items = self.free_items.get(type(item))
+        if free_items is not None and len(free_items) >= MAX_FREE_ITEMS:
+            self.scene.removeItem(item)
+            return
+        item.hide()
+        if free_items is not None:
+            free_items.append(item)
+
+    # a hidden item in its initial state, or None
+    def reuse_item(self, item_type):
+        if len(self.free_items[item_type]) == 0:
+            return None
+        item = self.free_items[item_type].pop()
+        item.setPos(0, 0)
+        item.setRotation(0)
+        item.show()
+        return item
+
 
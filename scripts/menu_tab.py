@@ -1,8 +1,14 @@
 from PyQt5.QtWidgets import QMenu, QAction, QFileDialog, QMessageBox, QMenuBar, QWidget, QSizePolicy, QPushButton, QHBoxLayout
 from PyQt5.QtCore import Qt, QSize
 from PyQt5.QtGui import QIcon
+from file_loader import FileLoader
+from log_viewer import LogDialog
+from profiler import profiler
 import os
 import datetime
+import logging
+
+logger = logging.getLogger(__name__)
 
 class DraggableMenuBar(QMenuBar):
     def __init__(self, main_window, parent=None):
@@ -96,6 +102,7 @@ class FileMenu(QMenu):
         # class variable initialization
         self.main_window = main_window
         self.map_manager = main_window.map_manager
+        self.file_loader = FileLoader(self.map_manager, parent=main_window)
 
         # file menu setting
         filemenu_items = [
@@ -114,7 +121,15 @@ class FileMenu(QMenu):
             {"name": "Save As Map Elements File",
              "shortcut": "Ctrl+Shift+S",
              "status_tip": "Save the current map elements file as a new file",
-             "triggered": self.save_as_file}
+             "triggered": self.save_as_file},
+            {"name": "Overwrite Map",
+             "shortcut": "Ctrl+Alt+S",
+             "status_tip": "Write the edited map back to its pgm file",
+             "triggered": self.overwrite_map},
+            {"name": "Save As New Map",
+             "shortcut": "Ctrl+Alt+Shift+S",
+             "status_tip": "Save the edited map as a new map (pgm and map yaml)",
+             "triggered": self.save_as_map}
         ]
         for item in filemenu_items:
             action = QAction(item["name"], self)
@@ -132,6 +147,8 @@ class FileMenu(QMenu):
                 self.overwrite_file()
             elif reply == QMessageBox.Cancel:
                 return
+        if not self.check_map_saved():
+            return
 
         # open an existing map elements file
         crt_dir = self.main_window.crt_dir
@@ -147,18 +164,26 @@ class FileMenu(QMenu):
         parent_dir = os.path.dirname(child_dir)
         self.main_window.crt_dir = parent_dir
 
-        # check if the selected file is a valid map elements file
-        if self.map_manager.check_validation(elements_path):
+        # parse the elements file and decode its map in the background
+        self.file_loader.load(elements_path,
+                              lambda elements, decoded_map: self.show_opened_file(elements_path, elements, decoded_map))
+
+    # called on the Qt thread when FileLoader has finished
+    def show_opened_file(self, elements_path, elements, decoded_map):
+        # check if the selected file is a valid map elements file (parsed only once)
+        if elements is not None:
             self.map_manager.reset_data()
-            self.map_manager.load_elements(elements_path)
+            self.map_manager.load_elements(elements_path, elements)
         else:
             return
 
         # load map
         map_yaml_path = self.map_manager.map_yaml_path
-        is_map_loaded = self.map_manager.load_map(map_yaml_path)
-        if not is_map_loaded:
-            print(f"can't load map file {map_yaml_path}")
+        is_map_loaded = decoded_map is not None
+        if is_map_loaded:
+            self.map_manager.apply_map(decoded_map)
+        else:
+            logger.error("Can't load map file %s", map_yaml_path)
             is_map_loaded = self.open_map()
 
         # check if the map is loaded
@@ -168,7 +193,7 @@ class FileMenu(QMenu):
         # show map and loaded elements
         self.map_manager.show_loaded_map()
         self.map_manager.show_loaded_elements()
-        print(f"open map elements file {elements_path}")
+        logger.info("Open map elements file %s", elements_path)
 
     def create_new_file(self):
        # check if the current map elements file is saved before discarding map elements in the window
@@ -179,6 +204,8 @@ class FileMenu(QMenu):
                 self.overwrite_file()
             elif reply == QMessageBox.Cancel:
                 return
+        if not self.check_map_saved():
+            return
 
         # reset both elements and map
         self.map_manager.reset_data()
@@ -210,10 +237,10 @@ class FileMenu(QMenu):
         # load map
         is_map_loaded = self.map_manager.load_map(map_yaml_path)
         if not is_map_loaded:
-            print(f"can't load map file {map_yaml_path}")
+            logger.error("Can't load map file %s", map_yaml_path)
             return False
         else:
-            print(f"load map file {map_yaml_path}")
+            logger.info("Load map file %s", map_yaml_path)
             self.map_manager.map_yaml_path = map_yaml_path
 
         return True
@@ -225,9 +252,9 @@ class FileMenu(QMenu):
             reply = QMessageBox.question(None, "Overwrite Map Elements File", message, QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
             if reply == QMessageBox.Yes:
                 self.map_manager.save_elements()
-                print(f"overwrite {self.map_manager.elements_path}")
+                logger.info("Overwrite %s", self.map_manager.elements_path)
             else:
-                print("Cancel overwrite map elements file")
+                logger.info("Cancel overwrite map elements file")
         else:
             self.save_as_file()
 
@@ -253,19 +280,189 @@ class FileMenu(QMenu):
         # save the map elements file
         self.map_manager.elements_path = elements_path
         self.map_manager.save_elements()
-        print(f"save as {elements_path}")
+        logger.info("Save as %s", elements_path)
+
+    # ask to save the edited map before discarding it, returns False if canceled
+    def check_map_saved(self):
+        if self.map_manager.is_map_saved:
+            return True
+        message = f"Do you want to save the edited map ({self.map_manager.map_pgm_path})?"
+        reply = QMessageBox.question(None, "Save Map", message, QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
+        if reply == QMessageBox.Yes:
+            self.overwrite_map()
+        elif reply == QMessageBox.Cancel:
+            return False
+        return True
+
+    def overwrite_map(self):
+        if self.map_manager.map_pgm_path is None:
+            logger.error("No map loaded")
+            return
+        message = f"Do you want to overwrite {self.map_manager.map_pgm_path}?"
+        reply = QMessageBox.question(None, "Overwrite Map", message, QMessageBox.Yes | QMessageBox.No)
+        if reply == QMessageBox.Yes:
+            self.map_manager.save_map()
+        else:
+            logger.info("Cancel overwrite map")
+
+    def save_as_map(self):
+        if self.map_manager.map_pgm_path is None:
+            logger.error("No map loaded")
+            return
+        # get the path of the new map yaml (the pgm is written next to it)
+        crt_dir = self.main_window.crt_dir
+        date_str = datetime.datetime.now().strftime("%Y%m%d-%H%M")
+        default_path = os.path.join(crt_dir, "map-" + date_str + ".yaml")
+        fname, _ = QFileDialog.getSaveFileName(None, "Save As New Map", default_path, "Map Files (*.yaml)")
+
+        # check if the user cancels the file dialog
+        if fname == "":
+            return
+        if fname.split(".")[-1] != "yaml":
+            map_yaml_path = fname + ".yaml"
+        else:
+            map_yaml_path = fname
+        self.map_manager.save_map_as(map_yaml_path)
 
 class EditMenu(QMenu):
   def __init__(self, main_window, parent=None):
     super().__init__("&Edit", parent=parent)
+    # class variable initialization
     self.main_window = main_window
+    self.map_manager = main_window.map_manager
+
+    # edit menu setting
+    editmenu_items = [
+        {"name": "Undo",
+         "shortcut": "Ctrl+Z",
+         "status_tip": "Undo the last edit of map elements",
+         "triggered": self.map_manager.undo},
+        {"name": "Redo",
+         "shortcut": "Ctrl+Shift+Z",
+         "status_tip": "Redo the last undone edit of map elements",
+         "triggered": self.map_manager.redo},
+        {"name": "Select All Nodes",
+         "shortcut": "Ctrl+A",
+         "status_tip": "Select all nodes",
+         "triggered": self.map_manager.select_all},
+        {"name": "Clear Selection",
+         "shortcut": "Esc",
+         "status_tip": "Clear the node selection",
+         "triggered": self.map_manager.clear_selection},
+        {"name": "Delete Selected Nodes",
+         "shortcut": "Del",
+         "status_tip": "Delete all selected nodes",
+         "triggered": self.delete_selected},
+        {"name": "Set Selected Nodes to Head",
+         "shortcut": "Ctrl+Shift+H",
+         "status_tip": "Set the direction of all selected nodes to head",
+         "triggered": lambda: self.map_manager.set_selected_direction("head")},
+        {"name": "Set Selected Nodes to Keep",
+         "shortcut": "Ctrl+Shift+K",
+         "status_tip": "Set the direction of all selected nodes to keep",
+         "triggered": lambda: self.map_manager.set_selected_direction("keep")}
+    ]
+    for item in editmenu_items:
+      action = QAction(item["name"], self)
+      action.setShortcut(item["shortcut"])
+      action.setStatusTip(item["status_tip"])
+      action.triggered.connect(item["triggered"])
+      self.addAction(action)
+
+    # new nodes are connected to the last node by a collision-free path
+    self.addSeparator()
+    auto_route_action = QAction("Auto Route", self)
+    auto_route_action.setShortcut("Ctrl+R")
+    auto_route_action.setStatusTip("Route new nodes around obstacles")
+    auto_route_action.setCheckable(True)
+    auto_route_action.setChecked(self.main_window.setting_manager.stgs["map_manager"]["auto_route"]["enabled"])
+    auto_route_action.toggled.connect(self.set_auto_route)
+    self.addAction(auto_route_action)
+
+  def set_auto_route(self, checked):
+    self.main_window.setting_manager.stgs["map_manager"]["auto_route"]["enabled"] = checked
+
+  def delete_selected(self):
+    self.main_window.map_widget.graphics_view.delete_selected_event()
 
 class ViewMenu(QMenu):
   def __init__(self, main_window, parent=None):
     super().__init__("&View", parent=parent)
     self.main_window = main_window
 
+    # performance instrumentation (see profiler.py)
+    overlay_action = QAction("Show Performance Overlay", self)
+    overlay_action.setShortcut("Ctrl+Shift+P")
+    overlay_action.setStatusTip("Show the frame time and input latency of the map view")
+    overlay_action.setCheckable(True)
+    overlay_action.toggled.connect(self.main_window.map_widget.graphics_view.set_perf_overlay)
+    self.addAction(overlay_action)
+
+    record_action = QAction("Record Timings", self)
+    record_action.setStatusTip("Record the wall time and call count of the instrumented functions")
+    record_action.setCheckable(True)
+    record_action.setChecked(profiler.enabled)
+    record_action.toggled.connect(self.set_recording)
+    self.addAction(record_action)
+
+    viewmenu_items = [
+        {"name": "Profile Next Operation",
+         "shortcut": "Ctrl+Shift+R",
+         "status_tip": "Run the next instrumented operation under cProfile",
+         "triggered": self.profile_next},
+        {"name": "Export Timings",
+         "shortcut": "",
+         "status_tip": "Save the recorded timings as JSON",
+         "triggered": self.export_timings},
+        {"name": "Reset Timings",
+         "shortcut": "",
+         "status_tip": "Clear the recorded timings",
+         "triggered": profiler.reset}
+    ]
+    for item in viewmenu_items:
+      action = QAction(item["name"], self)
+      action.setShortcut(item["shortcut"])
+      action.setStatusTip(item["status_tip"])
+      action.triggered.connect(item["triggered"])
+      self.addAction(action)
+
+  def set_recording(self, checked):
+    profiler.enabled = checked
+    logger.info("Record timings %s", "on" if checked else "off")
+
+  def profile_next(self):
+    profiler.arm_capture()
+    logger.info("Profile the next operation")
+
+  def export_timings(self):
+    crt_dir = self.main_window.crt_dir
+    date_str = datetime.datetime.now().strftime("%Y%m%d-%H%M")
+    default_path = os.path.join(crt_dir, "timings-" + date_str + ".json")
+    fname, _ = QFileDialog.getSaveFileName(None, "Export Timings", default_path, "JSON Files (*.json)")
+    if fname == "":
+      return
+    try:
+      profiler.save(fname)
+    except OSError as e:
+      logger.error("Can't write %s: %s", fname, e)
+      return
+    logger.info("Export timings to %s", fname)
+
 class HelpMenu(QMenu):
   def __init__(self, main_window, parent=None):
     super().__init__("&Help", parent=parent)
     self.main_window = main_window
+    self.log_dialog = None
+
+    show_log_action = QAction("Show Log", self)
+    show_log_action.setShortcut("Ctrl+L")
+    show_log_action.setStatusTip("Show the recent log messages")
+    show_log_action.triggered.connect(self.show_log)
+    self.addAction(show_log_action)
+
+  def show_log(self):
+    if self.log_dialog is None:
+      self.log_dialog = LogDialog(self.main_window, parent=self.main_window)
+    self.log_dialog.refresh()
+    self.log_dialog.show()
+    self.log_dialog.raise_()
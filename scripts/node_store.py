@@ -0,0 +1,317 @@
+import numpy as np
+import yaml
+import os
+
+# libyaml bindings are much faster, fall back to the pure python ones if missing
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
+
+# NOTE: direction strings are stored as small integer codes,
+# unknown directions get a new code so that saving stays lossless
+DIRECTION_NAMES = ["head", "keep"]
+HEAD = 0
+KEEP = 1
+
+NODE_KEYS = ("id", "pose", "type")
+POSE_KEYS = ("x", "y", "direction")
+
+SIDECAR_VERSION = 1
+SIDECAR_COLUMNS = ("id", "x", "y", "direction", "type")
+
+# column-oriented storage of the route, rows are in route order
+# x, y: map coordinates [m], x_p, y_p: scene pixel coordinates
+class NodeStore():
+    COLUMNS = {
+        "id": np.int64,
+        "x": np.float64,
+        "y": np.float64,
+        "x_p": np.float64,
+        "y_p": np.float64,
+        "angle": np.float64,
+        "direction": np.int16,
+        "type": np.int64
+    }
+
+    def __init__(self, capacity=64):
+        self.size = 0
+        self.capacity = capacity
+        self.data = {name: np.zeros(capacity, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        self.row_of = {}                # id -> row
+        self.next_id = 0                # high-water mark of the used ids
+        self.extra = {}                 # id -> unknown keys of the node dict
+        self.extra_pose = {}            # id -> unknown keys of the pose dict
+        self.direction_names = list(DIRECTION_NAMES)
+        self.direction_codes = {name: code for code, name in enumerate(self.direction_names)}
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, node_id):
+        return node_id in self.row_of
+
+    # views of the used part of each column
+    def __getitem__(self, name):
+        return self.data[name][:self.size]
+
+    # O(1) id allocation, ids of deleted nodes are not reused
+    def allocate_id(self):
+        node_id = self.next_id
+        self.next_id += 1
+        return node_id
+
+    def direction_code(self, direction):
+        if direction not in self.direction_codes:
+            self.direction_codes[direction] = len(self.direction_names)
+            self.direction_names.append(direction)
+        return self.direction_codes[direction]
+
+    def direction_name(self, code):
+        return self.direction_names[code]
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, 2 * self.capacity)
+        for name, column in self.data.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.data[name] = grown
+        self.capacity = capacity
+
+    def get(self, name, row):
+        return self.data[name][row].item()
+
+    def set(self, name, row, value):
+        self.data[name][row] = value
+
+    def insert(self, row, node_id, x, y, x_p, y_p, direction, node_type):
+        if node_id in self.row_of:
+            raise KeyError(f"Duplicate node id: {node_id}")
+        self.reserve(self.size + 1)
+        values = {
+            "id": node_id,
+            "x": x,
+            "y": y,
+            "x_p": x_p,
+            "y_p": y_p,
+            "angle": 0,
+            "direction": self.direction_code(direction),
+            "type": node_type
+        }
+        for name, column in self.data.items():
+            column[row + 1:self.size + 1] = column[row:self.size]
+            column[row] = values[name]
+        self.size += 1
+        self.next_id = max(self.next_id, node_id + 1)
+        self.reindex(row)
+        return row
+
+    # insert a node dict of the elements file schema (unknown keys are kept)
+    def insert_node(self, row, node, x_p, y_p):
+        pose = node["pose"]
+        self.insert(row, node["id"], pose["x"], pose["y"], x_p, y_p, pose["direction"], node.get("type", 1))
+        self.set_extra(node)
+        return row
+
+    # batch version of insert_node(), rows are the rows after insertion in ascending order
+    def insert_nodes(self, rows, nodes, x_p, y_p):
+        ids = [node["id"] for node in nodes]
+        if len(set(ids)) != len(ids) or any(node_id in self.row_of for node_id in ids):
+            raise KeyError("Duplicate node id")
+        size = self.size + len(rows)
+        self.reserve(size)
+        inserted = np.zeros(size, dtype=bool)
+        inserted[rows] = True
+        values = {
+            "id": ids,
+            "x": [node["pose"]["x"] for node in nodes],
+            "y": [node["pose"]["y"] for node in nodes],
+            "x_p": x_p,
+            "y_p": y_p,
+            "angle": 0,
+            "direction": [self.direction_code(node["pose"]["direction"]) for node in nodes],
+            "type": [node.get("type", 1) for node in nodes]
+        }
+        for name, column in self.data.items():
+            column[:size][~inserted] = column[:self.size].copy()
+            column[:size][inserted] = values[name]
+        self.size = size
+        for node in nodes:
+            self.set_extra(node)
+        if len(ids) != 0:
+            self.next_id = max(self.next_id, max(ids) + 1)
+            self.reindex(rows[0])
+
+    def append(self, node_id, x, y, x_p, y_p, direction, node_type):
+        return self.insert(self.size, node_id, x, y, x_p, y_p, direction, node_type)
+
+    def delete(self, row):
+        node_id = self.get("id", row)
+        for column in self.data.values():
+            column[row:self.size - 1] = column[row + 1:self.size]
+        self.size -= 1
+        del self.row_of[node_id]
+        self.extra.pop(node_id, None)
+        self.extra_pose.pop(node_id, None)
+        self.reindex(row)
+
+    # batch version of delete()
+    def delete_rows(self, rows):
+        if len(rows) == 0:
+            return
+        keep = np.ones(self.size, dtype=bool)
+        keep[rows] = False
+        for node_id in self.data["id"][rows].tolist():
+            del self.row_of[node_id]
+            self.extra.pop(node_id, None)
+            self.extra_pose.pop(node_id, None)
+        size = int(keep.sum())
+        for column in self.data.values():
+            column[:size] = column[:self.size][keep]
+        self.size = size
+        self.reindex(int(np.min(rows)))
+
+    # rows after start moved, refresh their id -> row entries
+    def reindex(self, start=0):
+        ids = self.data["id"][start:self.size].tolist()
+        self.row_of.update(zip(ids, range(start, self.size)))
+
+    # bulk load from the node dicts of an elements file
+    def extend(self, nodes, x_p=0, y_p=0):
+        start = self.size
+        n = len(nodes)
+        self.reserve(start + n)
+        ids = [node["id"] for node in nodes]
+        if len(set(ids)) != n or any(node_id in self.row_of for node_id in ids):
+            raise KeyError("Duplicate node id")
+        self.data["id"][start:start + n] = ids
+        self.data["x"][start:start + n] = [node["pose"]["x"] for node in nodes]
+        self.data["y"][start:start + n] = [node["pose"]["y"] for node in nodes]
+        self.data["x_p"][start:start + n] = x_p
+        self.data["y_p"][start:start + n] = y_p
+        self.data["angle"][start:start + n] = 0
+        self.data["direction"][start:start + n] = [self.direction_code(node["pose"]["direction"]) for node in nodes]
+        self.data["type"][start:start + n] = [node.get("type", 1) for node in nodes]
+        for node in nodes:
+            self.set_extra(node)
+        self.size += n
+        if n != 0:
+            self.next_id = max(self.next_id, max(ids) + 1)
+        self.reindex(start)
+
+    # keep the unknown keys of a node dict for lossless saving
+    def set_extra(self, node):
+        extra = {key: value for key, value in node.items() if key not in NODE_KEYS}
+        if extra:
+            self.extra[node["id"]] = extra
+        extra_pose = {key: value for key, value in node["pose"].items() if key not in POSE_KEYS}
+        if extra_pose:
+            self.extra_pose[node["id"]] = extra_pose
+
+    # node dict in the elements file schema
+    def to_dict(self, row):
+        node_id = self.get("id", row)
+        node = {
+            "id": node_id,
+            "pose": {
+                "x": self.get("x", row),
+                "y": self.get("y", row),
+                "direction": self.direction_name(self.get("direction", row))
+            },
+            "type": self.get("type", row)
+        }
+        if node_id in self.extra_pose:
+            node["pose"].update(self.extra_pose[node_id])
+        if node_id in self.extra:
+            node.update(self.extra[node_id])
+        return node
+
+    # column-wise version of to_dict() for saving
+    def to_dicts(self):
+        ids = self["id"].tolist()
+        xs = self["x"].tolist()
+        ys = self["y"].tolist()
+        directions = [self.direction_names[code] for code in self["direction"].tolist()]
+        types = self["type"].tolist()
+        nodes = []
+        for node_id, x, y, direction, node_type in zip(ids, xs, ys, directions, types):
+            node = {
+                "id": node_id,
+                "pose": {
+                    "x": x,
+                    "y": y,
+                    "direction": direction
+                },
+                "type": node_type
+            }
+            if node_id in self.extra_pose:
+                node["pose"].update(self.extra_pose[node_id])
+            if node_id in self.extra:
+                node.update(self.extra[node_id])
+            nodes.append(node)
+        return nodes
+
+# NOTE: binary sidecar of an elements file ("<elements>.yaml.npz")
+# holds the node columns, so large routes load without parsing the yaml
+def sidecar_path_of(elements_path):
+    return elements_path + ".npz"
+
+def is_sidecar_fresh(elements_path, sidecar_path):
+    if not os.path.exists(sidecar_path):
+        return False
+    if not os.path.exists(elements_path):
+        return True
+    return os.path.getmtime(sidecar_path) >= os.path.getmtime(elements_path)
+
+def save_sidecar(sidecar_path, nodes, occ_map_name):
+    arrays = {name: nodes[name] for name in SIDECAR_COLUMNS}
+    arrays["version"] = np.array(SIDECAR_VERSION)
+    arrays["direction_names"] = np.array(nodes.direction_names, dtype=str)
+    arrays["occ_map_name"] = np.array("" if occ_map_name is None else occ_map_name, dtype=str)
+    arrays["has_occ_map_name"] = np.array(occ_map_name is not None)
+    # unknown keys are rare, keep them as yaml text to stay lossless
+    extra = {"extra": nodes.extra, "extra_pose": nodes.extra_pose}
+    arrays["extra"] = np.array(yaml.dump(extra, Dumper=YamlDumper), dtype=str)
+
+    # write to a temporary file first so an interrupted save never leaves a broken sidecar
+    tmp_path = sidecar_path + ".tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, sidecar_path)
+
+def peek_sidecar_map_name(sidecar_path):
+    # np.load is lazy, only the two small arrays are read
+    with np.load(sidecar_path, allow_pickle=False) as data:
+        if not bool(data["has_occ_map_name"]):
+            return None
+        return str(data["occ_map_name"])
+
+def load_sidecar(sidecar_path):
+    with np.load(sidecar_path, allow_pickle=False) as data:
+        version = int(data["version"])
+        if version != SIDECAR_VERSION:
+            raise ValueError(f"Unsupported sidecar version: {version}")
+        columns = {name: data[name] for name in SIDECAR_COLUMNS}
+        direction_names = data["direction_names"].tolist()
+        occ_map_name = str(data["occ_map_name"]) if bool(data["has_occ_map_name"]) else None
+        extra = yaml.load(str(data["extra"]), Loader=YamlLoader)
+
+    n = len(columns["id"])
+    if any(len(column) != n for column in columns.values()):
+        raise ValueError("Inconsistent column length")
+
+    nodes = NodeStore(capacity=max(n, 64))
+    for name, column in columns.items():
+        nodes.data[name][:n] = column
+    nodes.size = n
+    nodes.direction_names = direction_names
+    nodes.direction_codes = {name: code for code, name in enumerate(direction_names)}
+    nodes.extra = extra["extra"]
+    nodes.extra_pose = extra["extra_pose"]
+    nodes.reindex()
+    if len(nodes.row_of) != n:
+        raise ValueError("Duplicate node id")
+    if n != 0:
+        nodes.next_id = int(columns["id"].max()) + 1
+    return occ_map_name, nodes
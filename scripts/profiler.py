@@ -0,0 +1,119 @@
+import os
+import io
+import json
+import time
+import datetime
+import threading
+import functools
+import cProfile
+import pstats
+import logging
+
+ENV_VAR = "BRUSHEE_PROFILE"     # "1" enables the instrumentation regardless of the settings
+CAPTURE_LINES = 25              # lines of the cProfile summary written to the log
+
+logger = logging.getLogger(__name__)
+
+# NOTE: wall-time and call counts of the functions decorated with @timed,
+# disabled by default (a disabled call costs one attribute check)
+# the stats are keyed by the qualified name of the function, e.g. "MapManager.load_map"
+class Profiler():
+    def __init__(self):
+        # class variable initialization
+        self.enabled = False
+        self.capture_dir = None
+        self.stats = {}     # name -> [count, total, max] in seconds
+        self.lock = threading.Lock()    # maps are decoded on worker threads
+        self.local = threading.local()
+        self.is_capture_armed = False
+
+    def configure(self, sm):
+        self.enabled = bool(sm["enabled"]) or os.environ.get(ENV_VAR, "0") not in ("", "0")
+        capture_dir = sm["capture_dir"]
+        if capture_dir is None:
+            capture_dir = os.path.join(os.path.expanduser("~"), ".cache", "brushee_gui", "profiles")
+        self.capture_dir = capture_dir
+
+    def record(self, name, elapsed):
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                self.stats[name] = [1, elapsed, elapsed]
+            else:
+                stat[0] += 1
+                stat[1] += elapsed
+                if elapsed > stat[2]:
+                    stat[2] = elapsed
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    # {name: {"count", "total_ms", "mean_ms", "max_ms"}} sorted by total time
+    def to_dict(self):
+        with self.lock:
+            stats = {name: list(stat) for name, stat in self.stats.items()}
+        return {name: {"count": count,
+                       "total_ms": total * 1000,
+                       "mean_ms": total / count * 1000,
+                       "max_ms": maximum * 1000}
+                for name, (count, total, maximum) in sorted(stats.items(), key=lambda item: -item[1][1])}
+
+    def save(self, path):
+        result = {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "stats": self.to_dict()
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(result, file, indent=2)
+        os.replace(tmp_path, path)
+
+    # the next outermost @timed call on the Qt thread runs under cProfile
+    def arm_capture(self):
+        self.is_capture_armed = True
+
+    def call(self, name, function, args, kwargs):
+        depth = getattr(self.local, "depth", 0)
+        capture = (self.is_capture_armed and depth == 0 and threading.current_thread() is threading.main_thread())
+        if capture:
+            self.is_capture_armed = False
+            profile = cProfile.Profile()
+        self.local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            if capture:
+                return profile.runcall(function, *args, **kwargs)
+            return function(*args, **kwargs)
+        finally:
+            if self.enabled:
+                self.record(name, time.perf_counter() - start)
+            self.local.depth = depth
+            if capture:
+                self.save_capture(name, profile)
+
+    def save_capture(self, name, profile):
+        date_str = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.capture_dir, f"{name}-{date_str}.prof")
+        try:
+            os.makedirs(self.capture_dir, exist_ok=True)
+            profile.dump_stats(path)
+        except OSError as e:
+            logger.error("Can't write %s: %s", path, e)
+            path = None
+
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(CAPTURE_LINES)
+        logger.info("Profile of %s (saved to %s)\n%s", name, path, summary.getvalue())
+
+profiler = Profiler()
+
+def timed(function):
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not profiler.enabled and not profiler.is_capture_armed:
+            return function(*args, **kwargs)
+        return profiler.call(name, function, args, kwargs)
+    return wrapper
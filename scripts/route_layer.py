@@ -0,0 +1,335 @@
+from PyQt5.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+from PyQt5.QtGui import QPolygonF, QPen, QBrush, QColor
+from PyQt5.QtCore import Qt, QRectF, QPointF, QTimer
+import numpy as np
+
+# NOTE: "batched" render mode, one item paints the whole route from MapManager.nodes
+# node_items / edge_items of MapManager hold the handles below instead of scene items,
+# so the editing code is the same in both render modes
+# when zoomed out (in both render modes) the layer paints an overview instead of the nodes:
+# a decimated polyline, nodes as points and dense areas as cluster markers with counts
+class RouteLayer(QGraphicsItem):
+    def __init__(self, graphics_view, map_manager, triangle_base, is_batched, parent=None):
+        super().__init__(parent)
+        # class variable initialization
+        self.graphics_view = graphics_view
+        self.map_manager = map_manager
+        self.sm = graphics_view.sm["lod"]
+        self.edge_pen = graphics_view.edge_pen
+        self.triangle_base = triangle_base  # [px]
+        self.is_batched = is_batched
+        self.bounds = QRectF()
+        self.is_bounds_dirty = False
+
+        # cosmetic pens (width in screen pixels) for the overview
+        self.overview_edge_pen = QPen(self.edge_pen)
+        self.overview_edge_pen.setCosmetic(True)
+        self.overview_unsafe_edge_pen = QPen(graphics_view.unsafe_edge_pen)
+        self.overview_unsafe_edge_pen.setCosmetic(True)
+        self.point_pens = {}
+        self.cluster_pen = QPen(QColor(self.sm["cluster_pen"]))
+        self.cluster_pen.setCosmetic(True)
+        self.cluster_brush = QBrush(QColor(self.sm["cluster_brush"]))
+
+        # item setting
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+        self.setZValue(1)
+
+    def boundingRect(self):
+        return self.bounds
+
+    # nodes smaller than node_min_size on screen are not drawn in detail
+    def is_overview(self, scale):
+        return self.triangle_base * scale < self.sm["node_min_size"]
+
+    # called on every change of the route, the bounds are recomputed once per event loop iteration
+    def mark_dirty(self):
+        if not self.is_bounds_dirty:
+            self.is_bounds_dirty = True
+            QTimer.singleShot(0, self.refresh_bounds)
+        self.update()
+
+    def refresh_bounds(self):
+        self.is_bounds_dirty = False
+        nodes = self.map_manager.nodes
+        if len(nodes) == 0:
+            bounds = QRectF()
+        else:
+            pad = self.triangle_base
+            x_p = nodes["x_p"]
+            y_p = nodes["y_p"]
+            x_min, x_max = float(x_p.min()), float(x_p.max())
+            y_min, y_max = float(y_p.min()), float(y_p.max())
+            bounds = QRectF(x_min - pad, y_min - pad, x_max - x_min + 2 * pad, y_max - y_min + 2 * pad)
+        if bounds != self.bounds:
+            self.prepareGeometryChange()
+            self.bounds = bounds
+        self.update()
+
+    def paint(self, painter, option, widget=None):
+        nodes = self.map_manager.nodes
+        if len(nodes) == 0:
+            return
+        rect = option.exposedRect
+        if painter.hasClipping():
+            # QGraphicsView.render() exposes the whole item and clips instead
+            rect = rect.intersected(painter.clipBoundingRect())
+        scale = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        if self.is_overview(scale):
+            self.paint_overview(painter, rect, scale)
+        elif self.is_batched:
+            self.paint_nodes(painter, rect)
+
+    def paint_nodes(self, painter, rect):
+        nodes = self.map_manager.nodes
+        left, top, right, bottom = rect.left(), rect.top(), rect.right(), rect.bottom()
+        x_p = nodes["x_p"]
+        y_p = nodes["y_p"]
+
+        # edges crossing the exposed rect, one drawLines call
+        self.paint_edges(painter, rect, x_p, y_p, self.edge_pen)
+        self.paint_unsafe_edges(painter, rect, self.graphics_view.unsafe_edge_pen)
+
+        # nodes in the exposed rect, grouped by style so pen and brush are set once per style
+        pad = self.triangle_base
+        visible = (x_p >= left - pad) & (x_p <= right + pad) & (y_p >= top - pad) & (y_p <= bottom + pad)
+        rows = np.nonzero(visible)[0]
+        if len(rows) == 0:
+            return
+        triangles = rotated_triangles(x_p[rows], y_p[rows], nodes["angle"][rows], self.triangle_base)
+        node_items = self.map_manager.node_items
+        groups = {}
+        for i, row in enumerate(rows.tolist()):
+            handle = node_items[row]
+            key = (id(handle.node_pen), id(handle.node_brush))
+            if key not in groups:
+                groups[key] = (handle.node_pen, handle.node_brush, [])
+            groups[key][2].append(i)
+        for pen, brush, group in groups.values():
+            painter.setPen(pen)
+            painter.setBrush(brush)
+            draw_triangles(painter, triangles[group])
+
+    def paint_edges(self, painter, rect, x_p, y_p, pen):
+        if len(x_p) < 2:
+            return
+        self.paint_segments(painter, rect, x_p[:-1], y_p[:-1], x_p[1:], y_p[1:], pen)
+
+    # segments crossing rect, one drawLines call
+    def paint_segments(self, painter, rect, x_0, y_0, x_1, y_1, pen):
+        visible = ((np.minimum(x_0, x_1) <= rect.right()) & (np.maximum(x_0, x_1) >= rect.left()) &
+                   (np.minimum(y_0, y_1) <= rect.bottom()) & (np.maximum(y_0, y_1) >= rect.top()))
+        rows = np.nonzero(visible)[0]
+        if len(rows) == 0:
+            return
+        point_pairs = np.stack([x_0[rows], y_0[rows], x_1[rows], y_1[rows]], axis=-1).reshape(-1, 2)
+        painter.setPen(pen)
+        painter.drawLines(points_to_polygon(point_pairs))
+
+    # edges too close to obstacles (MapManager.unsafe_edges) on top of the others
+    def paint_unsafe_edges(self, painter, rect, pen):
+        if len(self.map_manager.unsafe_edges) == 0:
+            return
+        nodes = self.map_manager.nodes
+        rows = np.array([nodes.row_of[node_id] for node_id in self.map_manager.unsafe_edges], dtype=np.int64)
+        x_p = nodes["x_p"]
+        y_p = nodes["y_p"]
+        self.paint_segments(painter, rect, x_p[rows], y_p[rows], x_p[rows + 1], y_p[rows + 1], pen)
+
+    def paint_overview(self, painter, rect, scale):
+        nodes = self.map_manager.nodes
+        x_p = nodes["x_p"]
+        y_p = nodes["y_p"]
+
+        # decimated polyline, consecutive nodes on the same screen pixel are merged
+        # NOTE: one drawPolyline() is much faster than drawLines() with the same segments
+        if len(nodes) > 1:
+            q_x = np.floor(x_p * scale)
+            q_y = np.floor(y_p * scale)
+            kept = np.ones(len(nodes), dtype=bool)
+            kept[1:-1] = (q_x[1:-1] != q_x[:-2]) | (q_y[1:-1] != q_y[:-2])
+            painter.setPen(self.overview_edge_pen)
+            painter.drawPolyline(points_to_polygon(np.stack([x_p[kept], y_p[kept]], axis=-1)))
+        self.paint_unsafe_edges(painter, rect, self.overview_unsafe_edge_pen)
+
+        # nodes sharing a screen cell with many others are drawn as one cluster marker
+        # NOTE: the cells are anchored at the scene origin (not at rect), so a partial repaint
+        # sees the same clusters, and every cell a marker reaching into rect may come from
+        # is gathered whole (rect padded by the largest marker radius, rounded out to cells)
+        cell_size = self.sm["cluster_cell_size"] / scale
+        font_metrics = painter.fontMetrics()
+        pad = self.marker_radius(font_metrics, cluster_label(len(nodes))) / scale
+        x_min = np.floor((rect.left() - pad) / cell_size) * cell_size
+        y_min = np.floor((rect.top() - pad) / cell_size) * cell_size
+        x_max = np.ceil((rect.right() + pad) / cell_size) * cell_size
+        y_max = np.ceil((rect.bottom() + pad) / cell_size) * cell_size
+        visible = (x_p >= x_min) & (x_p < x_max) & (y_p >= y_min) & (y_p < y_max)
+        rows = np.nonzero(visible)[0]
+        if len(rows) == 0:
+            return
+        cell_x = np.floor(x_p[rows] / cell_size).astype(np.int64)
+        cell_y = np.floor(y_p[rows] / cell_size).astype(np.int64)
+        cell_x -= cell_x.min()
+        cell_y -= cell_y.min()
+        cells = cell_y * (int(cell_x.max()) + 1) + cell_x
+        _, cell_of, counts = np.unique(cells, return_inverse=True, return_counts=True)
+        is_clustered = counts[cell_of] >= self.sm["cluster_min_count"]
+
+        # the other nodes are points in the color of their style
+        point_rows = rows[~is_clustered]
+        styles = nodes["direction"][point_rows].astype(np.int64)
+        if len(self.map_manager.selected_ids) != 0:
+            is_selected = np.isin(nodes["id"][point_rows], list(self.map_manager.selected_ids))
+            styles[is_selected] = -1
+        for style in np.unique(styles).tolist():
+            group = point_rows[styles == style]
+            painter.setPen(self.point_pen(style))
+            painter.drawPoints(points_to_polygon(np.stack([x_p[group], y_p[group]], axis=-1)))
+
+        clusters = np.nonzero(counts >= self.sm["cluster_min_count"])[0]
+        if len(clusters) == 0:
+            return
+        clustered_cells = cell_of[is_clustered]
+        clustered_rows = rows[is_clustered]
+        n_cells = len(counts)
+        c_x = np.bincount(clustered_cells, weights=x_p[clustered_rows], minlength=n_cells)[clusters] / counts[clusters]
+        c_y = np.bincount(clustered_cells, weights=y_p[clustered_rows], minlength=n_cells)[clusters] / counts[clusters]
+
+        # markers have a fixed screen size, so they are drawn in device coordinates
+        transform = painter.worldTransform()
+        markers = []
+        for x, y, count in zip(c_x.tolist(), c_y.tolist(), counts[clusters].tolist()):
+            label = cluster_label(count)
+            markers.append((transform.map(QPointF(x, y)), self.marker_radius(font_metrics, label), label))
+        painter.save()
+        painter.resetTransform()
+        painter.setPen(self.cluster_pen)
+        painter.setBrush(self.cluster_brush)
+        for center, radius, _ in markers:
+            painter.drawEllipse(center, radius, radius)
+        # counts after all markers, so that overlapping markers do not hide them
+        for center, radius, label in markers:
+            painter.drawText(QRectF(center.x() - radius, center.y() - radius, 2 * radius, 2 * radius),
+                             Qt.AlignCenter, label)
+        painter.restore()
+
+    # [device px] the marker grows so that the count fits
+    def marker_radius(self, font_metrics, label):
+        return max(self.sm["cluster_marker_size"], font_metrics.horizontalAdvance(label) + 8) / 2
+
+    # style -1 is the selection, others are direction codes
+    def point_pen(self, style):
+        if style not in self.point_pens:
+            if style == -1:
+                pen, _ = self.graphics_view.selection_style()
+            else:
+                pen, _ = self.graphics_view.node_style(self.map_manager.nodes.direction_name(style))
+            point_pen = QPen(pen.color())
+            point_pen.setWidthF(self.sm["point_size"])
+            point_pen.setCosmetic(True)
+            self.point_pens[style] = point_pen
+        return self.point_pens[style]
+
+# stand-in for the QGraphicsPolygonItem of a node, only its style is kept here
+# (position and heading are read from the node store when painting)
+class NodeHandle():
+    __slots__ = ("layer", "node_pen", "node_brush")
+
+    def __init__(self, layer, pen, brush):
+        self.layer = layer
+        self.node_pen = pen
+        self.node_brush = brush
+
+    def pen(self):
+        return self.node_pen
+
+    def brush(self):
+        return self.node_brush
+
+    def setPen(self, pen):
+        self.node_pen = pen
+        self.layer.update()
+
+    def setBrush(self, brush):
+        self.node_brush = brush
+        self.layer.update()
+
+    def setRotation(self, angle):
+        self.layer.update()
+
+    def moveBy(self, dx, dy):
+        self.layer.update()
+
+    def setTransformOriginPoint(self, x, y):
+        pass
+
+    def update(self):
+        self.layer.update()
+
+    def hide(self):
+        self.layer.update()
+
+# stand-in for the QGraphicsLineItem of an edge
+class EdgeHandle():
+    __slots__ = ("layer",)
+
+    def __init__(self, layer):
+        self.layer = layer
+
+    def setLine(self, *line):
+        self.layer.update()
+
+    # unsafe edges are painted from MapManager.unsafe_edges
+    def setPen(self, pen):
+        self.layer.update()
+
+    def hide(self):
+        self.layer.update()
+
+# count shown on a cluster marker
+def cluster_label(count):
+    return str(count) if count < 1000 else f"{count // 1000}k"
+
+# node triangles rotated by their heading around the node, shape (n, 3, 2) as (top, left, right)
+# NOTE: same geometry as a node item of MapGraphicsView.draw_nodes() after setRotation()
+def rotated_triangles(x_p, y_p, angle, triangle_base):
+    offsets = np.array([[0, -triangle_base],
+                        [-triangle_base/2, triangle_base/2],
+                        [triangle_base/2, triangle_base/2]])
+    cos = np.cos(angle)[:, None]
+    sin = np.sin(angle)[:, None]
+    x = np.asarray(x_p)[:, None] + offsets[:, 0] * cos - offsets[:, 1] * sin
+    y = np.asarray(y_p)[:, None] + offsets[:, 0] * sin + offsets[:, 1] * cos
+    return np.stack([x, y], axis=-1)
+
+# QPolygonF filled with a single copy, points has shape (n, 2)
+def points_to_polygon(points):
+    polygon = QPolygonF(len(points))
+    buffer = polygon.data()
+    buffer.setsize(len(points) * 2 * 8)
+    np.frombuffer(buffer, dtype=np.float64)[:] = np.ascontiguousarray(points, dtype=np.float64).ravel()
+    return polygon
+
+# NOTE: QPainter has no call for many polygons, the triangles are copied into one QPolygonF
+# and drawn one by one from slices of it (faster than one QPainterPath of all the triangles,
+# and overlapping triangles are painted like separate node items)
+def draw_triangles(painter, triangles):
+    polygon = points_to_polygon(triangles.reshape(-1, 2))
+    for i in range(0, len(polygon), 3):
+        painter.drawPolygon(polygon.mid(i, 3))
+
+def point_in_triangle(x, y, triangle):
+    (x_a, y_a), (x_b, y_b), (x_c, y_c) = triangle
+    d_1 = (x - x_b) * (y_a - y_b) - (x_a - x_b) * (y - y_b)
+    d_2 = (x - x_c) * (y_b - y_c) - (x_b - x_c) * (y - y_c)
+    d_3 = (x - x_a) * (y_c - y_a) - (x_c - x_a) * (y - y_a)
+    has_neg = d_1 < 0 or d_2 < 0 or d_3 < 0
+    has_pos = d_1 > 0 or d_2 > 0 or d_3 > 0
+    return not (has_neg and has_pos)
+
+def point_segment_distance(x, y, x_0, y_0, x_1, y_1):
+    dx = x_1 - x_0
+    dy = y_1 - y_0
+    length_2 = dx**2 + dy**2
+    t = 0 if length_2 == 0 else min(max(((x - x_0) * dx + (y - y_0) * dy) / length_2, 0), 1)
+    return ((x - x_0 - t * dx)**2 + (y - y_0 - t * dy)**2) ** 0.5
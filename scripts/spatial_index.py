@@ -0,0 +1,91 @@
+from collections import defaultdict
+import math
+
+# NOTE: uniform grid in scene pixel coordinates
+# each object is registered in every cell its (padded) shape overlaps,
+# so a point query only has to look at the single cell containing the point
+class SpatialIndex():
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(set)
+        self.obj_cells = {}
+        self.obj_priority = {}
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.obj_cells)
+
+    def __contains__(self, obj):
+        return obj in self.obj_cells
+
+    def cell_of(self, x, y):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def cells_in_rect(self, x0, y0, x1, y1):
+        cx0, cy0 = self.cell_of(min(x0, x1), min(y0, y1))
+        cx1, cy1 = self.cell_of(max(x0, x1), max(y0, y1))
+        return {(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)}
+
+    def cells_on_segment(self, x0, y0, x1, y1, pad):
+        # sample the segment at half a cell and pad each sample
+        length = math.hypot(x1 - x0, y1 - y0)
+        step = self.cell_size / 2
+        n = max(int(math.ceil(length / step)), 1)
+        cells = set()
+        for i in range(n + 1):
+            x = x0 + (x1 - x0) * i / n
+            y = y0 + (y1 - y0) * i / n
+            cells |= self.cells_in_rect(x - pad - step, y - pad - step, x + pad + step, y + pad + step)
+        return cells
+
+    # lower priority is returned first by query(), ties keep insertion order
+    def insert(self, obj, cells, priority=0):
+        if obj in self.obj_cells:
+            self.remove(obj)
+        for cell in cells:
+            self.cells[cell].add(obj)
+        self.obj_cells[obj] = cells
+        self.obj_priority[obj] = (priority, self.counter)
+        self.counter += 1
+
+    def insert_point(self, obj, x, y, pad, priority=0):
+        self.insert(obj, self.cells_in_rect(x - pad, y - pad, x + pad, y + pad), priority)
+
+    def insert_segment(self, obj, x0, y0, x1, y1, pad, priority=0):
+        self.insert(obj, self.cells_on_segment(x0, y0, x1, y1, pad), priority)
+
+    # keep the original ordering when an object only changes its position
+    def move_point(self, obj, x, y, pad):
+        priority = self.obj_priority.get(obj)
+        self.remove(obj)
+        cells = self.cells_in_rect(x - pad, y - pad, x + pad, y + pad)
+        for cell in cells:
+            self.cells[cell].add(obj)
+        self.obj_cells[obj] = cells
+        if priority is None:
+            priority = (0, self.counter)
+            self.counter += 1
+        self.obj_priority[obj] = priority
+
+    def remove(self, obj):
+        cells = self.obj_cells.pop(obj, None)
+        if cells is None:
+            return
+        for cell in cells:
+            bucket = self.cells[cell]
+            bucket.discard(obj)
+            if not bucket:
+                del self.cells[cell]
+        self.obj_priority.pop(obj, None)
+
+    def query(self, x, y):
+        bucket = self.cells.get(self.cell_of(x, y))
+        if not bucket:
+            return []
+        return sorted(bucket, key=self.obj_priority.__getitem__)
+
+    def clear(self):
+        self.cells.clear()
+        self.obj_cells.clear()
+        self.obj_priority.clear()
+        self.counter = 0
@@ -0,0 +1,140 @@
+from collections import deque
+
+# NOTE: every entry stores only what changed (ids, rows and old/new values),
+# never a snapshot of the route, so memory and time per entry do not depend on the route size
+class UndoStack():
+    def __init__(self, depth=1000):
+        self.undo_entries = deque(maxlen=depth)
+        self.redo_entries = []
+        self.is_replaying = False
+
+    @property
+    def can_undo(self):
+        return len(self.undo_entries) != 0
+
+    @property
+    def can_redo(self):
+        return len(self.redo_entries) != 0
+
+    def set_depth(self, depth):
+        self.undo_entries = deque(self.undo_entries, maxlen=depth)
+
+    # entries pushed while replaying are the side effects of undo/redo itself
+    def push(self, delta):
+        if self.is_replaying:
+            return
+        top = self.undo_entries[-1] if self.undo_entries else None
+        if top is not None and top.merge(delta):
+            return
+        self.undo_entries.append(delta)
+        self.redo_entries.clear()
+
+    # stop merging into the last entry (e.g. at the end of a drag)
+    def close(self):
+        if self.undo_entries:
+            self.undo_entries[-1].is_open = False
+
+    def undo(self, map_manager):
+        if not self.can_undo:
+            return None
+        delta = self.undo_entries.pop()
+        delta.is_open = False
+        self.replay(delta.undo, map_manager)
+        self.redo_entries.append(delta)
+        return delta
+
+    def redo(self, map_manager):
+        if not self.can_redo:
+            return None
+        delta = self.redo_entries.pop()
+        self.replay(delta.redo, map_manager)
+        self.undo_entries.append(delta)
+        return delta
+
+    def replay(self, func, map_manager):
+        self.is_replaying = True
+        try:
+            func(map_manager)
+        finally:
+            self.is_replaying = False
+
+    def clear(self):
+        self.undo_entries.clear()
+        self.redo_entries.clear()
+
+class Delta():
+    name = "Edit"
+
+    def __init__(self):
+        self.is_open = False
+
+    def merge(self, delta):
+        return False
+
+    def undo(self, map_manager):
+        raise NotImplementedError
+
+    def redo(self, map_manager):
+        raise NotImplementedError
+
+# nodes is a list of (row, node dict) in ascending row order
+class AddNodesDelta(Delta):
+    name = "Add Node"
+
+    def __init__(self, nodes):
+        super().__init__()
+        self.nodes = nodes
+
+    def undo(self, map_manager):
+        map_manager.delete_nodes([node["id"] for _, node in self.nodes])
+
+    def redo(self, map_manager):
+        map_manager.insert_nodes(self.nodes)
+
+class DeleteNodesDelta(AddNodesDelta):
+    name = "Delete Node"
+
+    def undo(self, map_manager):
+        AddNodesDelta.redo(self, map_manager)
+
+    def redo(self, map_manager):
+        AddNodesDelta.undo(self, map_manager)
+
+# positions are scene pixels, a whole drag is merged into one entry while it is open
+class MoveNodesDelta(Delta):
+    name = "Move Node"
+
+    def __init__(self, ids, old_pos, new_pos, is_open=False):
+        super().__init__()
+        self.ids = ids
+        self.old_pos = old_pos
+        self.new_pos = new_pos
+        self.is_open = is_open
+
+    def merge(self, delta):
+        if not self.is_open or not isinstance(delta, MoveNodesDelta) or delta.ids != self.ids:
+            return False
+        self.new_pos = delta.new_pos
+        self.is_open = delta.is_open
+        return True
+
+    def undo(self, map_manager):
+        map_manager.set_nodes_position(self.ids, self.old_pos)
+
+    def redo(self, map_manager):
+        map_manager.set_nodes_position(self.ids, self.new_pos)
+
+class DirectionDelta(Delta):
+    name = "Change Direction"
+
+    def __init__(self, ids, old_directions, new_directions):
+        super().__init__()
+        self.ids = ids
+        self.old_directions = old_directions
+        self.new_directions = new_directions
+
+    def undo(self, map_manager):
+        map_manager.set_nodes_direction(self.ids, self.old_directions)
+
+    def redo(self, map_manager):
+        map_manager.set_nodes_direction(self.ids, self.new_directions)
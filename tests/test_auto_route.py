@@ -0,0 +1,145 @@
+import heapq
+import math
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+from auto_route import CostMap, cost_to_go, is_connected, BLOCKED
+
+# cost of the cheapest 8-connected route from each cell to goal (x, y), a step costs its length
+# times the mean cost of its two cells, same definition as cost_to_go()
+def dijkstra(cost, goal):
+    h, w = cost.shape
+    d = np.full((h, w), math.inf)
+    gx, gy = goal
+    d[gy, gx] = 0.0
+    heap = [(0.0, gx, gy)]
+    while heap:
+        c, x, y = heapq.heappop(heap)
+        if c > d[y, x]:
+            continue
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                nx, ny = x + dx, y + dy
+                if (dx, dy) == (0, 0) or not (0 <= nx < w and 0 <= ny < h) or math.isinf(cost[ny, nx]):
+                    continue
+                nc = c + math.hypot(dx, dy) * (cost[y, x] + cost[ny, nx]) / 2
+                if nc < d[ny, nx]:
+                    d[ny, nx] = nc
+                    heapq.heappush(heap, (nc, nx, ny))
+    return d
+
+# random costs in [1, 3) with a share of blocked cells
+def random_cost(rng, h, w, blocked_share):
+    cost = 1 + rng.random((h, w)) * 2
+    cost[rng.random((h, w)) < blocked_share] = BLOCKED
+    return cost
+
+def random_free_cell(rng, cost):
+    ys, xs = np.nonzero(np.isfinite(cost))
+    i = rng.integers(len(ys))
+    return int(xs[i]), int(ys[i])
+
+def make_cost_map(cost):
+    cost_map = CostMap.__new__(CostMap)
+    cost_map.cost = cost
+    cost_map.cell_size = 1
+    return cost_map
+
+# True if the segment a - b (scene pixels, cell_size 1) enters the inside of a blocked cell,
+# the segment is clipped to each cell square (touching a corner or a side is not entering)
+def crosses_blocked(cost, a, b):
+    y_0, x_0 = np.nonzero(~np.isfinite(cost))
+    t_enter = np.zeros(len(x_0))
+    t_exit = np.ones(len(x_0))
+    for p, d, low in ((a[0], b[0] - a[0], x_0), (a[1], b[1] - a[1], y_0)):
+        if d == 0:
+            outside = (p <= low) | (p >= low + 1)
+            t_exit[outside] = -1
+            continue
+        t_low, t_high = (low - p) / d, (low + 1 - p) / d
+        t_enter = np.maximum(t_enter, np.minimum(t_low, t_high))
+        t_exit = np.minimum(t_exit, np.maximum(t_low, t_high))
+    return bool((t_exit - t_enter > 1e-9).any())
+
+@pytest.mark.parametrize("seed", range(20))
+def test_cost_to_go_matches_dijkstra(seed):
+    rng = np.random.default_rng(seed)
+    h, w = rng.integers(2, 40, size=2)
+    cost = random_cost(rng, h, w, rng.random() * 0.4)
+    goal = random_free_cell(rng, cost)
+
+    expected = dijkstra(cost, goal)
+    actual = cost_to_go(cost, goal)
+    np.testing.assert_array_equal(np.isinf(actual), np.isinf(expected))
+    finite = np.isfinite(expected)
+    np.testing.assert_allclose(actual[finite], expected[finite], rtol=1e-9)
+
+def test_cost_to_go_turning_back():
+    # a serpentine corridor, the route turns back vertically at every wall
+    cost = np.ones((21, 15))
+    for i, y in enumerate(range(2, 20, 3)):
+        cost[y, :] = BLOCKED
+        cost[y, -1 if i % 2 == 0 else 0] = 1.0
+    expected = dijkstra(cost, (0, 20))
+    actual = cost_to_go(cost, (0, 20))
+    finite = np.isfinite(expected)
+    np.testing.assert_array_equal(np.isfinite(actual), finite)
+    np.testing.assert_allclose(actual[finite], expected[finite], rtol=1e-9)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_is_connected_matches_dijkstra(seed):
+    rng = np.random.default_rng(seed)
+    h, w = rng.integers(2, 40, size=2)
+    cost = random_cost(rng, h, w, 0.3 + rng.random() * 0.3)
+    a = random_free_cell(rng, cost)
+    b = random_free_cell(rng, cost)
+    assert is_connected(np.isfinite(cost), a, b) == bool(np.isfinite(dijkstra(cost, a)[b[1], b[0]]))
+
+def test_is_connected_rejects_split_grid():
+    free = np.ones((10, 12), dtype=bool)
+    free[:, 6] = False
+    assert not is_connected(free, (0, 0), (11, 9))
+    assert is_connected(free, (0, 0), (5, 9))
+    # a diagonal gap is enough for an 8-connected route
+    free[4, 6] = True
+    assert is_connected(free, (0, 0), (11, 9))
+    free[4, 6] = False
+    free[:, 5] = False
+    free[3, 5] = True
+    free[4, 6] = True
+    assert is_connected(free, (0, 0), (11, 9))
+
+def test_plan_walled_off_goal():
+    cost = np.ones((30, 40))
+    # a closed box around the goal
+    cost[10:20, 25] = cost[10:20, 35] = BLOCKED
+    cost[10, 25:36] = cost[19, 25:36] = BLOCKED
+    cost_map = make_cost_map(cost)
+    assert cost_map.plan((2.5, 2.5), (30.5, 15.5), margin=4) is None
+
+@pytest.mark.parametrize("seed", range(20))
+def test_plan_avoids_blocked_cells(seed):
+    rng = np.random.default_rng(seed)
+    h, w = rng.integers(10, 60, size=2)
+    cost = random_cost(rng, h, w, 0.15)
+    # a few walls with a gap
+    for x in rng.integers(1, w - 1, size=3).tolist():
+        cost[:, x] = BLOCKED
+        gap = int(rng.integers(h))
+        cost[gap, x] = 1.0
+    start = random_free_cell(rng, cost)
+    goal = random_free_cell(rng, cost)
+    cost_map = make_cost_map(cost)
+
+    route = cost_map.plan((start[0] + 0.5, start[1] + 0.5), (goal[0] + 0.5, goal[1] + 0.5), margin=2)
+    if not np.isfinite(dijkstra(cost, goal)[start[1], start[0]]):
+        assert route is None
+        return
+    assert route is not None
+    assert route[0] == (start[0] + 0.5, start[1] + 0.5)
+    assert route[-1] == (goal[0] + 0.5, goal[1] + 0.5)
+    for a, b in zip(route[:-1], route[1:]):
+        assert not crosses_blocked(cost, a, b), (a, b)
@@ -0,0 +1,112 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+import map_utils
+from map_utils import read_pgm, write_pgm, patch_pgm, write_journal, row_runs, occupancy_lut
+
+class Crash(Exception):
+    pass
+
+# a P5 pgm of random pixels, its raster, its bytes and the offset of the pixels
+def make_pgm(tmp_path, max_val, shape=(40, 30), seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.integers(0, max_val + 1, size=shape).astype(np.uint8 if max_val < 256 else np.uint16)
+    pgm_path = str(tmp_path / "map.pgm")
+    offset = write_pgm(pgm_path, data, max_val)
+    with open(pgm_path, "rb") as file:
+        original = file.read()
+    return pgm_path, data, original, offset
+
+# a copy of data with the rows of dirty_rows changed
+def edit(data, dirty_rows, max_val):
+    edited = data.copy()
+    edited[dirty_rows] = max_val - edited[dirty_rows]
+    return edited
+
+def read_bytes(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+def test_row_runs():
+    rows = np.array([True, True, False, True, False, False, True])
+    assert row_runs(rows) == [(0, 2), (3, 4), (6, 7)]
+    assert row_runs(np.zeros(5, dtype=bool)) == []
+
+@pytest.mark.parametrize("max_val, negate, unknown_is_occupied",
+                         [(200, 0, True), (200, 1, False), (1000, 0, False), (1000, 1, True)])
+def test_occupancy_lut_out_of_range_is_occupied(max_val, negate, unknown_is_occupied):
+    size = 256 if max_val < 256 else 65536
+    lut = occupancy_lut(max_val, negate, 0.65, 0.196, unknown_is_occupied, size=size)
+    assert len(lut) == size
+    assert lut[max_val + 1:].all()
+    # the occupied and free values of a pgm
+    assert lut[max_val if negate else 0]
+    assert not lut[0 if negate else max_val]
+
+@pytest.mark.parametrize("max_val", [255, 65535])
+def test_patch_writes_only_dirty_rows(tmp_path, max_val):
+    pgm_path, data, original, offset = make_pgm(tmp_path, max_val)
+    dirty_rows = np.zeros(len(data), dtype=bool)
+    dirty_rows[[0, 1, 7, 39]] = True
+    edited = edit(data, dirty_rows, max_val)
+
+    patch_pgm(pgm_path, edited.astype(read_pgm(pgm_path).data.dtype), offset, dirty_rows)
+    assert not os.path.exists(pgm_path + ".journal")
+    assert len(read_bytes(pgm_path)) == len(original)
+    np.testing.assert_array_equal(read_pgm(pgm_path).data, edited)
+
+@pytest.mark.parametrize("max_val", [255, 65535])
+def test_crash_after_patch_is_rolled_back(tmp_path, monkeypatch, max_val):
+    pgm_path, data, original, offset = make_pgm(tmp_path, max_val)
+    dirty_rows = np.zeros(len(data), dtype=bool)
+    dirty_rows[3:9] = True
+    dirty_rows[20] = True
+    edited = edit(data, dirty_rows, max_val)
+
+    # the process dies once the rows are written, before the journal is removed
+    def crash(path):
+        raise Crash(path)
+    monkeypatch.setattr(map_utils.os, "remove", crash)
+    with pytest.raises(Crash):
+        patch_pgm(pgm_path, edited.astype(read_pgm(pgm_path).data.dtype), offset, dirty_rows)
+    monkeypatch.undo()
+    assert os.path.exists(pgm_path + ".journal")
+    assert read_bytes(pgm_path) != original
+
+    np.testing.assert_array_equal(read_pgm(pgm_path).data, data)
+    assert read_bytes(pgm_path) == original
+    assert not os.path.exists(pgm_path + ".journal")
+
+def test_torn_write_is_rolled_back(tmp_path):
+    pgm_path, data, original, offset = make_pgm(tmp_path, 255)
+    row_bytes = data.shape[1]
+    spans = np.array([(offset + 2 * row_bytes, 3 * row_bytes), (offset + 30 * row_bytes, row_bytes)],
+                     dtype=np.int64)
+    originals = [np.frombuffer(original[p:p + n], dtype=np.uint8) for p, n in spans.tolist()]
+    write_journal(pgm_path + ".journal", spans, originals)
+    # only part of the first run reached the file
+    with open(pgm_path, "r+b") as file:
+        file.seek(offset + 2 * row_bytes)
+        file.write(b"\xff" * row_bytes)
+
+    np.testing.assert_array_equal(read_pgm(pgm_path).data, data)
+    assert read_bytes(pgm_path) == original
+
+def test_crash_before_journal_leaves_pgm_untouched(tmp_path, monkeypatch):
+    pgm_path, data, original, offset = make_pgm(tmp_path, 255)
+    dirty_rows = np.zeros(len(data), dtype=bool)
+    dirty_rows[5] = True
+
+    # the journal is written to a temporary file and only then renamed
+    def crash(src, dst):
+        raise Crash(dst)
+    monkeypatch.setattr(map_utils.os, "replace", crash)
+    with pytest.raises(Crash):
+        patch_pgm(pgm_path, edit(data, dirty_rows, 255), offset, dirty_rows)
+    monkeypatch.undo()
+    assert not os.path.exists(pgm_path + ".journal")
+    assert read_bytes(pgm_path) == original
+    np.testing.assert_array_equal(read_pgm(pgm_path).data, data)
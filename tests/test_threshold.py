@@ -0,0 +1,38 @@
+import itertools
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+from map_utils import threshold_lut, threshold_map
+
+# the per-pixel loop of MapManager.convert2pil before the lookup table
+def baseline_threshold(bytes_map, w_p, h_p, max_val, negate, occupied_thresh, free_thresh):
+    map_np = np.zeros((h_p, w_p), dtype=np.uint8)
+    for i in range(len(bytes_map)):
+        if negate:
+            cell = (max_val - bytes_map[i]) / max_val
+        else:
+            cell = bytes_map[i] / max_val
+
+        if cell > occupied_thresh:
+            map_np[i // w_p, i % w_p] = max_val
+        elif cell < free_thresh:
+            map_np[i // w_p, i % w_p] = 0
+        else:
+            map_np[i // w_p, i % w_p] = int(cell * max_val)
+    return map_np
+
+@pytest.mark.parametrize("max_val, negate, occupied_thresh, free_thresh", list(itertools.product(
+    [255, 254, 100], [0, 1], [0.65, 0.5, 0.9, 1.0], [0.196, 0.0, 0.25, 0.5])))
+def test_lut_matches_baseline(max_val, negate, occupied_thresh, free_thresh):
+    # every 8-bit value that can appear in the map, as a 16 x 16 raster
+    values = np.arange(256, dtype=np.uint8)
+    values = np.minimum(values, max_val).astype(np.uint8)
+    expected = baseline_threshold(values.tolist(), 16, 16, max_val, negate, occupied_thresh, free_thresh)
+
+    lut = threshold_lut(max_val, negate, occupied_thresh, free_thresh)
+    np.testing.assert_array_equal(lut[values].reshape(16, 16), expected)
+    raster = values.reshape(16, 16)
+    np.testing.assert_array_equal(threshold_map(raster, max_val, negate, occupied_thresh, free_thresh), expected)